@@ -1,8 +1,12 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, g, has_request_context
 from viewmodels.main_viewmodel import MainViewModel
+from model.storage import RequestCachedStorage, get_default_storage
+from model.price_stream import sse
+from bot_worker import build_scheduler
 import os # Para la clave secreta
 import time # Para añadir el "freno"
 import datetime # Para el reporte y fechas
+import itertools # Para devolver el primer bloque del reporte ya leído
 
 # --- ¡CORRECCIÓN AQUÍ! ---
 # Quitamos template_folder='app/templates' y static_folder='app/static'
@@ -11,7 +15,35 @@ import datetime # Para el reporte y fechas
 app = Flask(__name__)
 
 app.secret_key = os.urandom(24) # Clave segura
-vm = MainViewModel()
+
+
+def _cache_de_peticion():
+    """Caché de lecturas de la petición actual (vive en flask.g y muere con la petición)."""
+    if not has_request_context(): return None
+    if 'storage_cache' not in g: g.storage_cache = {}
+    return g.storage_cache
+
+
+# Lecturas repetidas del mismo perfil/settings dentro de una petición salen de memoria
+vm = MainViewModel(RequestCachedStorage(get_default_storage(), _cache_de_peticion))
+
+# Con 'python app.py', los workers del barrido de backtests (model/backtest_sweep.py,
+# forkserver/spawn) importan este archivo como '__mp_main__': ahí no se arrancan hilos.
+_PROCESO_WEB = __name__ != '__mp_main__'
+
+# --- BOTS AUTOMÁTICOS EN SEGUNDO PLANO ---
+# Por defecto corren en un hilo dentro de la web. Con varios workers de gunicorn
+# usa BOT_SCHEDULER=off y lanza 'python bot_worker.py' como proceso aparte.
+if _PROCESO_WEB and os.environ.get('BOT_SCHEDULER', 'web') == 'web':
+    bot_scheduler = build_scheduler(vm)
+    if bot_scheduler: bot_scheduler.start()
+
+# --- PRECIOS EN VIVO DE KRAKEN (WEBSOCKET) ---
+# KRAKEN_WS=off lo desactiva (get_real_price vuelve a la API REST).
+# KRAKEN_WS_REPLAY=<archivo.jsonl> reproduce mensajes grabados en vez de conectarse.
+if _PROCESO_WEB and os.environ.get('KRAKEN_WS', 'on') == 'on':
+    vm.start_market_feed(replay=os.environ.get('KRAKEN_WS_REPLAY'),
+                         pausa=float(os.environ.get('KRAKEN_WS_REPLAY_PAUSE', 0)))
 
 @app.route('/')
 def home():
@@ -112,17 +144,83 @@ def api_convert():
     from_c = data.get('from')
     to_c = data.get('to')
     
-    # Llamamos a la función universal del ViewModel
-    result, rate = vm.convert_currency_amount(amount, from_c, to_c)
+    # Llamamos a la función universal del ViewModel (tabla de tasas en memoria)
+    snapshot = vm.get_rate_snapshot()
+    result, rate = vm.convert_currency_amount(amount, from_c, to_c, snapshot)
     
-    # Devolvemos la respuesta en JSON
+    # Devolvemos la respuesta en JSON (con la antigüedad de la tasa en segundos)
     return jsonify({
         "result": result,
         "rate": rate,
+        "rate_age": round(snapshot.age(), 1),
         "success": (rate > 0)
     })
 
 
+# --- RUTA 3: CONVERSIÓN POR LOTES ---
+@app.route('/api/convert_batch', methods=['POST'])
+def api_convert_batch():
+    """
+    Recibe {"items": [{"amount": 0.5, "from": "BTC", "to": "COP"}, ...], "to": "COP"}
+    ("to" global es opcional) y resuelve todo con la misma foto de tasas.
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({"success": False, "error": "Envía una lista 'items'."}), 400
+    if len(items) > 1000:
+        return jsonify({"success": False, "error": "Máximo 1000 conversiones por lote."}), 400
+
+    results, total, snapshot = vm.convert_batch(items, data.get('to'))
+    return jsonify({
+        "results": results,
+        "total": total,
+        # El total deja fuera las conversiones fallidas: avisamos que no es completo
+        "total_partial": total is not None and not all(r['success'] for r in results),
+        "rate_age": round(snapshot.age(), 1),
+        "success": all(r['success'] for r in results)
+    })
+
+# --- PRECIO EN VIVO (SSE) ---
+@app.route('/api/stream/prices')
+def stream_prices():
+    """Server-Sent Events con el precio en vivo de ?asset=crypto_btc_usd"""
+    if 'user_id' not in session:
+        return jsonify({"error": "No autenticado"}), 401
+
+    sub = vm.subscribe_prices(request.args.get('asset', 'crypto_btc_usd'))
+
+    def eventos():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                evento = sub.siguiente(timeout=15)
+                # Comentario SSE como latido para que proxies no corten la conexión
+                yield sse(evento) if evento else ": ping\n\n"
+        finally:
+            # El navegador cerró la conexión: soltamos la suscripción
+            sub.cerrar()
+
+    return Response(eventos(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# --- MÉTRICAS INTERNAS (para pruebas de carga) ---
+# Apagadas por defecto: METRICS_ENDPOINT=on las habilita, y aun así piden sesión iniciada.
+@app.route('/api/metrics')
+def api_metrics():
+    if os.environ.get('METRICS_ENDPOINT', 'off') != 'on':
+        return jsonify({"error": "No encontrado"}), 404
+    if 'user_id' not in session:
+        return jsonify({"error": "No autenticado"}), 401
+    return jsonify({
+        "quote_cache": vm.get_quote_cache_stats(),
+        "firebase_latency": vm.get_firebase_latency_stats(),
+        "price_stream": vm.price_hub.stats(),
+        "kraken_ws": vm.kraken_feed.stats(),
+        "trade_queue": vm.get_trade_queue_stats()
+    })
+
+
 @app.route('/logout')
 def logout():
     session.pop('user_id', None)
@@ -248,6 +346,20 @@ def performance():
     data = vm.get_performance_data(user_id, token)
     return render_template('rendimientos.html', **data)
 
+@app.route('/api/trades')
+def api_trades():
+    """Historial paginado: ?before=<seq del último trade mostrado>&limit=50"""
+    if 'user_id' not in session:
+        return jsonify({"error": "No autenticado"}), 401
+
+    user_id = session['user_id']
+    token = session['id_token']
+    try:
+        limit = int(request.args.get('limit', 50))
+        return jsonify(vm.get_trade_history(user_id, token, before=request.args.get('before') or None, limit=limit))
+    except ValueError:
+        return jsonify({"error": "limit o before inválido"}), 400
+
 @app.route('/update_dashboard_asset', methods=['POST'])
 def update_dashboard_asset():
     if 'user_id' not in session:
@@ -273,12 +385,32 @@ def run_backtest():
     user_id = session['user_id']
     token = session['id_token']
     
-    if vm.generate_mock_trades(user_id, token):
-        flash("Simulación de backtest generada con éxito.", "success")
+    summary = vm.run_backtest(user_id, token)
+    if summary:
+        flash(f"Backtest de {summary['activo']} listo: {summary['operaciones']} operaciones, retorno {summary['retorno_pct']:.2f}%.", "success")
     else:
         flash("Error al generar la simulación.", "danger")
     return redirect(url_for('performance'))
     
+@app.route('/api/backtest_sweep', methods=['POST'])
+def backtest_sweep():
+    """
+    Barrido de parámetros del backtest. JSON opcional con listas o rangos, ej:
+    {"window": [10, 14, 20], "banda_alta": {"inicio": 1.001, "fin": 1.005, "paso": 0.001},
+     "banda_baja": [0.998], "rsi_period": [null, 14]}
+    """
+    if 'user_id' not in session:
+        return jsonify({"error": "No autenticado"}), 401
+
+    user_id = session['user_id']
+    token = session['id_token']
+    grilla = request.get_json(silent=True) or None
+
+    resultado, error = vm.run_backtest_sweep(user_id, token, grilla)
+    if error:
+        return jsonify({"error": error}), 400
+    return jsonify(resultado)
+
 @app.route('/clear_history', methods=['POST'])
 def clear_history():
     """Borra el historial de trades (backtest)"""
@@ -294,31 +426,52 @@ def clear_history():
         flash("Error al borrar el historial.", "danger")
     return redirect(url_for('performance'))
 
-# --- RUTA DE DESCARGA CSV ---
+# --- RUTA DE DESCARGA (CSV / PARQUET) ---
 @app.route('/download_report')
 def download_report():
+    """?formato=csv|parquet&desde=YYYY-MM-DD&hasta=YYYY-MM-DD"""
     if 'user_id' not in session:
         return redirect(url_for('home'))
     
     user_id = session['user_id']
     token = session['id_token']
-    
-    # 1. Obtener el contenido CSV del ViewModel
-    # (Asegúrate de que vm.generate_csv_report exista en tu MainViewModel)
+    formato = request.args.get('formato', 'csv').lower()
+    desde = request.args.get('desde') or None
+    hasta = request.args.get('hasta') or None
+    sufijo = f"_{desde or 'inicio'}_{hasta or 'hoy'}" if desde or hasta else ""
+
+    # El historial se lee sin la caché de flask.g (vm.historial_service): ni el primer
+    # bloque, que se lee dentro de la petición, ni el resto se acumulan en memoria
     try:
-        csv_content = vm.generate_csv_report(user_id, token)
-        
-        # 2. Devolverlo como un archivo descargable
-        return Response(
-            csv_content,
-            mimetype="text/csv",
-            headers={"Content-disposition": "attachment; filename=reporte_trading.csv"}
-        )
-    except AttributeError:
-        # Si no has actualizado el ViewModel con la función CSV todavía
-        flash("Función de descarga no disponible aún.", "warning")
+        if formato == 'parquet':
+            contenido = vm.generate_parquet_report(user_id, token, desde, hasta)
+            if contenido is None:
+                flash("Exportar a Parquet requiere instalar pyarrow en el servidor.", "warning")
+                return redirect(url_for('performance'))
+            mimetype, extension = "application/vnd.apache.parquet", "parquet"
+        else:
+            contenido = vm.generate_csv_report(user_id, token, desde, hasta)
+            mimetype, extension = "text/csv", "csv"
+    except ValueError:
+        flash("Fechas inválidas. Usa el formato AAAA-MM-DD.", "danger")
+        return redirect(url_for('performance'))
+
+    # El primer bloque se lee antes de responder: si el historial no se puede leer
+    # avisamos en vez de entregar un archivo vacío. Un error más adelante corta la
+    # descarga (el navegador la marca como fallida, no como completa).
+    try:
+        primero = next(contenido)
+    except Exception as e:
+        print(f"Error generando reporte para {user_id}: {e}")
+        flash("No se pudo leer el historial para el reporte. Intenta de nuevo.", "danger")
         return redirect(url_for('performance'))
 
+    return Response(
+        itertools.chain([primero], contenido),
+        mimetype=mimetype,
+        headers={"Content-disposition": f"attachment; filename=reporte_trading{sufijo}.{extension}"}
+    )
+
 
 @app.route('/change_password', methods=['POST'])
 def change_password():
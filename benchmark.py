@@ -0,0 +1,92 @@
+# benchmark.py
+# Prueba de carga del flujo de trading completo SIN red:
+# mercado y broker simulados (model/sim_exchange.py) + persistencia SQLite local.
+# Uso:  python benchmark.py --trades 5000 --hilos 8 --latencia-ms 1
+
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from model.sim_exchange import PriceTape, SimBroker, SimMarket
+from model.storage import SQLiteStorage
+from model.broker_client import BrokerClient
+from viewmodels.main_viewmodel import MainViewModel
+
+ACTIVOS = {
+    'crypto_btc_usd': ('BTC/USD', 60000.0),
+    'crypto_eth_usd': ('ETH/USD', 3000.0),
+    'crypto_sol_usd': ('SOL/USD', 150.0),
+    'crypto_ada_usd': ('ADA/USD', 0.5),
+}
+
+
+def crear_mercado(latencia):
+    cintas = {symbol: PriceTape.sintetica(precio, semilla=i) for i, (symbol, precio) in enumerate(ACTIVOS.values())}
+    return SimMarket(cintas, latencia=latencia)
+
+
+def resumen(nombre, latencias, segundos):
+    ms = np.asarray(latencias) * 1000
+    print(f"{nombre}: {len(ms)} en {segundos:.2f}s -> {len(ms) / segundos:,.0f}/s | "
+          f"p50 {np.percentile(ms, 50):.2f} ms · p95 {np.percentile(ms, 95):.2f} ms · p99 {np.percentile(ms, 99):.2f} ms")
+
+
+def bench_trades(vm, trades, hilos):
+    """Cada hilo opera con su propio usuario, alternando COMPRA y VENTA sobre los activos."""
+    activos = list(ACTIVOS)
+
+    def operar(hilo):
+        user_id, latencias = f"bench_{hilo}", []
+        for n in range(trades // hilos):
+            activo = activos[(n // 2) % len(activos)]
+            accion = "COMPRA" if n % 2 == 0 else "VENTA"
+            inicio = time.perf_counter()
+            ok, msg, _ = vm.execute_manual_trade(user_id, None, activo, accion, quantity=0.001)
+            latencias.append(time.perf_counter() - inicio)
+            if not ok: print(f"Fallo ({user_id}): {msg}")
+        return latencias
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        latencias = [l for lista in pool.map(operar, range(hilos)) for l in lista]
+    resumen("Trades (execute_manual_trade)", latencias, time.perf_counter() - inicio)
+
+
+def bench_broker(mercado, ordenes):
+    """
+    Órdenes por BrokerClient contra el broker simulado (futures, sin sleeps fijos).
+    Cada flujo vende sólo lo que compró, así que todos deben terminar y la posición
+    del broker tiene que volver a cero; si no, el resumen lo marca como error.
+    """
+    simulado = SimBroker(mercado)
+    broker = BrokerClient(api=simulado)
+    inicio = time.perf_counter()
+    futuros = [(time.perf_counter(), broker.ejecutar_trade_y_obtener_log('crypto_btc_usd')) for _ in range(ordenes)]
+    latencias, fallidos = [], 0
+    for enviado, futuro in futuros:
+        if futuro.result() is None: fallidos += 1
+        latencias.append(time.perf_counter() - enviado)
+    resumen("Broker (compra + venta)", latencias, time.perf_counter() - inicio)
+    cuenta = simulado.get_account()
+    posicion = cuenta.equity - cuenta.cash
+    if fallidos or abs(posicion) > 1e-6:
+        print(f"ERROR broker: {fallidos} de {ordenes} flujos fallaron · posición abierta al final: ${posicion:,.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de trading con mercado simulado")
+    parser.add_argument("--trades", type=int, default=5000)
+    parser.add_argument("--hilos", type=int, default=8)
+    parser.add_argument("--latencia-ms", type=float, default=0.0, help="latencia simulada por llamada al mercado")
+    parser.add_argument("--ordenes-broker", type=int, default=200)
+    args = parser.parse_args()
+
+    mercado = crear_mercado(args.latencia_ms / 1000)
+    ruta = os.path.join(tempfile.mkdtemp(prefix="bench_"), "bench.db")
+    vm = MainViewModel(SQLiteStorage(ruta), market=mercado)
+
+    bench_trades(vm, args.trades, args.hilos)
+    if args.ordenes_broker: bench_broker(mercado, args.ordenes_broker)
+    print(f"Llamadas al mercado simulado: {mercado.llamadas} · base de datos: {ruta}")
@@ -0,0 +1,44 @@
+# bot_worker.py
+# Proceso dedicado para los bots automáticos (fuera del servidor web).
+# Uso:  python bot_worker.py
+# En ese caso arranca la web con BOT_SCHEDULER=off para no evaluar dos veces.
+
+import os
+from firebase_config import admin_db_ref
+from model.admin_db_adapter import AdminDBAdapter
+from model.storage import FirebaseStorage, get_default_storage, is_local_storage
+from model.bot_scheduler import BotScheduler
+from viewmodels.main_viewmodel import MainViewModel
+
+
+def build_scheduler(vm=None, storage=None):
+    """
+    Crea el scheduler. Con Firebase se conecta vía Admin SDK (sin idToken); con
+    STORAGE_BACKEND=sqlite usa el mismo archivo local que la web.
+    'vm': ViewModel ya creado (la web pasa el suyo, así no se duplican sus hilos,
+    cachés ni conexiones); sin él se crea uno propio (python bot_worker.py).
+    'storage': almacenamiento a usar en vez del que se elige por entorno.
+    """
+    if storage is None:
+        if is_local_storage():
+            storage = get_default_storage()
+        elif admin_db_ref is None:
+            print("ADVERTENCIA: Sin Firebase Admin SDK. El bot en segundo plano NO funcionará.")
+            return None
+        else:
+            storage = FirebaseStorage(lambda: AdminDBAdapter(admin_db_ref))
+
+    vm = vm.con_storage(storage) if vm is not None else MainViewModel(storage)
+    return BotScheduler(
+        vm,
+        intervalo=int(os.environ.get('BOT_SCHEDULER_INTERVAL', 60)),
+        max_workers=int(os.environ.get('BOT_SCHEDULER_WORKERS', 4))
+    )
+
+
+if __name__ == "__main__":
+    scheduler = build_scheduler()
+    if scheduler:
+        # Precios de Kraken por WebSocket también en el proceso de bots
+        if os.environ.get('KRAKEN_WS', 'on') == 'on': scheduler.vm.start_market_feed()
+        scheduler.run_forever()
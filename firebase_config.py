@@ -4,6 +4,7 @@ import pyrebase
 import firebase_admin
 from firebase_admin import credentials, db as admin_db
 import os
+from model.http_session import crear_sesion
 
 # --- 1. CONFIGURACIÓN PYREBASE (CLIENTE WEB) ---
 # (Esto es lo que ya tenías. No se toca nada)
@@ -19,6 +20,8 @@ firebaseConfig = {
 }
 
 firebase = pyrebase.initialize_app(firebaseConfig)
+# Sesión HTTP con pool keep-alive, timeouts y reintentos (debe ir antes de auth()/database())
+firebase.requests = crear_sesion()
 
 # Exportaciones para el ViewModel y las rutas (lo que ya usas)
 auth = firebase.auth()
@@ -0,0 +1,73 @@
+class _Respuesta:
+    """Imita la respuesta de Pyrebase (sólo necesitamos .val())."""
+
+    def __init__(self, valor):
+        self._valor = valor
+
+    def val(self):
+        return self._valor
+
+
+class AdminDBAdapter:
+    """
+    Envuelve la referencia de Firebase Admin (admin_db_ref) con la misma
+    interfaz que usamos de Pyrebase: child(...).get/set/push/update/remove(token=...).
+    Así DBService y BotService funcionan igual en segundo plano, sin idToken
+    de usuario (el Admin SDK usa la cuenta de servicio).
+
+    A diferencia de Pyrebase, cada child() devuelve un objeto NUEVO, así que
+    es seguro usarlo desde varios hilos a la vez.
+    """
+
+    def __init__(self, ref, consulta=None):
+        self._ref = ref
+        self._consulta = consulta or []
+
+    def child(self, *partes):
+        ref = self._ref
+        for parte in partes:
+            ref = ref.child(str(parte))
+        return AdminDBAdapter(ref)
+
+    # --- CONSULTAS (se aplican al hacer get) ---
+    def _con(self, metodo, *args):
+        return AdminDBAdapter(self._ref, self._consulta + [(metodo, args)])
+
+    def order_by_key(self): return self._con('order_by_key')
+    def order_by_child(self, campo): return self._con('order_by_child', campo)
+    def start_at(self, valor): return self._con('start_at', valor)
+    def end_at(self, valor): return self._con('end_at', valor)
+    def equal_to(self, valor): return self._con('equal_to', valor)
+    def limit_to_first(self, n): return self._con('limit_to_first', n)
+    def limit_to_last(self, n): return self._con('limit_to_last', n)
+
+    # --- OPERACIONES (el token se ignora: el Admin SDK ya está autenticado) ---
+    def get(self, token=None):
+        consulta = self._ref
+        for metodo, args in self._consulta:
+            consulta = getattr(consulta, metodo)(*args)
+        return _Respuesta(consulta.get())
+
+    def set(self, data, token=None):
+        self._ref.set(data)
+        return data
+
+    def update(self, data, token=None):
+        self._ref.update(data)
+        return data
+
+    def get_etag(self, token=None):
+        valor, etag = self._ref.get(etag=True)
+        return {'ETag': etag, 'value': valor}
+
+    def conditional_set(self, data, etag, token=None):
+        """Como Pyrebase: lo escrito si el ETag coincide, o {'ETag', 'value'} actuales si no."""
+        ok, valor, nuevo_etag = self._ref.set_if_unchanged(etag, data)
+        return data if ok else {'ETag': nuevo_etag, 'value': valor}
+
+    def push(self, data, token=None):
+        nuevo = self._ref.push(data)
+        return {"name": nuevo.key}
+
+    def remove(self, token=None):
+        self._ref.delete()
@@ -0,0 +1,130 @@
+import numpy as np
+
+# --- MOTOR DE BACKTEST VECTORIZADO ---
+# Reproduce la regla del bot automático (check_bot_execution) sobre velas históricas:
+#   cierre > SMA(14) * 1.002  -> COMPRA 'qty'
+#   cierre < SMA(14) * 0.998  -> VENTA 'qty' (sólo si hay inventario)
+# Todo se calcula con operaciones de arrays (sin bucle por vela), así que
+# años de velas de 1h se procesan en milisegundos.
+
+
+def sma(close, window):
+    """Media móvil simple con cumsum (NaN en las primeras window-1 velas)."""
+    close = np.asarray(close, dtype=float)
+    salida = np.full(close.shape, np.nan)
+    if window <= 0 or len(close) < window: return salida
+    acumulado = np.cumsum(np.insert(close, 0, 0.0))
+    salida[window - 1:] = (acumulado[window:] - acumulado[:-window]) / window
+    return salida
+
+
+def rsi(close, period=14):
+    """RSI con medias simples de ganancias/pérdidas (el mismo cálculo que get_ai_analysis)."""
+    close = np.asarray(close, dtype=float)
+    delta = np.diff(close, prepend=np.nan)
+    with np.errstate(invalid='ignore'):
+        ganancia = np.where(delta > 0, delta, 0.0)
+        perdida = np.where(delta < 0, -delta, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = sma(ganancia, period) / sma(perdida, period)
+        return 100 - (100 / (1 + rs))
+
+
+def _posicion_con_piso(senal):
+    """
+    Posición (en unidades de 'qty') acumulando +1/-1 pero sin bajar de 0
+    (no se puede vender lo que no se tiene). Es la suma acumulada "reflejada":
+    p_t = S_t - min(0, min_{k<=t} S_k)
+    """
+    suma = np.cumsum(senal)
+    return suma - np.minimum(0, np.minimum.accumulate(suma))
+
+
+def _posicion_con_caja(senal, close, qty, saldo_inicial):
+    """
+    Respaldo exacto para cuando la versión vectorizada se queda sin efectivo:
+    recorre SÓLO las velas con señal aplicando también el límite de caja
+    (igual que 'Saldo insuficiente' en execute_manual_trade).
+    """
+    posicion = np.zeros(len(senal))
+    unidades, caja = 0, saldo_inicial
+    indices = np.flatnonzero(senal)
+    for n, i in enumerate(indices):
+        costo = qty * close[i]
+        if senal[i] > 0 and caja >= costo:
+            unidades += 1
+            caja -= costo
+        elif senal[i] < 0 and unidades > 0:
+            unidades -= 1
+            caja += costo
+        fin = indices[n + 1] if n + 1 < len(indices) else len(senal)
+        posicion[i:fin] = unidades
+    return posicion
+
+
+def run_sma_backtest(close, window=14, banda_alta=1.002, banda_baja=0.998, qty=0.001, saldo_inicial=100000.0,
+                     rsi_period=None, rsi_sobrecompra=70, rsi_sobreventa=30):
+    """
+    Simula la estrategia SMA sobre el array de cierres.
+    Las órdenes se llenan al cierre de la vela que da la señal (como el bot en vivo).
+    Con 'rsi_period' se añade un filtro: no comprar en sobrecompra ni vender en sobreventa.
+    Devuelve un dict con métricas y los arrays de caja/equity.
+    """
+    close = np.asarray(close, dtype=float)
+    media = sma(close, window)
+
+    # 1. Señales (+1 compra, -1 venta, 0 mantener). Con NaN las comparaciones dan False.
+    with np.errstate(invalid='ignore'):
+        compra = close > media * banda_alta
+        venta = close < media * banda_baja
+        if rsi_period:
+            valores_rsi = rsi(close, rsi_period)
+            compra &= valores_rsi < rsi_sobrecompra
+            venta &= valores_rsi > rsi_sobreventa
+    senal = np.where(compra, 1, np.where(venta, -1, 0))
+
+    # 2. Posición y fills
+    posicion = _posicion_con_piso(senal)
+    fills = np.diff(posicion, prepend=0.0)
+    caja = saldo_inicial - np.cumsum(fills * qty * close)
+
+    if len(caja) and caja.min() < 0:
+        posicion = _posicion_con_caja(senal, close, qty, saldo_inicial)
+        fills = np.diff(posicion, prepend=0.0)
+        caja = saldo_inicial - np.cumsum(fills * qty * close)
+
+    # 3. Curva de capital y métricas
+    equity = caja + posicion * qty * close
+    if len(equity):
+        picos = np.maximum.accumulate(equity)
+        max_drawdown = float(((equity - picos) / picos).min()) * 100
+        equity_final = float(equity[-1])
+    else:
+        max_drawdown, equity_final = 0.0, saldo_inicial
+
+    validos = np.flatnonzero(~np.isnan(media))
+    buy_hold = float(close[-1] / close[validos[0]] - 1) * 100 if len(validos) else 0.0
+
+    return {
+        "barras": int(len(close)),
+        "operaciones": int(np.count_nonzero(fills)),
+        "compras": int(np.count_nonzero(fills > 0)),
+        "ventas": int(np.count_nonzero(fills < 0)),
+        "saldo_final": float(caja[-1]) if len(caja) else saldo_inicial,
+        "unidades_finales": float(posicion[-1] * qty) if len(posicion) else 0.0,
+        "equity_final": equity_final,
+        "pnl": equity_final - saldo_inicial,
+        "retorno_pct": (equity_final / saldo_inicial - 1) * 100,
+        "buy_hold_pct": buy_hold,
+        "max_drawdown_pct": max_drawdown,
+        "caja": caja,
+        "equity": equity,
+    }
+
+
+def reducir_curva(valores, puntos=100):
+    """Submuestrea una curva larga a 'puntos' valores para guardarla/graficarla."""
+    valores = np.asarray(valores, dtype=float)
+    if len(valores) <= puntos: return [round(float(v), 2) for v in valores]
+    idx = np.linspace(0, len(valores) - 1, puntos).astype(int)
+    return [round(float(v), 2) for v in valores[idx]]
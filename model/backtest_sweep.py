@@ -0,0 +1,163 @@
+import itertools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import numpy as np
+from model import backtest_engine
+
+# --- BARRIDO DE PARÁMETROS (GRID SEARCH) ---
+# Cada combinación (ventana SMA, bandas, período RSI) es un backtest independiente,
+# así que los repartimos en un ProcessPoolExecutor compartido por todo el servidor.
+# Los cierres se copian UNA vez a memoria compartida y cada worker los lee sin
+# copiarlos: a las tareas sólo viajan el nombre del bloque y los parámetros.
+
+# Grilla por defecto si el usuario no manda rangos
+GRILLA_DEFAULT = {
+    "window": [10, 14, 20, 30, 50],
+    "banda_alta": [1.001, 1.002, 1.005],
+    "banda_baja": [0.999, 0.998, 0.995],
+    "rsi_period": [None, 7, 14],
+}
+
+MAX_COMBINACIONES = 5000
+
+METRICAS = ("operaciones", "compras", "ventas", "equity_final", "pnl", "retorno_pct", "buy_hold_pct", "max_drawdown_pct")
+
+# Parámetros que el usuario puede barrer y cómo se convierten (qty/saldo los pone el servidor)
+PARAMETROS = {"window": int, "banda_alta": float, "banda_baja": float, "rsi_period": int}
+
+# Un solo pool de procesos para todo el servidor (no uno por petición).
+# Se crea tarde, con la web ya corriendo hilos (gateway asyncio, scheduler, feeds...):
+# hacer fork de un proceso con hilos puede dejar a los hijos trabados en un lock que
+# otro hilo tenía tomado. Con 'forkserver' (o 'spawn' donde no existe) los workers
+# salen de un proceso limpio que sólo importa este módulo.
+_CONTEXTO = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+MAX_WORKERS = int(os.environ.get('BACKTEST_SWEEP_WORKERS', min(4, os.cpu_count() or 1)))
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def expandir_rango(valor):
+    """
+    Acepta una lista [10, 14, 20], un valor suelto 14, o un rango
+    {"inicio": 1.001, "fin": 1.005, "paso": 0.001} (fin incluido).
+    """
+    if isinstance(valor, dict):
+        try:
+            inicio, fin, paso = float(valor['inicio']), float(valor['fin']), float(valor['paso'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("Un rango necesita 'inicio', 'fin' y 'paso' numéricos")
+        if paso <= 0: raise ValueError("El paso del rango debe ser > 0")
+        n = int(round((fin - inicio) / paso)) + 1
+        return [round(inicio + i * paso, 10) for i in range(max(n, 0))]
+    if isinstance(valor, (list, tuple)):
+        return list(valor)
+    return [valor]
+
+
+def _convertir(clave, valor):
+    """Valor de la grilla -> tipo del parámetro. ValueError si no sirve."""
+    if clave == 'rsi_period' and not valor: return None
+    try:
+        convertido = PARAMETROS[clave](valor)
+    except (TypeError, ValueError):
+        raise ValueError(f"Valor inválido para '{clave}': {valor!r}")
+    if convertido <= 0: raise ValueError(f"'{clave}' debe ser > 0")
+    return convertido
+
+
+def expandir_grilla(grilla):
+    """{'window': [10, 14], 'rsi_period': [None, 14]} -> lista de dicts (producto cartesiano)."""
+    grilla = grilla or GRILLA_DEFAULT
+    if not isinstance(grilla, dict): raise ValueError("La grilla debe ser un objeto JSON")
+    desconocidas = sorted(set(grilla) - set(PARAMETROS))
+    if desconocidas:
+        raise ValueError(f"Parámetros no permitidos: {', '.join(desconocidas)}. Usa: {', '.join(PARAMETROS)}")
+    claves = list(grilla)
+    valores = [[_convertir(c, v) for v in expandir_rango(grilla[c])] for c in claves]
+    return [dict(zip(claves, combo)) for combo in itertools.product(*valores)]
+
+
+def _adjuntar(nombre):
+    try:
+        # Python 3.13+: el worker no registra el bloque, el dueño es el proceso padre
+        return shared_memory.SharedMemory(name=nombre, track=False)
+    except TypeError:
+        # Antes de 3.13 el registro va al mismo resource_tracker del padre (es un set),
+        # así que duplicarlo es inofensivo y el padre lo libera con unlink()
+        return shared_memory.SharedMemory(name=nombre)
+
+
+def _correr_lote(nombre_shm, n, qty, saldo_inicial, lote):
+    """Un trozo de combinaciones sobre los cierres en memoria compartida (se adjunta y se suelta)."""
+    shm = _adjuntar(nombre_shm)
+    close = np.ndarray((n,), dtype=np.float64, buffer=shm.buf)
+    close.setflags(write=False)
+    try:
+        filas = []
+        for params in lote:
+            resultado = backtest_engine.run_sma_backtest(close, **params, qty=qty, saldo_inicial=saldo_inicial)
+            fila = dict(params)
+            fila.update({k: resultado[k] for k in METRICAS})
+            filas.append(fila)
+        return filas
+    finally:
+        # La vista debe soltarse antes de cerrar el bloque
+        del close
+        shm.close()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if _CONTEXTO.get_start_method() == 'forkserver':
+                _CONTEXTO.set_forkserver_preload([__name__])
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=_CONTEXTO)
+        return _pool
+
+
+def _descartar_pool(pool):
+    """Si un worker murió el pool queda roto: se reemplaza en la próxima petición."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool: _pool = None
+    pool.shutdown(wait=False)
+
+
+def barrido(close, grilla=None, qty=0.001, saldo_inicial=100000.0, ordenar_por='retorno_pct'):
+    """
+    Corre un backtest por cada combinación de la grilla en paralelo y devuelve
+    la tabla ordenada (mejor primero) con la columna 'rank'.
+    """
+    # Validación completa ANTES de mandar trabajo a los procesos
+    combinaciones = expandir_grilla(grilla)
+    if len(combinaciones) > MAX_COMBINACIONES:
+        raise ValueError(f"Demasiadas combinaciones ({len(combinaciones)}), máximo {MAX_COMBINACIONES}")
+
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    # Trozos grandes: menos viajes entre procesos, pero suficientes para balancear
+    tamano = max(1, len(combinaciones) // (MAX_WORKERS * 4))
+    lotes = [combinaciones[i:i + tamano] for i in range(0, len(combinaciones), tamano)]
+
+    shm = shared_memory.SharedMemory(create=True, size=max(close.nbytes, 1))
+    pool = _get_pool()
+    try:
+        np.ndarray(close.shape, dtype=np.float64, buffer=shm.buf)[:] = close
+        futuros = [pool.submit(_correr_lote, shm.name, len(close), qty, saldo_inicial, lote) for lote in lotes]
+        tabla = [fila for futuro in futuros for fila in futuro.result()]
+    except BrokenProcessPool:
+        _descartar_pool(pool)
+        raise
+    finally:
+        shm.close()
+        shm.unlink()
+
+    tabla.sort(key=lambda fila: fila.get(ordenar_por, 0), reverse=True)
+    for i, fila in enumerate(tabla, start=1):
+        fila['rank'] = i
+    return tabla
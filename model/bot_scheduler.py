@@ -0,0 +1,130 @@
+import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def dentro_de_horario(horario, ahora=None):
+    """
+    ¿Está 'ahora' dentro del horario operativo del bot? Formato "HH:MM-HH:MM".
+    Soporta horarios que cruzan la medianoche (ej: "22:00-06:00").
+    Si el horario está vacío o mal escrito, el bot opera todo el día (como antes).
+    """
+    if not horario: return True
+    ahora = ahora or datetime.datetime.now()
+    try:
+        inicio_txt, fin_txt = [p.strip() for p in str(horario).split('-')]
+        inicio = datetime.datetime.strptime(inicio_txt, "%H:%M").time()
+        fin = datetime.datetime.strptime(fin_txt, "%H:%M").time()
+    except ValueError:
+        print(f"Horario inválido '{horario}', se ignora.")
+        return True
+
+    actual = ahora.time().replace(second=0, microsecond=0)
+    if inicio <= fin:
+        return inicio <= actual <= fin
+    return actual >= inicio or actual <= fin
+
+
+class BotScheduler:
+    """
+    Ejecuta los bots automáticos en segundo plano, fuera de las peticiones web.
+    Cada 'intervalo' segundos:
+      1. Lee los bot_settings de todos los usuarios y se queda con los activos.
+      2. Filtra los que están dentro de su 'horario'.
+      3. Agrupa a los usuarios por (símbolo, fuente, timeframe): la señal (precio +
+         SMA) se calcula UNA vez por grupo, así el costo crece con los símbolos
+         distintos y no con los usuarios.
+      4. Reparte las operaciones de cada usuario (su cantidad y riesgo) en un pool
+         de hilos acotado (max_workers).
+    Un usuario no se vuelve a encolar si su evaluación anterior sigue en curso.
+    """
+
+    def __init__(self, vm, intervalo=60, max_workers=4):
+        self.vm = vm
+        self.intervalo = intervalo
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bot")
+        self._en_curso = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._hilo = None
+        self.ultimos_grupos = 0
+
+    def tick(self, ahora=None):
+        """Una pasada del scheduler. Devuelve cuántos bots se encolaron."""
+        activos = self.vm.get_active_bot_settings()
+        grupos = {}
+        for user_id, settings in activos.items():
+            if not dentro_de_horario(settings.get('horario'), ahora): continue
+            with self._lock:
+                if user_id in self._en_curso: continue
+                self._en_curso.add(user_id)
+            grupos.setdefault(self.vm.bot_group(settings), []).append((user_id, settings))
+
+        for usuarios in grupos.values():
+            self.pool.submit(self._evaluar_grupo, usuarios)
+        self.ultimos_grupos = len(grupos)
+        return sum(len(usuarios) for usuarios in grupos.values())
+
+    def _evaluar_grupo(self, usuarios):
+        """Calcula la señal del grupo y encola la operación de cada usuario."""
+        try:
+            activo = usuarios[0][1].get('activo', 'crypto_btc_usd')
+            accion, precio = self.vm.bot_signal(activo)
+        except Exception as e:
+            print(f"Bot error (señal de {usuarios[0][1].get('activo')}): {e}")
+            accion, precio = "MANTENER", 0.0
+
+        for user_id, settings in usuarios:
+            if accion == "MANTENER" or not precio:
+                self._liberar(user_id)
+            else:
+                try:
+                    self.pool.submit(self._operar, user_id, settings, accion, precio)
+                except RuntimeError:
+                    # El pool se está cerrando (stop): no se opera
+                    self._liberar(user_id)
+
+    def _operar(self, user_id, settings, accion, precio):
+        try:
+            self.vm.execute_bot_trade(user_id, None, settings, accion, precio)
+        except Exception as e:
+            print(f"Bot error ({user_id}): {e}")
+        finally:
+            self._liberar(user_id)
+
+    def _liberar(self, user_id):
+        with self._lock:
+            self._en_curso.discard(user_id)
+
+    def _loop(self):
+        print(f"--- Scheduler de bots iniciado (cada {self.intervalo}s) ---")
+        while not self._stop.is_set():
+            inicio = time.monotonic()
+            try:
+                n = self.tick()
+                if n: print(f"🤖 Scheduler: {n} bots evaluados ({self.ultimos_grupos} señales)")
+            except Exception as e:
+                print(f"Error en scheduler de bots: {e}")
+            # Cadencia fija: descontamos lo que tardó la pasada
+            self._stop.wait(max(0.0, self.intervalo - (time.monotonic() - inicio)))
+
+    def start(self):
+        """Arranca el scheduler en un hilo daemon (no bloquea)."""
+        if self._hilo and self._hilo.is_alive(): return
+        self._stop.clear()
+        self._hilo = threading.Thread(target=self._loop, name="bot-scheduler", daemon=True)
+        self._hilo.start()
+
+    def run_forever(self):
+        """Para el proceso dedicado (bot_worker.py): corre en primer plano."""
+        try:
+            self._loop()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        self._stop.set()
+        self.pool.shutdown(wait=True)
@@ -1,52 +1,129 @@
-from firebase_config import db
+from model import ledger
+from model.storage import get_default_storage
+
+# Veces que se reintenta un trade si otro proceso cambió el ledger entre la lectura y el commit
+INTENTOS_COMMIT = 3
 
 class BotService:
-    def __init__(self):
-        # Conexión Pyrebase
-        self.db = db
+    def __init__(self, storage=None):
+        # Backend de persistencia (Pyrebase/SQLite por defecto, Admin SDK en segundo plano)
+        self.storage = storage or get_default_storage()
 
     # --- LECTURA DE DATOS ---
     def get_bot_settings(self, user_id, token):
         try:
-            data = self.db.child("bot_settings").child(user_id).get(token=token)
-            return data.val()
+            return self.storage.get(f"bot_settings/{user_id}", token)
         except Exception as e:
             print(f"Error settings: {e}")
             return None
 
     def save_bot_settings(self, user_id, data, token):
         try:
-            self.db.child("bot_settings").child(user_id).set(data, token=token)
+            self.storage.set(f"bot_settings/{user_id}", data, token)
             return True
         except Exception as e:
             return False
 
+    def get_all_bot_settings(self, token=None):
+        """Todos los bot_settings {user_id: settings} (lo usa el scheduler en segundo plano)."""
+        try:
+            return self.storage.get("bot_settings", token) or {}
+        except Exception as e:
+            print(f"Error leyendo todos los settings: {e}")
+            return {}
+
     def get_trade_log(self, user_id, token):
         try:
-            data = self.db.child("trade_log").child(user_id).get(token=token)
-            return data.val()
+            return self.storage.get(f"trade_log/{user_id}", token)
         except Exception as e:
             return {}
 
+    def get_trades_page(self, user_id, token, limit=50, before_seq=None):
+        """
+        Una página del historial, del más reciente al más antiguo, en orden de 'seq'
+        (el mismo del ledger): pedimos las 'limit' anteriores a 'before_seq' (cursor)
+        sin descargar el resto del trade_log. En Firebase requiere ".indexOn": "seq".
+        Devuelve (lista de trades con su 'key', cursor siguiente o None).
+        """
+        try:
+            # end_at es inclusivo: pedimos uno de más para descartar el propio cursor
+            data = self.storage.query(f"trade_log/{user_id}", order_by='seq', end_at=before_seq,
+                                      limit_to_last=limit + (1 if before_seq is not None else 0), token=token)
+            trades = [dict(v, key=k) for k, v in data.items() if before_seq is None or v.get('seq') != before_seq]
+            trades = trades[-limit:]
+            trades.reverse()
+            siguiente = trades[-1].get('seq') if len(trades) == limit else None
+            return trades, siguiente
+        except Exception as e:
+            print(f"Error leyendo página del historial: {e}")
+            return [], None
+
+    def get_trades_between(self, user_id, token, desde=None, hasta=None, limit=None):
+        """
+        Trades con timestamp entre 'desde' y 'hasta' (texto "YYYY-MM-DD HH:MM:SS", inclusivos),
+        del más antiguo al más reciente. En Firebase requiere ".indexOn": "timestamp" en trade_log.
+        Los errores de lectura NO se tragan: un bloque vacío cortaría el recorrido de iter_trades
+        y el reporte saldría incompleto como si estuviera completo.
+        """
+        return self.storage.query(f"trade_log/{user_id}", order_by='timestamp', start_at=desde,
+                                  end_at=hasta, limit_to_first=limit, token=token)
+
+    def iter_trades(self, user_id, token, desde=None, hasta=None, chunk=1000, despues_de=None):
+        """
+        Recorre el historial completo del más antiguo al más reciente en bloques de
+        'chunk' registros (memoria constante). Con 'desde'/'hasta' pagina por timestamp;
+        si no, por 'seq' (orden de llegada, el del ledger), empezando después del 'seq'
+        'despues_de' si se da. En Firebase requiere ".indexOn": "seq".
+        Produce tuplas (clave, trade). Si falla una lectura, la excepción sale del generador.
+        """
+        if desde is None and hasta is None:
+            # start_at es inclusivo: pedimos uno de más para descartar el propio cursor
+            ultimo = despues_de
+            while True:
+                extra = 1 if ultimo is not None else 0
+                data = self.storage.query(f"trade_log/{user_id}", order_by='seq', start_at=ultimo,
+                                          limit_to_first=chunk + extra, token=token)
+                nuevos = [(k, v) for k, v in data.items() if ultimo is None or v.get('seq') != ultimo]
+                yield from nuevos
+                if len(data) < chunk + extra or not nuevos: return
+                ultimo = nuevos[-1][1].get('seq')
+                # Trades sin 'seq' (anteriores a la migración, ver asignar_seq_legado): no hay cursor
+                if ultimo is None: raise ValueError(f"Hay trades sin 'seq' en el historial de {user_id}")
+
+        # Por fechas: el siguiente bloque empieza en el último timestamp visto (inclusivo)
+        # y descarta las claves ya entregadas con ese mismo timestamp
+        inicio, vistos, limite = desde, set(), chunk
+        while True:
+            data = self.get_trades_between(user_id, token, inicio, hasta, limit=limite)
+            nuevos = [(k, v) for k, v in data.items() if k not in vistos]
+            yield from nuevos
+            if len(data) < limite: return
+            if not nuevos:
+                # Más de 'limite' trades en el mismo segundo: ampliamos el bloque
+                limite *= 2
+                continue
+            ultimo_ts = nuevos[-1][1].get('timestamp')
+            vistos = {k for k, v in data.items() if v.get('timestamp') == ultimo_ts}
+            inicio, limite = ultimo_ts, chunk
+
     # --- API KEYS (Si decides usarlas a futuro) ---
     def get_api_keys(self, user_id, token):
         try:
-            data = self.db.child("api_keys").child(user_id).get(token=token)
-            return data.val()
+            return self.storage.get(f"api_keys/{user_id}", token)
         except Exception:
             return None
 
     def save_api_key(self, user_id, key_data, token):
         try:
             exchange = key_data['exchange'].lower()
-            self.db.child("api_keys").child(user_id).child(exchange).set(key_data, token=token)
+            self.storage.set(f"api_keys/{user_id}/{exchange}", key_data, token)
             return True
         except Exception:
             return False
             
     def delete_api_key(self, user_id, exchange_name, token):
         try:
-            self.db.child("api_keys").child(user_id).child(exchange_name.lower()).remove(token=token)
+            self.storage.remove(f"api_keys/{user_id}/{exchange_name.lower()}", token)
             return True
         except Exception:
             return False
@@ -55,24 +132,122 @@ class BotService:
     def record_trade(self, user_id, trade_data, token):
         """
         Recibe un diccionario con los datos del trade REAL (Paper Trading)
-        y lo empuja al historial de Firebase.
+        y lo guarda junto con el ledger (ver commit_trade). Si otro proceso
+        movió el ledger en medio, vuelve a leerlo y reintenta (INTENTOS_COMMIT).
+        """
+        for _ in range(INTENTOS_COMMIT):
+            snapshot = self.get_ledger(user_id, token)
+            if not snapshot: snapshot = ledger.reconstruir(self.get_trade_log(user_id, token))
+            resultado = self.commit_trade(user_id, trade_data, snapshot, token)
+            if resultado is None: return False
+            if resultado: return True
+        print(f"❌ No se pudo guardar el trade de {user_id}: el ledger siguió cambiando")
+        return False
+
+    def commit_trade(self, user_id, trade_data, snapshot, token):
+        """
+        Guarda el trade, el snapshot del ledger y el saldo del perfil en UNA
+        escritura, condicionada a que el ledger siga siendo el que se leyó
+        (mismo last_trade_key): si otro proceso (la web, bot_worker.py) aplicó
+        un trade en medio, no se escribe nada.
+        'snapshot' es el ledger vigente ANTES del trade.
+        Devuelve la clave del trade, False si el ledger cambió (volver a leer y
+        reintentar) o None si falló la escritura.
+        La clave sólo identifica al trade; el orden lo da 'seq' (ver model/ledger.py).
         """
         try:
-            # Usamos push() para que cree un ID único automáticamente
-            self.db.child("trade_log").child(user_id).push(trade_data, token=token)
-            print(f"✅ Trade guardado en Firebase: {trade_data.get('activo')} - {trade_data.get('tipo')}")
-            return True
+            esperado = snapshot.get('last_trade_key')
+            trade_key = self.storage.new_key()
+            trade_data['seq'] = ledger.siguiente_seq(snapshot)
+            ledger.aplicar_trade(snapshot, trade_data, trade_key)
+            escrito = self.storage.update_if(
+                f"ledger/{user_id}",
+                lambda actual: (actual or {}).get('last_trade_key') == esperado,
+                {
+                    f"ledger/{user_id}": snapshot,
+                    f"trade_log/{user_id}/{trade_key}": trade_data,
+                    f"users/{user_id}/saldo_virtual": snapshot['cash'],
+                }, token)
+            if not escrito:
+                print(f"⚠️ El ledger de {user_id} cambió mientras se operaba, hay que reintentar")
+                return False
+            print(f"✅ Trade guardado: {trade_data.get('activo')} - {trade_data.get('tipo')}")
+            return trade_key
         except Exception as e:
             print(f"❌ Error al guardar trade: {e}")
-            return False
+            return None
 
     def clear_trade_log(self, user_id, token):
         try:
-            self.db.child("trade_log").child(user_id).remove(token=token)
+            self.storage.remove(f"trade_log/{user_id}", token)
+            self.storage.remove(f"ledger/{user_id}", token)
             return True
         except Exception:
             return False
-    
+
+    # --- LIBRO CONTABLE (SNAPSHOT INCREMENTAL) ---
+    def get_ledger(self, user_id, token):
+        try:
+            return self.storage.get(f"ledger/{user_id}", token)
+        except Exception as e:
+            print(f"Error leyendo ledger: {e}")
+            return None
+
+    def save_ledger(self, user_id, snapshot, token):
+        try:
+            self.storage.set(f"ledger/{user_id}", snapshot, token)
+            return True
+        except Exception as e:
+            print(f"Error guardando ledger: {e}")
+            return False
+
+    def get_last_trade_key(self, user_id, token):
+        """
+        Sólo la clave del último trade por 'seq' (1 registro), para verificar el snapshot barato.
+        En Firebase requiere ".indexOn": "seq" en trade_log. Los errores (ej. falta el índice)
+        se propagan: devolver None haría creer que el snapshot está desincronizado.
+        """
+        val = self.storage.query(f"trade_log/{user_id}", order_by='seq', limit_to_last=1, token=token)
+        return list(val.keys())[-1] if val else None
+
+    def asignar_seq_legado(self, user_id, trade_log, token, bloque=500):
+        """
+        Numera (seq = 1, 2, ...) en orden de clave los trades de 'trade_log' guardados antes
+        de que existiera 'seq' (push keys del servidor, cronológicas), en el propio dict y en
+        el almacenamiento. Pasa una sola vez por usuario: los trades nuevos empiezan en
+        trade_count + 1, así que no se pisan. Devuelve cuántos trades numeró.
+        """
+        if not isinstance(trade_log, dict): return 0
+        legado = [k for k in sorted(trade_log) if isinstance(trade_log[k], dict) and trade_log[k].get('seq') is None]
+        for n, k in enumerate(legado, start=1):
+            trade_log[k]['seq'] = n
+        for inicio in range(0, len(legado), bloque):
+            self.storage.update("", {f"trade_log/{user_id}/{k}/seq": trade_log[k]['seq']
+                                     for k in legado[inicio:inicio + bloque]}, token)
+        return len(legado)
+
+    # --- RESUMEN DEL ÚLTIMO BACKTEST ---
+    def save_backtest(self, user_id, summary, token):
+        try:
+            self.storage.set(f"backtests/{user_id}", summary, token)
+            return True
+        except Exception as e:
+            print(f"Error guardando backtest: {e}")
+            return False
+
+    def get_backtest(self, user_id, token):
+        try:
+            return self.storage.get(f"backtests/{user_id}", token)
+        except Exception:
+            return None
+
+    def clear_backtest(self, user_id, token):
+        try:
+            self.storage.remove(f"backtests/{user_id}", token)
+            return True
+        except Exception:
+            return False
+
     # Mantenemos esta por compatibilidad, pero ahora usa la lógica interna
     def generate_mock_trade_log(self, user_id, token, asset_name):
         return False # Desactivamos la simulación vieja
\ No newline at end of file
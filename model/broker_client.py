@@ -1,13 +1,138 @@
 import alpaca_trade_api as tradeapi
+from alpaca_trade_api.entity import Order
+import heapq
 import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 import time
 import uuid
 import random # --- ¡NUEVO! ---
 
+# Estados finales de una orden en Alpaca (ya no van a cambiar)
+ESTADOS_FINALES = {'filled', 'canceled', 'expired', 'rejected', 'done_for_day'}
+
+# Con el mercado cerrado la orden se queda en 'accepted' hasta la apertura: si sigue
+# así pasado este tiempo no tiene sentido esperar el timeout de llenado completo.
+ESPERA_ACEPTADA = 1.0
+
+
+class OrderTracker:
+    """
+    Sigue órdenes hasta que terminan SIN bloquear a quien las envía.
+    - track(order_id) devuelve un Future que se resuelve con la orden final
+      (o con la última vista si pasa el timeout, para que el llamador decida).
+    - Un solo hilo consulta get_order con backoff exponencial para TODAS las
+      órdenes pendientes (no un sleep fijo por orden).
+    - Si se conecta el stream 'trade_updates' de Alpaca, los fills resuelven
+      el Future en cuanto llegan, sin esperar al siguiente sondeo.
+    - Con 'espera_aceptada', una orden que sigue 'accepted' (mercado cerrado)
+      se resuelve pasado ese tiempo en vez de al vencer el timeout.
+    """
+
+    def __init__(self, api, espera_inicial=0.25, espera_max=5.0):
+        self.api = api
+        self.espera_inicial = espera_inicial
+        self.espera_max = espera_max
+        self._pendientes = {}   # order_id -> {"future", "limite", "espera", "callback"}
+        self._agenda = []       # heap (próximo_sondeo, order_id)
+        self._cond = threading.Condition()
+        self._hilo = None
+
+    def track(self, order_id, timeout=60.0, callback=None, espera_aceptada=None):
+        futuro = Future()
+        if callback: futuro.add_done_callback(lambda f: callback(f.result()))
+        ahora = time.monotonic()
+        with self._cond:
+            self._pendientes[order_id] = {"future": futuro, "limite": ahora + timeout,
+                                          "limite_aceptada": ahora + espera_aceptada if espera_aceptada is not None else None,
+                                          "espera": self.espera_inicial, "ultima": None}
+            # Primer sondeo inmediato (las órdenes de mercado suelen llenarse enseguida)
+            heapq.heappush(self._agenda, (time.monotonic(), order_id))
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._loop, name="order-tracker", daemon=True)
+                self._hilo.start()
+            self._cond.notify()
+        return futuro
+
+    def _resolver(self, order_id, orden):
+        with self._cond:
+            pendiente = self._pendientes.pop(order_id, None)
+        if pendiente and not pendiente["future"].done():
+            pendiente["future"].set_result(orden)
+
+    def on_trade_update(self, evento):
+        """
+        Handler del stream trade_updates: evento con .event y .order (objeto o dict).
+        Corre dentro del bucle asyncio del stream, así que NO vuelve a pedir la orden
+        al broker (una llamada bloqueante frenaría todos los eventos): el evento ya
+        trae la orden completa, la envolvemos como la devuelve get_order.
+        """
+        orden = getattr(evento, 'order', None) or (evento.get('order') if isinstance(evento, dict) else None)
+        if orden is None: return
+        if isinstance(orden, dict): orden = Order(orden)
+        if orden.status in ESTADOS_FINALES:
+            self._resolver(orden.id, orden)
+
+    def conectar_stream(self, stream):
+        """Suscribe el tracker a un alpaca_trade_api.Stream y lo corre en un hilo de fondo."""
+        async def handler(evento):
+            try:
+                self.on_trade_update(evento)
+            except Exception as e:
+                # Si falla, la orden se sigue resolviendo por sondeo
+                print(f"Error procesando trade_update: {e}")
+        stream.subscribe_trade_updates(handler)
+        threading.Thread(target=stream.run, name="alpaca-stream", daemon=True).start()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._agenda:
+                    self._cond.wait()
+                cuando, order_id = self._agenda[0]
+                ahora = time.monotonic()
+                if cuando > ahora:
+                    self._cond.wait(cuando - ahora)
+                    continue
+                heapq.heappop(self._agenda)
+                pendiente = self._pendientes.get(order_id)
+            if pendiente is None: continue  # ya resuelta por el stream
+
+            try:
+                orden = self.api.get_order(order_id)
+                pendiente["ultima"] = orden
+            except Exception as e:
+                print(f"Error consultando orden {order_id}: {e}")
+                orden = pendiente["ultima"]
+
+            ahora = time.monotonic()
+            aceptada = pendiente["limite_aceptada"]
+            if orden is not None and orden.status in ESTADOS_FINALES:
+                self._resolver(order_id, orden)
+            elif ahora >= pendiente["limite"]:
+                self._resolver(order_id, orden)
+            elif orden is not None and orden.status == 'accepted' and aceptada is not None and ahora >= aceptada:
+                self._resolver(order_id, orden)
+            else:
+                proximo = ahora + pendiente["espera"]
+                if aceptada is not None and ahora < aceptada: proximo = min(proximo, aceptada)
+                with self._cond:
+                    heapq.heappush(self._agenda, (proximo, order_id))
+                    pendiente["espera"] = min(pendiente["espera"] * 2, self.espera_max)
+
+    def pendientes(self):
+        with self._cond:
+            return len(self._pendientes)
+
+
 class BrokerClient:
-    def __init__(self):
-        self.api = None
+    def __init__(self, api=None):
+        # 'api' permite inyectar otro broker con la misma interfaz (ej. el simulador local)
+        self.api = api
+        self._tracker = OrderTracker(api) if api else None
+        self._flujos = ThreadPoolExecutor(max_workers=8, thread_name_prefix="broker")
+        if api: return
         try:
             # ¡Lee las claves de las variables de entorno de Render!
             key_id = os.environ.get('ALPACA_KEY_ID')
@@ -21,11 +146,16 @@ class BrokerClient:
             base_url = "https://paper-api.alpaca.markets"
             
             self.api = tradeapi.REST(key_id, secret_key, base_url, api_version='v2')
+            self._tracker = OrderTracker(self.api)
             
             # Verificamos la conexión
             account = self.api.get_account()
             print(f"--- Conexión exitosa a Alpaca. Cuenta de Paper Trading: ${account.equity} ---")
 
+            # Fills por el stream 'trade_updates' (el sondeo sigue como respaldo). ALPACA_STREAM=off lo apaga.
+            if os.environ.get('ALPACA_STREAM', 'on').lower() != 'off':
+                self._tracker.conectar_stream(tradeapi.Stream(key_id, secret_key, base_url))
+
         except Exception as e:
             print(f"Error al inicializar el cliente de Alpaca: {e}")
 
@@ -51,14 +181,24 @@ class BrokerClient:
             
         return simbolo
 
-    def ejecutar_trade_y_obtener_log(self, asset_name):
+    def ejecutar_trade_y_obtener_log(self, asset_name, callback=None, timeout_llenado=10.0):
         """
-        La función principal. Ejecuta un trade y devuelve el log
-        en el formato que tu app espera.
+        La función principal. Envía el trade y devuelve AL INSTANTE un Future
+        con el log en el formato que tu app espera (o None si falla).
+        'callback(trade_data)' opcional se llama cuando termina.
         """
         if not self.api:
             print("Error: El cliente de Alpaca no está inicializado.")
-            return None # --- ¡CAMBIO! Devolvemos None en lugar de {}
+            futuro = Future()
+            futuro.set_result(None)
+            return futuro
+
+        futuro = self._flujos.submit(self._flujo_trade, asset_name, timeout_llenado)
+        if callback: futuro.add_done_callback(lambda f: callback(f.result()))
+        return futuro
+
+    def _flujo_trade(self, asset_name, timeout_llenado):
+        """Compra -> espera el fill (tracker) -> vende lo comprado -> espera el fill -> log con PNL."""
 
         simbolo = self._traducir_asset(asset_name)
         
@@ -85,14 +225,12 @@ class BrokerClient:
                 **qty_o_notional
             )
             
-            # 2. Esperamos 5 segundos
-            print("Esperando 5 segundos para que la orden se llene...")
-            time.sleep(5)
+            # 2. El tracker nos avisa en cuanto la orden se llena (o al vencer el plazo,
+            #    o si se queda 'accepted' porque el mercado está cerrado)
+            orden_ejecutada = self._tracker.track(orden.id, timeout=timeout_llenado,
+                                                  espera_aceptada=ESPERA_ACEPTADA).result()
             
-            # 3. Obtenemos la orden ejecutada para saber el precio
-            orden_ejecutada = self.api.get_order(orden.id)
-            
-            print(f"--- Status de la orden después de 5s: {orden_ejecutada.status} ---")
+            print(f"--- Status de la orden: {orden_ejecutada.status} ---")
 
             # --- ¡LÓGICA MEJORADA! ---
             
@@ -101,19 +239,32 @@ class BrokerClient:
                 print("--- ¡Orden 'filled'! El mercado está abierto. Calculando PNL... ---")
                 precio_compra = float(orden_ejecutada.filled_avg_price)
                 
-                print(f"Cerrando posición para {simbolo} para calcular PNL...")
-                posicion_cerrada = self.api.close_position(simbolo)
-                print("Esperando 5 segundos para que la posición se cierre...")
-                time.sleep(5)
+                # Vendemos SÓLO lo que llenó esta compra: close_position liquidaría toda la
+                # posición, incluidas las compras de otros flujos que corren en paralelo
+                qty_comprada = orden_ejecutada.filled_qty
+                print(f"Vendiendo {qty_comprada} {simbolo} para calcular PNL...")
+                orden_cierre = self.api.submit_order(
+                    symbol=simbolo,
+                    side='sell',
+                    type=tipo_orden,
+                    time_in_force=time_in_force,
+                    qty=qty_comprada
+                )
+                cierre = self._tracker.track(orden_cierre.id, timeout=timeout_llenado).result()
                 
-                # Obtenemos el PNL
-                actividades = self.api.get_activities(activity_types='FILL', direction='desc', page_size=10)
-                pnl_trade = 0.0
-                for act in actividades:
-                    if act.symbol == simbolo and act.side == 'sell':
-                        if hasattr(act, 'pl'):
-                            pnl_trade = float(act.pl)
-                            break
+                if cierre is None or cierre.status != 'filled':
+                    # Sin precio de venta no hay PNL que registrar (un 0.0 sería inventado):
+                    # cancelamos el cierre para que no se llene después sin que nadie lo vea
+                    print(f"--- El cierre no se llenó a tiempo (status: {getattr(cierre, 'status', None)}), se cancela ---")
+                    try:
+                        self.api.cancel_order(orden_cierre.id)
+                    except Exception as e:
+                        print(f"No se pudo cancelar la orden de cierre {orden_cierre.id}: {e}")
+                    print(f"--- Quedan {qty_comprada} {simbolo} en la cuenta de Alpaca sin registrar ---")
+                    return None
+
+                # PNL con los precios de llenado de la compra y de la venta
+                pnl_trade = (float(cierre.filled_avg_price) - precio_compra) * float(cierre.filled_qty)
                 print(f"--- Trade real (paper) completado. PNL: ${pnl_trade} ---")
 
             # CASO 2: ¡ÉXITO DE DEMO! (El mercado está cerrado, la orden fue 'accepted')
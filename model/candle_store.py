@@ -0,0 +1,204 @@
+import os
+import threading
+import time
+import datetime
+import math
+import numpy as np
+import pandas as pd
+
+# --- ALMACÉN LOCAL DE VELAS (OHLCV) ---
+# Las velas de BTC/USD 1h son las mismas para todos los usuarios, así que las
+# guardamos una sola vez por (symbol, timeframe) en disco (.npy, leído con mmap)
+# y sólo pedimos a la red la "cola" que falta desde la última vela guardada.
+# Formato de cada fila: [timestamp_ms, open, high, low, close, volume]
+
+COLUMNAS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+
+TIMEFRAME_MS = {
+    '1m': 60_000,
+    '5m': 300_000,
+    '15m': 900_000,
+    '30m': 1_800_000,
+    '1h': 3_600_000,
+    '4h': 14_400_000,
+    '1d': 86_400_000,
+}
+
+DIA_MS = 86_400_000
+
+DIRECTORIO_DEFAULT = os.environ.get(
+    'CANDLE_STORE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'candles')
+)
+
+
+class CandleStore:
+    """
+    Velas compartidas por todo el proceso, con refresco incremental.
+    - Una vela nueva sólo se pide cuando ya debería existir (cambio de barra),
+      o si la barra abierta tiene más de 'refresco_min' segundos.
+    - Un lock por (symbol, timeframe): si 50 usuarios piden BTC/USD a la vez,
+      sólo uno va a la red y los demás leen el resultado.
+    - La red va por el MarketDataGateway (límite de concurrencia y timeout por fuente).
+    """
+
+    def __init__(self, gateway=None, directorio=DIRECTORIO_DEFAULT, max_barras=50000, refresco_min=60.0):
+        self.gateway = gateway
+        self.directorio = directorio
+        self.max_barras = max_barras
+        self.refresco_min = refresco_min
+
+        self._series = {}      # (symbol, timeframe) -> np.ndarray (N, 6)
+        self._refrescado = {}  # (symbol, timeframe) -> time.monotonic() del último fetch
+        self._sin_historia = set()  # (symbol, timeframe) cuyo exchange ya no tiene velas más viejas
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.fetches = 0
+
+    # --- DISCO ---
+    def _ruta(self, symbol, timeframe):
+        seguro = ''.join(c if c.isalnum() else '_' for c in symbol)
+        return os.path.join(self.directorio, f"{seguro}_{timeframe}.npy")
+
+    def _cargar(self, symbol, timeframe):
+        ruta = self._ruta(symbol, timeframe)
+        if not os.path.exists(ruta): return np.empty((0, 6))
+        try:
+            # mmap: no leemos todo el archivo, sólo las páginas que se usen
+            return np.load(ruta, mmap_mode='r')
+        except Exception as e:
+            print(f"Error leyendo velas {ruta}: {e}")
+            return np.empty((0, 6))
+
+    def _guardar(self, symbol, timeframe, velas):
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            ruta = self._ruta(symbol, timeframe)
+            temporal = ruta + '.tmp.npy'
+            np.save(temporal, velas)
+            os.replace(temporal, ruta)  # escritura atómica
+        except Exception as e:
+            print(f"Error guardando velas de {symbol} {timeframe}: {e}")
+
+    # --- RED ---
+    def _get_gateway(self):
+        if self.gateway is None:
+            from model.market_gateway import market_gateway
+            self.gateway = market_gateway
+        return self.gateway
+
+    def _ohlcv(self, symbol, source, timeframe, since, limit):
+        """Una petición de velas por el gateway (bloquea como mucho su timeout)."""
+        gateway = self._get_gateway()
+        return gateway.run(gateway.ohlcv(symbol, source, timeframe, limit=limit, since=since))
+
+    def _fetch_crypto(self, symbol, timeframe, since, limit):
+        if since is not None:
+            return self._ohlcv(symbol, 'crypto', timeframe, int(since), None)
+
+        # Primera carga: paginamos hacia adelante hasta tener 'limit' velas
+        # (Kraken sólo guarda ~720 velas por timeframe, así que puede quedarse corto)
+        inicio = int(time.time() * 1000) - limit * TIMEFRAME_MS[timeframe]
+        filas = []
+        while len(filas) < limit:
+            pagina = self._ohlcv(symbol, 'crypto', timeframe, inicio, min(limit, 720))
+            if not pagina: break
+            filas.extend(pagina)
+            if pagina[-1][0] <= inicio: break
+            inicio = pagina[-1][0] + 1
+            if len(pagina) < min(limit, 720): break
+        return filas
+
+    def _fetch_yahoo(self, symbol, timeframe, since, limit):
+        if since is not None:
+            inicio = datetime.datetime.fromtimestamp(since / 1000, tz=datetime.timezone.utc)
+        else:
+            # La bolsa abre ~1/4 del día: pedimos días de sobra para completar 'limit' velas
+            dias = limit * TIMEFRAME_MS[timeframe] / DIA_MS
+            dias = dias * 1.5 if timeframe == '1d' else dias * 4
+            dias = min(math.ceil(dias) + 3, 729 if timeframe != '1d' else 3650)
+            inicio = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=dias)
+
+        return self._ohlcv(symbol, 'yahoo', timeframe, int(inicio.timestamp() * 1000), None)
+
+    # --- LÓGICA PRINCIPAL ---
+    def _lock_de(self, clave):
+        with self._lock:
+            if clave not in self._locks:
+                self._locks[clave] = threading.Lock()
+            return self._locks[clave]
+
+    def _necesita_refresco(self, clave, velas, timeframe, limit):
+        if len(velas) == 0: return True
+        # Piden más velas de las que hay: se completa el historial, salvo que el
+        # exchange ya haya dicho que no tiene más viejas
+        if len(velas) < limit and clave not in self._sin_historia: return True
+        ahora_ms = time.time() * 1000
+        barra_nueva = ahora_ms >= velas[-1, 0] + TIMEFRAME_MS[timeframe]
+        edad = time.monotonic() - self._refrescado.get(clave, 0)
+        return barra_nueva or edad >= self.refresco_min
+
+    def _refrescar(self, symbol, source, timeframe, limit, velas):
+        # Pedimos desde la última vela guardada (inclusive, porque estaba abierta).
+        # Sólo se recorre el historial completo si faltan velas y el exchange aún
+        # no nos dijo que no tiene más viejas (Kraken guarda ~720 por timeframe).
+        clave = (symbol, timeframe)
+        completa = len(velas) == 0 or (len(velas) < limit and clave not in self._sin_historia)
+        since = None if completa else int(velas[-1, 0])
+        if source == 'crypto':
+            filas = self._fetch_crypto(symbol, timeframe, since, limit)
+        else:
+            filas = self._fetch_yahoo(symbol, timeframe, since, limit)
+        self.fetches += 1
+        if completa and len(filas) < limit:
+            # Pedimos 'limit' y llegaron menos: no hay más historia, no volvemos a paginarla
+            self._sin_historia.add(clave)
+        if not filas: return velas
+
+        nuevas = np.asarray(filas, dtype=float).reshape(-1, 6)
+        nuevas = nuevas[np.argsort(nuevas[:, 0], kind='stable')]
+        # Lo viejo se queda hasta donde empieza lo nuevo; lo nuevo reemplaza el resto
+        viejas = np.asarray(velas)[np.asarray(velas)[:, 0] < nuevas[0, 0]] if len(velas) else np.empty((0, 6))
+        combinadas = np.vstack([viejas, nuevas])
+        _, idx = np.unique(combinadas[:, 0], return_index=True)
+        combinadas = combinadas[idx][-self.max_barras:]
+        self._guardar(symbol, timeframe, combinadas)
+        return combinadas
+
+    def get_candles(self, symbol, source, timeframe, limit=100):
+        """
+        Últimas 'limit' velas como array NumPy (N, 6), refrescando sólo la cola que falta.
+        El array devuelto es de sólo lectura (se comparte entre usuarios).
+        """
+        clave = (symbol, timeframe)
+        with self._lock_de(clave):
+            velas = self._series.get(clave)
+            cambio = velas is None
+            if cambio:
+                velas = self._cargar(symbol, timeframe)
+
+            if self._necesita_refresco(clave, velas, timeframe, limit):
+                try:
+                    velas = self._refrescar(symbol, source, timeframe, limit, velas)
+                    cambio = True
+                except Exception as e:
+                    # Sin red seguimos sirviendo lo que hay en disco
+                    print(f"Error refrescando velas {symbol} {timeframe}: {e}")
+                self._refrescado[clave] = time.monotonic()
+
+            if cambio:
+                velas = np.array(velas, dtype=float)
+                velas.setflags(write=False)
+                self._series[clave] = velas
+        return velas[-limit:]
+
+    def get_frame(self, symbol, source, timeframe, limit=100):
+        """Lo mismo que get_candles pero como DataFrame (columnas timestamp/open/.../volume)."""
+        return pd.DataFrame(self.get_candles(symbol, source, timeframe, limit), columns=COLUMNAS)
+
+
+# Instancia única del proceso (la web y el scheduler de bots comparten las velas)
+candle_store = CandleStore(
+    max_barras=int(os.environ.get('CANDLE_STORE_MAX_BARS', 50000)),
+    refresco_min=float(os.environ.get('CANDLE_REFRESH_SECONDS', 60))
+)
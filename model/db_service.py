@@ -1,24 +1,33 @@
-from firebase_config import db
+from model.storage import get_default_storage
 
 class DBService:
-    def __init__(self):
-        self.db = db
+    def __init__(self, storage=None):
+        # Por defecto según STORAGE_BACKEND (Pyrebase o SQLite); el scheduler pasa el del Admin SDK
+        self.storage = storage or get_default_storage()
 
     def save_user_profile(self, user_id, data, token):
         """Crea o actualiza el perfil de un usuario (autenticado)."""
         try:
             # .set() crea o reemplaza completamente.
-            self.db.child("users").child(user_id).set(data, token=token)
+            self.storage.set(f"users/{user_id}", data, token)
             return True
         except Exception as e:
             print("Error creando/actualizando perfil de usuario:", e)
             return False
 
+    def update_user_fields(self, user_id, fields, token):
+        """Actualiza sólo los campos dados del perfil (PATCH), sin leerlo ni reescribirlo completo."""
+        try:
+            self.storage.update(f"users/{user_id}", fields, token)
+            return True
+        except Exception as e:
+            print("Error actualizando campos del perfil:", e)
+            return False
+
     def get_user_profile(self, user_id, token):
         """Obtiene los datos de un usuario de la DB (autenticado)."""
         try:
-            data = self.db.child("users").child(user_id).get(token=token)
-            return data.val()
+            return self.storage.get(f"users/{user_id}", token)
         except Exception as e:
             print("Error al leer perfil:", e)
             return {} # Devuelve dict vacío en lugar de None
@@ -26,10 +35,8 @@ class DBService:
     def delete_user_data(self, user_id, token):
         """Elimina todos los datos de un usuario (perfil, bot, logs, keys)."""
         try:
-            self.db.child("users").child(user_id).remove(token=token)
-            self.db.child("bot_settings").child(user_id).remove(token=token)
-            self.db.child("trade_log").child(user_id).remove(token=token)
-            self.db.child("api_keys").child(user_id).remove(token=token)
+            for coleccion in ("users", "bot_settings", "trade_log", "ledger", "backtests", "api_keys"):
+                self.storage.remove(f"{coleccion}/{user_id}", token)
             return True
         except Exception as e:
             print(f"Error al eliminar datos de usuario: {e}")
@@ -0,0 +1,122 @@
+import bisect
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# --- SESIÓN HTTP COMPARTIDA PARA FIREBASE (REST) ---
+# Pyrebase hace todas sus llamadas con firebase.requests. La reemplazamos por una
+# sesión con pool de conexiones keep-alive (sin repetir el handshake TLS en cada
+# lectura), timeouts por defecto, reintentos con backoff y un histograma de latencia.
+# Variables de entorno: FIREBASE_POOL_SIZE, FIREBASE_CONNECT_TIMEOUT,
+# FIREBASE_READ_TIMEOUT, FIREBASE_RETRIES, FIREBASE_BACKOFF.
+
+# Límites superiores de cada cubeta (ms). La última cubeta es "más de 5 s".
+CUBETAS_MS = (5, 10, 20, 35, 50, 75, 100, 150, 250, 400, 600, 1000, 2000, 5000)
+
+
+class LatencyHistogram:
+    """Histograma de latencias por operación ('GET users', 'POST trade_log'...)."""
+
+    def __init__(self, cubetas=CUBETAS_MS):
+        self.cubetas = tuple(cubetas)
+        self._datos = {}  # operacion -> {"conteos": [...], "total_ms", "max_ms", "errores"}
+        self._lock = threading.Lock()
+
+    def registrar(self, operacion, ms, error=False):
+        with self._lock:
+            d = self._datos.get(operacion)
+            if d is None:
+                d = self._datos[operacion] = {"conteos": [0] * (len(self.cubetas) + 1), "total_ms": 0.0, "max_ms": 0.0, "errores": 0}
+            d["conteos"][bisect.bisect_left(self.cubetas, ms)] += 1
+            d["total_ms"] += ms
+            d["max_ms"] = max(d["max_ms"], ms)
+            if error: d["errores"] += 1
+
+    def _percentil(self, conteos, p, max_ms):
+        """Límite superior de la cubeta donde cae el percentil p (aproximado; en la última, el máximo visto)."""
+        total = sum(conteos)
+        if not total: return None
+        objetivo, acumulado = total * p, 0
+        for i, n in enumerate(conteos):
+            acumulado += n
+            if acumulado >= objetivo:
+                return self.cubetas[i] if i < len(self.cubetas) else round(max_ms, 2)
+        return None
+
+    def stats(self):
+        with self._lock:
+            salida = {}
+            for operacion, d in sorted(self._datos.items()):
+                n = sum(d["conteos"])
+                salida[operacion] = {
+                    "count": n,
+                    "errors": d["errores"],
+                    "avg_ms": round(d["total_ms"] / n, 2) if n else 0.0,
+                    "max_ms": round(d["max_ms"], 2),
+                    "p50_ms": self._percentil(d["conteos"], 0.50, d["max_ms"]),
+                    "p95_ms": self._percentil(d["conteos"], 0.95, d["max_ms"]),
+                    "p99_ms": self._percentil(d["conteos"], 0.99, d["max_ms"]),
+                    "buckets": dict(zip([f"<={c}" for c in self.cubetas] + [f">{self.cubetas[-1]}"], d["conteos"])),
+                }
+            return salida
+
+    def reset(self):
+        with self._lock:
+            self._datos.clear()
+
+
+def _operacion(method, url):
+    """'GET users' a partir de https://<db>.firebaseio.com/users/<uid>.json?auth=..."""
+    partes = urlsplit(url)
+    if 'firebaseio.com' not in partes.netloc and 'firebasedatabase.app' not in partes.netloc:
+        return f"{method} auth"
+    primero = partes.path.strip('/').split('/')[0].replace('.json', '')
+    return f"{method} {primero or '/'}"
+
+
+class PooledSession(requests.Session):
+    """requests.Session con timeout por defecto y medición de cada llamada."""
+
+    def __init__(self, histograma, timeout):
+        super().__init__()
+        self.histograma = histograma
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        inicio = time.perf_counter()
+        error = True
+        try:
+            respuesta = super().request(method, url, **kwargs)
+            error = respuesta.status_code >= 400
+            return respuesta
+        finally:
+            self.histograma.registrar(_operacion(method.upper(), url), (time.perf_counter() - inicio) * 1000, error)
+
+
+def crear_sesion(histograma=None):
+    """Sesión lista para asignar a firebase.requests (antes de crear auth() y database())."""
+    pool = int(os.environ.get('FIREBASE_POOL_SIZE', 20))
+    timeout = (float(os.environ.get('FIREBASE_CONNECT_TIMEOUT', 3.05)), float(os.environ.get('FIREBASE_READ_TIMEOUT', 10)))
+    # Reintentos: errores de conexión (la petición no salió) y 5xx/429 en métodos idempotentes.
+    # POST (push) queda fuera de los reintentos por estado para no duplicar trades.
+    reintentos = Retry(
+        total=int(os.environ.get('FIREBASE_RETRIES', 3)),
+        backoff_factor=float(os.environ.get('FIREBASE_BACKOFF', 0.3)),
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'PUT', 'PATCH', 'DELETE', 'HEAD', 'OPTIONS']),
+        raise_on_status=False
+    )
+    sesion = PooledSession(histograma or firebase_latency, timeout)
+    adaptador = HTTPAdapter(pool_connections=pool, pool_maxsize=pool, max_retries=reintentos, pool_block=False)
+    sesion.mount('https://', adaptador)
+    sesion.mount('http://', adaptador)
+    return sesion
+
+
+# Histograma único del proceso (lo expone /api/metrics)
+firebase_latency = LatencyHistogram()
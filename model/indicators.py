@@ -0,0 +1,227 @@
+import threading
+from collections import deque
+
+# --- INDICADORES INCREMENTALES (O(1) POR VELA) ---
+# En vez de reconstruir un DataFrame y hacer rolling() en cada petición, cada
+# indicador guarda su estado y se actualiza con la vela nueva en tiempo constante.
+# update(x)  -> llega una vela NUEVA
+# replace(x) -> la última vela (todavía abierta) cambió su cierre
+# value      -> valor actual (None mientras no haya suficientes velas)
+
+
+class SMA:
+    def __init__(self, period):
+        self.period = period
+        self._ventana = deque()
+        self._suma = 0.0
+
+    def update(self, x):
+        self._ventana.append(x)
+        self._suma += x
+        if len(self._ventana) > self.period:
+            self._suma -= self._ventana.popleft()
+        return self.value
+
+    def replace(self, x):
+        if not self._ventana: return self.update(x)
+        self._suma += x - self._ventana[-1]
+        self._ventana[-1] = x
+        return self.value
+
+    @property
+    def value(self):
+        if len(self._ventana) < self.period: return None
+        return self._suma / self.period
+
+
+class EMA:
+    """EMA con alpha = 2/(n+1), sembrada con el primer valor (como pandas ewm(adjust=False))."""
+
+    def __init__(self, period):
+        self.period = period
+        self.alpha = 2.0 / (period + 1)
+        self._anterior = None  # EMA antes de la última vela (para replace)
+        self._valor = None
+        self._n = 0
+
+    def update(self, x):
+        self._anterior = self._valor
+        self._valor = x if self._valor is None else self._valor + self.alpha * (x - self._valor)
+        self._n += 1
+        return self.value
+
+    def replace(self, x):
+        if self._n == 0: return self.update(x)
+        self._valor = x if self._anterior is None else self._anterior + self.alpha * (x - self._anterior)
+        return self.value
+
+    @property
+    def value(self):
+        # Igual que las demás: sin valor hasta tener 'period' velas
+        return self._valor if self._n >= self.period else None
+
+
+class RSI:
+    """
+    RSI con medias SIMPLES de ganancias y pérdidas (el mismo cálculo que
+    hacía get_ai_analysis con rolling(14).mean()).
+    """
+
+    def __init__(self, period=14):
+        self.period = period
+        self._ganancias = SMA(period)
+        self._perdidas = SMA(period)
+        self._cierre_previo = None  # cierre de la vela anterior a la última
+        self._ultimo = None
+
+    def _delta(self, x, previo):
+        # La primera vela no tiene delta: cuenta como 0 (igual que pandas con where(..., 0))
+        d = 0.0 if previo is None else x - previo
+        return max(d, 0.0), max(-d, 0.0)
+
+    def update(self, x):
+        self._cierre_previo = self._ultimo
+        self._ultimo = x
+        g, p = self._delta(x, self._cierre_previo)
+        self._ganancias.update(g)
+        self._perdidas.update(p)
+        return self.value
+
+    def replace(self, x):
+        if self._ultimo is None: return self.update(x)
+        self._ultimo = x
+        g, p = self._delta(x, self._cierre_previo)
+        self._ganancias.replace(g)
+        self._perdidas.replace(p)
+        return self.value
+
+    @property
+    def value(self):
+        g, p = self._ganancias.value, self._perdidas.value
+        if g is None or p is None: return None
+        if p == 0: return 100.0 if g > 0 else None
+        return 100 - (100 / (1 + g / p))
+
+
+class MACD:
+    """MACD clásico (12, 26, 9): línea, señal e histograma."""
+
+    def __init__(self, fast=12, slow=26, signal=9):
+        self.fast, self.slow = EMA(fast), EMA(slow)
+        self.signal = EMA(signal)
+
+    def _linea(self):
+        f, s = self.fast.value, self.slow.value
+        return None if f is None or s is None else f - s
+
+    def update(self, x):
+        self.fast.update(x)
+        self.slow.update(x)
+        linea = self._linea()
+        if linea is not None: self.signal.update(linea)
+        return self.value
+
+    def replace(self, x):
+        tenia_linea = self._linea() is not None
+        self.fast.replace(x)
+        self.slow.replace(x)
+        linea = self._linea()
+        if linea is not None:
+            if tenia_linea: self.signal.replace(linea)
+            else: self.signal.update(linea)
+        return self.value
+
+    @property
+    def value(self):
+        linea, senal = self._linea(), self.signal.value
+        if linea is None: return None
+        return {
+            "macd": linea,
+            "signal": senal,
+            "hist": None if senal is None else linea - senal
+        }
+
+
+def _indicadores_default():
+    """Set de indicadores que se mantiene por cada (symbol, timeframe)."""
+    return {
+        "sma_14": SMA(14),
+        "sma_20": SMA(20),
+        "sma_50": SMA(50),
+        "ema_12": EMA(12),
+        "ema_26": EMA(26),
+        "rsi_14": RSI(14),
+        "macd": MACD(12, 26, 9),
+    }
+
+
+class _Serie:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        self.indicadores = _indicadores_default()
+        self.ultimo_ts = None
+        self.close = None
+
+    def _alimentar(self, ts, close, nueva):
+        for ind in self.indicadores.values():
+            if nueva: ind.update(close)
+            else: ind.replace(close)
+        self.ultimo_ts, self.close = ts, close
+
+
+class IndicatorEngine:
+    """
+    Estado de indicadores por (symbol, timeframe), compartido por todo el proceso.
+    sync() recibe las velas del CandleStore y sólo procesa lo que no había visto.
+    """
+
+    def __init__(self):
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _serie(self, clave):
+        with self._lock:
+            if clave not in self._series:
+                self._series[clave] = _Serie()
+            return self._series[clave]
+
+    def sync(self, symbol, timeframe, velas):
+        """
+        Pone al día los indicadores con las velas [ts, o, h, l, c, v] y devuelve los valores.
+        - Vela con el mismo timestamp que la última vista -> replace (barra abierta).
+        - Velas posteriores -> update, una por una.
+        - Si hay un hueco (nos saltamos velas) se reinicia y se recalienta con todo el array.
+        """
+        serie = self._serie((symbol, timeframe))
+        with serie.lock:
+            if len(velas) == 0: return self._valores(serie)
+            inicio = 0
+            if serie.ultimo_ts is not None:
+                # Buscamos la última vela vista dentro del array (vienen ordenadas)
+                pos = None
+                for i in range(len(velas) - 1, -1, -1):
+                    if velas[i][0] <= serie.ultimo_ts:
+                        pos = i
+                        break
+                if pos is not None and velas[pos][0] == serie.ultimo_ts:
+                    serie._alimentar(velas[pos][0], float(velas[pos][4]), nueva=False)
+                    inicio = pos + 1
+                else:
+                    serie.reiniciar()
+
+            for fila in velas[inicio:]:
+                serie._alimentar(fila[0], float(fila[4]), nueva=True)
+            return self._valores(serie)
+
+    def _valores(self, serie):
+        valores = {nombre: ind.value for nombre, ind in serie.indicadores.items()}
+        valores["close"] = serie.close
+        valores["timestamp"] = serie.ultimo_ts
+        return valores
+
+
+# Instancia única del proceso
+indicator_engine = IndicatorEngine()
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import threading
+import time
+import aiohttp
+
+# --- INGESTA EN VIVO DE KRAKEN (WEBSOCKET v2) ---
+# Una conexión larga suscrita al canal 'ticker' (mejor bid/ask y último precio) de los
+# pares del conversor/bots. El estado más reciente queda en memoria y get_real_price
+# lo lee sin tocar la API REST (sin rate limit). Las velas siguen saliendo de
+# CandleStore. Para pruebas, replay() alimenta el mismo procesador con mensajes
+# grabados (JSONL) en su propio hilo.
+
+KRAKEN_WS_URL = "wss://ws.kraken.com/v2"
+
+
+class KrakenFeed:
+
+    def __init__(self, pares, hub=None, url=KRAKEN_WS_URL, max_edad=15.0, grabar=None):
+        self.pares = list(pares)
+        self.hub = hub                      # PriceHub opcional: cada ticker se publica a los navegadores
+        self.url = url
+        self.max_edad = max_edad            # segundos sin ticker de un par -> su precio deja de servirse
+        self.grabar = grabar                # ruta JSONL para grabar lo recibido (sirve para replay)
+
+        self._top = {}                      # symbol -> {bid, bid_qty, ask, ask_qty, last, ts}
+        self._recibido = {}                 # symbol -> time.monotonic() del último ticker de ese par
+        self._lock = threading.Lock()
+        self._ultimo_mensaje = None         # time.monotonic() del último mensaje (incluye heartbeats)
+        self._detener = False
+        self.mensajes = 0
+        self.reconexiones = 0
+
+    # --- ESTADO (lecturas O(1)) ---
+    def conectado(self):
+        return self._ultimo_mensaje is not None and time.monotonic() - self._ultimo_mensaje < self.max_edad
+
+    def price(self, symbol):
+        """
+        Último precio del par, o None si no llegó un ticker de ESE par en los últimos
+        'max_edad' segundos (usar REST). Los heartbeats y los mensajes de otros pares
+        mantienen viva la conexión, pero no dicen nada de este precio.
+        """
+        with self._lock:
+            top = self._top.get(symbol)
+            if not top or time.monotonic() - self._recibido.get(symbol, 0) >= self.max_edad: return None
+            return top.get('last')
+
+    def top(self, symbol):
+        """Mejor bid/ask actual del par (copia) o None."""
+        with self._lock:
+            top = self._top.get(symbol)
+            return dict(top) if top else None
+
+    # --- PROCESAMIENTO DE MENSAJES ---
+    def procesar(self, mensaje):
+        """Aplica un mensaje del WebSocket (dict o texto JSON) al estado en memoria."""
+        if isinstance(mensaje, (str, bytes)): mensaje = json.loads(mensaje)
+        self._ultimo_mensaje = time.monotonic()
+        self.mensajes += 1
+
+        canal = mensaje.get('channel')
+        if canal == 'ticker':
+            for d in mensaje.get('data', []):
+                symbol = d.get('symbol')
+                if not symbol: continue
+                with self._lock:
+                    top = self._top.setdefault(symbol, {})
+                    for campo in ('bid', 'bid_qty', 'ask', 'ask_qty', 'last'):
+                        if d.get(campo) is not None: top[campo] = float(d[campo])
+                    top['ts'] = time.time()
+                    self._recibido[symbol] = time.monotonic()
+                if self.hub is not None and top.get('last'):
+                    self.hub.publish('crypto', symbol, top['last'])
+
+    def _suscripciones(self):
+        return [
+            {"method": "subscribe", "params": {"channel": "ticker", "symbol": self.pares}},
+        ]
+
+    # --- CONEXIÓN EN VIVO ---
+    async def run(self):
+        """Conecta y se mantiene conectado (reintento con backoff exponencial hasta 60 s)."""
+        espera = 1
+        archivo = open(self.grabar, 'a', encoding='utf-8') if self.grabar else None
+        try:
+            while not self._detener:
+                try:
+                    async with aiohttp.ClientSession() as sesion:
+                        async with sesion.ws_connect(self.url, heartbeat=30) as ws:
+                            for sub in self._suscripciones():
+                                await ws.send_json(sub)
+                            espera = 1
+                            async for msg in ws:
+                                if self._detener: break
+                                if msg.type != aiohttp.WSMsgType.TEXT: break
+                                if archivo: archivo.write(msg.data + "\n")
+                                self.procesar(msg.data)
+                except Exception as e:
+                    print(f"Kraken WS desconectado: {e}")
+                if self._detener: break
+                self.reconexiones += 1
+                await asyncio.sleep(espera)
+                espera = min(espera * 2, 60)
+        finally:
+            if archivo: archivo.close()
+
+    def start(self, gateway):
+        """Lanza run() en el event loop del MarketDataGateway."""
+        self._detener = False
+        return gateway.submit(self.run())
+
+    def stop(self):
+        self._detener = True
+
+    # --- REPLAY (PRUEBAS) ---
+    def start_replay(self, fuente, pausa=0.0):
+        """
+        Lanza replay() en un hilo propio: con 'pausa' dura lo que la grabación, y en el
+        pool de tareas del gateway tendría ocupado un hilo todo ese tiempo.
+        """
+        self._detener = False
+        hilo = threading.Thread(target=self.replay, args=(fuente, pausa), name="kraken-replay", daemon=True)
+        hilo.start()
+        return hilo
+
+    def replay(self, fuente, pausa=0.0):
+        """
+        Reproduce mensajes grabados: 'fuente' es una ruta JSONL o un iterable de
+        mensajes (dict o texto). 'pausa' = segundos entre mensajes (0 = lo más rápido posible).
+        """
+        lineas = open(fuente, encoding='utf-8') if isinstance(fuente, str) else fuente
+        try:
+            for linea in lineas:
+                if self._detener: break
+                if isinstance(linea, str):
+                    linea = linea.strip()
+                    if not linea: continue
+                self.procesar(linea)
+                if pausa: time.sleep(pausa)
+        finally:
+            if isinstance(fuente, str): lineas.close()
+
+    def stats(self):
+        return {
+            "connected": self.conectado(),
+            "messages": self.mensajes,
+            "reconnects": self.reconexiones,
+            "symbols": sorted(self._top),
+        }
@@ -0,0 +1,113 @@
+import datetime
+
+# --- LIBRO CONTABLE MATERIALIZADO (SNAPSHOT) ---
+# En lugar de re-sumar todo el trade_log en cada acción, guardamos por usuario:
+#   {
+#     "cash": 99871.5,
+#     "posiciones": {"BTC_USD": {"activo": "BTC/USD", "qty": 0.002, "cost": 128.5}},
+#     "last_trade_key": "-NxAbc...",   # último trade aplicado (push key de Firebase)
+#     "trade_count": 2,
+#     "ultimo_seq": 2,                 # 'seq' del último trade (orden de llegada, ver abajo)
+#     "updated_at": "2025-01-01T12:00:00"
+#   }
+# Se actualiza trade a trade (O(1)) y sólo se recalcula completo si no cuadra.
+#
+# El orden de los trades NO sale de la clave: las claves nuevas las genera cada
+# proceso con su reloj, y un reloj atrasado las ordenaría antes que otras más
+# viejas. Cada trade lleva 'seq' = ultimo_seq + 1 del ledger en que se aplicó, y
+# el historial se reproduce por 'seq'. Los trades anteriores a 'seq' (push keys
+# del servidor) van primero, en orden de clave.
+
+SALDO_INICIAL = 100000.0
+
+
+def _clave_activo(symbol):
+    """Firebase no acepta '/', '.', '$', '#', '[' ni ']' en las claves."""
+    clave = str(symbol)
+    for c in '/.$#[]':
+        clave = clave.replace(c, '_')
+    return clave
+
+
+def ledger_vacio():
+    return {
+        "cash": SALDO_INICIAL,
+        "posiciones": {},
+        "last_trade_key": None,
+        "trade_count": 0,
+        "ultimo_seq": 0,
+        "updated_at": datetime.datetime.now().isoformat()
+    }
+
+
+def aplicar_trade(snapshot, trade, trade_key=None):
+    """Aplica UN trade al snapshot (misma matemática que la conciliación completa)."""
+    tipo = trade.get('tipo')
+    total = float(trade.get('total_operacion', 0))
+    qty = float(trade.get('cantidad', 0))
+    price = float(trade.get('precio_entrada', 0))
+    asset = trade.get('activo')
+
+    # Firebase no guarda diccionarios vacíos, así que puede venir sin 'posiciones'
+    posiciones = snapshot.setdefault('posiciones', {}) or {}
+    snapshot['posiciones'] = posiciones
+
+    if tipo == 'COMPRA':
+        snapshot['cash'] = float(snapshot.get('cash', SALDO_INICIAL)) - total
+    elif tipo == 'VENTA':
+        snapshot['cash'] = float(snapshot.get('cash', SALDO_INICIAL)) + total
+
+    if asset and tipo in ('COMPRA', 'VENTA'):
+        pos = posiciones.setdefault(_clave_activo(asset), {"activo": asset, "qty": 0.0, "cost": 0.0})
+        if tipo == 'COMPRA':
+            pos['qty'] = float(pos.get('qty', 0)) + qty
+            pos['cost'] = float(pos.get('cost', 0)) + (qty * price)
+        else:
+            # Al vender reducimos el costo a precio promedio (el promedio de lo que queda no cambia)
+            if pos.get('qty', 0) > 0:
+                avg_price = pos['cost'] / pos['qty']
+                pos['cost'] = float(pos['cost']) - (qty * avg_price)
+            pos['qty'] = float(pos.get('qty', 0)) - qty
+
+    if trade_key: snapshot['last_trade_key'] = trade_key
+    snapshot['trade_count'] = int(snapshot.get('trade_count', 0)) + 1
+    snapshot['ultimo_seq'] = max(int(snapshot.get('ultimo_seq') or 0), int(trade.get('seq') or 0))
+    snapshot['updated_at'] = datetime.datetime.now().isoformat()
+    return snapshot
+
+
+def siguiente_seq(snapshot):
+    """'seq' que le toca al próximo trade aplicado sobre este snapshot."""
+    return max(int(snapshot.get('ultimo_seq') or 0), int(snapshot.get('trade_count', 0))) + 1
+
+
+def orden_de_llegada(key, trade):
+    """Clave de orden del historial: primero los trades sin 'seq' (por clave), luego por 'seq'."""
+    seq = trade.get('seq') if isinstance(trade, dict) else None
+    return (0, 0, key) if seq is None else (1, int(seq), key)
+
+
+def reconstruir(trade_log):
+    """Recalcula el snapshot desde cero a partir del trade_log completo {key: trade}."""
+    snapshot = ledger_vacio()
+    if not isinstance(trade_log, dict): return snapshot
+    for key in sorted(trade_log, key=lambda k: orden_de_llegada(k, trade_log[k])):
+        trade = trade_log[key]
+        if isinstance(trade, dict):
+            aplicar_trade(snapshot, trade, key)
+    return snapshot
+
+
+def cantidad_en_cartera(snapshot, symbol):
+    """Cuánto hay de un activo (nunca negativo por residuos de redondeo)."""
+    pos = (snapshot.get('posiciones') or {}).get(_clave_activo(symbol))
+    if not pos: return 0.0
+    return max(0.0, float(pos.get('qty', 0)))
+
+
+def posiciones_por_activo(snapshot):
+    """{'BTC/USD': {'qty': 0.5, 'total_cost': 25000.0}} (formato de get_performance_data)."""
+    holdings = {}
+    for pos in (snapshot.get('posiciones') or {}).values():
+        holdings[pos.get('activo')] = {'qty': float(pos.get('qty', 0)), 'total_cost': float(pos.get('cost', 0))}
+    return holdings
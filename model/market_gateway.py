@@ -0,0 +1,188 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+# ccxt trae su versión asyncio en ccxt.async_support (usa aiohttp)
+import ccxt.async_support as ccxt_async
+
+# --- GATEWAY ASÍNCRONO DE DATOS DE MERCADO ---
+# Un event loop propio en un hilo de fondo atiende TODAS las peticiones de mercado:
+#   - Kraken con ccxt asíncrono (muchas peticiones en paralelo sobre un solo cliente).
+#   - Yahoo (yfinance es bloqueante) en un pool de hilos acotado.
+# Cada fuente tiene su límite de concurrencia (semáforo) y su timeout, que cuenta
+# también la espera en el semáforo, así que un Yahoo lento ya no congela el worker
+# de Flask más allá del timeout.
+# Desde el código síncrono se usa submit()/run(); submit devuelve un Future sin bloquear.
+
+LIMITES_DEFAULT = {"crypto": 8, "yahoo": 4}
+TIMEOUTS_DEFAULT = {"crypto": 5.0, "yahoo": 10.0}
+
+# run() sin timeout explícito espera el mayor timeout por fuente más este margen
+MARGEN_RUN = 2.0
+
+
+def ultimos_cierres(data, symbols):
+    """Del DataFrame de yf.download (multi-ticker) -> {symbol: último cierre > 0}."""
+    precios = {}
+    if data is None or data.empty: return precios
+    closes = data['Close']
+    if isinstance(closes, pd.Series): closes = closes.to_frame(symbols[0])
+    for symbol in symbols:
+        if symbol not in closes.columns: continue
+        serie = closes[symbol].dropna()
+        if not serie.empty and float(serie.iloc[-1]) > 0:
+            precios[symbol] = float(serie.iloc[-1])
+    return precios
+
+
+class MarketDataGateway:
+
+    def __init__(self, limites=None, timeouts=None, exchange=None, yahoo=None):
+        # exchange/yahoo: clientes alternativos con la misma interfaz (ej. el mercado simulado)
+        self.yf = yahoo or yf
+        self.limites = dict(LIMITES_DEFAULT, **(limites or {}))
+        self.timeouts = dict(TIMEOUTS_DEFAULT, **(timeouts or {}))
+        self._loop = None
+        self._hilo = None
+        self._lock = threading.Lock()
+        self._semaforos = {}
+        self._exchange = exchange
+        # Hilos para yfinance (bloqueante) y, aparte, para las tareas síncronas del ViewModel:
+        # si compartieran pool, tareas esperando a Yahoo podrían ocupar los hilos que Yahoo necesita
+        self._pool = ThreadPoolExecutor(max_workers=self.limites["yahoo"] * 2, thread_name_prefix="market-io")
+        self._tareas = ThreadPoolExecutor(max_workers=16, thread_name_prefix="market-task")
+
+    # --- CICLO DE VIDA DEL LOOP ---
+    def _arrancar(self):
+        if self._loop is not None: return
+        with self._lock:
+            if self._loop is not None: return
+            loop = asyncio.new_event_loop()
+            listo = threading.Event()
+
+            def correr():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(listo.set)
+                loop.run_forever()
+
+            self._hilo = threading.Thread(target=correr, name="market-gateway", daemon=True)
+            self._hilo.start()
+            listo.wait()
+            self._loop = loop
+
+    def submit(self, coro):
+        """Programa la corrutina en el loop del gateway y devuelve un concurrent.futures.Future."""
+        self._arrancar()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro, timeout=None):
+        """
+        Versión bloqueante de submit() (para el código síncrono existente). Nunca espera
+        para siempre: sin 'timeout' usa el mayor de las fuentes + MARGEN_RUN, y si vence
+        cancela la corrutina y lanza TimeoutError.
+        """
+        if timeout is None: timeout = max(self.timeouts.values()) + MARGEN_RUN
+        futuro = self.submit(coro)
+        try:
+            return futuro.result(timeout)
+        except FutureTimeout:
+            futuro.cancel()
+            raise
+
+    def call(self, fn, *args):
+        """Ejecuta una función síncrona en el pool del gateway -> Future (no bloquea al que llama)."""
+        return self._tareas.submit(fn, *args)
+
+    def close(self):
+        if self._loop is None: return
+        if self._exchange is not None:
+            self.run(self._exchange.close(), timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._pool.shutdown(wait=False)
+        self._tareas.shutdown(wait=False)
+
+    # --- LÍMITES POR FUENTE ---
+    def _semaforo(self, source):
+        # Se crean dentro del loop (los semáforos quedan ligados a él)
+        if source not in self._semaforos:
+            self._semaforos[source] = asyncio.Semaphore(self.limites.get(source, 4))
+        return self._semaforos[source]
+
+    async def _limitado(self, source, coro):
+        """Corre 'coro' con el límite de la fuente; el timeout incluye la espera en la fila."""
+        async def en_fila():
+            async with self._semaforo(source):
+                return await coro
+        try:
+            return await asyncio.wait_for(en_fila(), self.timeouts.get(source, 10.0))
+        finally:
+            coro.close()  # si venció esperando turno, la corrutina nunca arrancó
+
+    def _kraken(self):
+        if self._exchange is None:
+            self._exchange = ccxt_async.kraken({'enableRateLimit': True})
+        return self._exchange
+
+    async def _yahoo(self, fn, *args, **kwargs):
+        # El hilo se pide ya dentro del semáforo: si no, la llamada arrancaría igual
+        # aunque la fuente estuviera al límite
+        loop = asyncio.get_running_loop()
+
+        async def en_pool():
+            return await loop.run_in_executor(self._pool, lambda: fn(*args, **kwargs))
+        return await self._limitado("yahoo", en_pool())
+
+    # --- PETICIONES (corrutinas) ---
+    async def ticker(self, symbol):
+        return await self._limitado("crypto", self._kraken().fetch_ticker(symbol))
+
+    async def quote(self, symbol, source):
+        """Último precio (> 0) del símbolo. Lanza excepción si falla o si es inválido."""
+        if source == 'crypto':
+            price = float((await self.ticker(symbol))['last'])
+        else:
+            # 'fast_info' es más rápido y fiable para el precio actual
+            price = float(await self._yahoo(lambda: self.yf.Ticker(symbol).fast_info.last_price))
+        if not price or price <= 0:
+            raise ValueError(f"Precio inválido: {price}")
+        return price
+
+    async def quotes_batch(self, source, symbols):
+        """Una sola llamada de red para varios símbolos de la misma fuente -> {symbol: precio}."""
+        if source == 'crypto':
+            tickers = await self._limitado("crypto", self._kraken().fetch_tickers(symbols))
+            return {s: float(tickers[s]['last']) for s in symbols if (tickers.get(s) or {}).get('last')}
+        data = await self._yahoo(self.yf.download, symbols, period="5d", interval="1d", progress=False,
+                                 group_by='column', auto_adjust=False)
+        return ultimos_cierres(data, symbols)
+
+    async def ohlcv(self, symbol, source, timeframe='1h', limit=100, since=None):
+        """Velas [ts_ms, o, h, l, c, v] desde 'since' (ms, opcional); 'limit'=None = las que haya."""
+        if source == 'crypto':
+            return await self._limitado("crypto", self._kraken().fetch_ohlcv(symbol, timeframe, since=since, limit=limit))
+        kwargs = {"interval": timeframe}
+        if since is not None: kwargs["start"] = pd.to_datetime(since, unit='ms', utc=True)
+        else: kwargs["period"] = "1y" if timeframe in ('1d', '1wk', '1mo') else "60d"
+        hist = await self._yahoo(lambda: self.yf.Ticker(symbol).history(**kwargs))
+        if hist is None or hist.empty: return []
+        if limit: hist = hist.tail(limit)
+        ts = hist.index.as_unit('ms').asi8  # ms UTC (el índice puede venir en ns o en ms)
+        columnas = hist[['Open', 'High', 'Low', 'Close', 'Volume']].to_numpy(dtype=float)
+        return np.column_stack([ts, columnas]).tolist()
+
+
+# Instancia única del proceso (límites y timeouts configurables por entorno)
+market_gateway = MarketDataGateway(
+    limites={
+        "crypto": int(os.environ.get('MARKET_CRYPTO_CONCURRENCY', 8)),
+        "yahoo": int(os.environ.get('MARKET_YAHOO_CONCURRENCY', 4)),
+    },
+    timeouts={
+        "crypto": float(os.environ.get('MARKET_CRYPTO_TIMEOUT', 5)),
+        "yahoo": float(os.environ.get('MARKET_YAHOO_TIMEOUT', 10)),
+    }
+)
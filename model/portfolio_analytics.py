@@ -0,0 +1,262 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from model.candle_store import TIMEFRAME_MS
+from model.ledger import SALDO_INICIAL
+
+# --- ANALÍTICA DE PORTAFOLIO VECTORIZADA ---
+# El trade_log se convierte UNA vez en columnas NumPy (TradeColumns) y se guarda por
+# usuario; cuando llegan trades nuevos sólo se leen y se agregan esos. Sobre las
+# columnas, todo es aritmética de arrays (sin bucle por trade):
+#   - costo promedio, PnL realizado por venta y no realizado por activo (misma regla que el ledger),
+#   - curva de capital valorizada con las velas guardadas (CandleStore),
+#   - máx. drawdown, volatilidad, Sharpe y Sortino (tasa libre de riesgo = 0), win rate.
+
+PERIODOS_POR_ANIO = {'1h': 24 * 365, '4h': 6 * 365, '1d': 365}
+DIAS_CURVA_HORARIA = 30   # historiales más cortos se grafican en velas de 1h; los largos en 1d
+EPS = 1e-9
+
+
+def _a_segundos(textos):
+    """Timestamps "YYYY-mm-dd HH:MM:SS" -> segundos epoch (int64). Los ilegibles quedan en 0."""
+    try:
+        return np.array(textos, dtype='datetime64[s]').astype(np.int64)
+    except ValueError:
+        salida = np.zeros(len(textos), dtype=np.int64)
+        for i, texto in enumerate(textos):
+            try: salida[i] = np.datetime64(texto, 's').astype(np.int64)
+            except ValueError: pass
+        return salida
+
+
+class TradeColumns:
+    """El trade_log en columnas (una fila por trade, en orden de 'seq' = orden de llegada)."""
+
+    def __init__(self, ts, activo, signo, qty, precio, total, activos, ultimo_seq=0):
+        self.ts = ts                # int64, segundos epoch
+        self.activo = activo        # int32, índice en 'activos'
+        self.signo = signo          # +1 COMPRA, -1 VENTA, 0 otro tipo
+        self.qty = qty
+        self.precio = precio
+        self.total = total          # total_operacion (lo que movió el efectivo)
+        self.activos = activos      # ['BTC/USD', 'EC', ...]
+        self.ultimo_seq = ultimo_seq  # 'seq' del último trade cargado (0 si no hay)
+
+    def __len__(self):
+        return len(self.ts)
+
+    @classmethod
+    def desde_trades(cls, trades, activos=None):
+        """
+        Iterable de (clave, trade) en orden de 'seq' -> columnas. Es el único recorrido en Python;
+        'activos' permite extender la numeración de otras columnas ya cargadas.
+        """
+        activos = list(activos or [])
+        indice = {a: i for i, a in enumerate(activos)}
+        ts, activo, signo, qty, precio, total = [], [], [], [], [], []
+        ultimo = 0
+        for clave, trade in trades:
+            if not isinstance(trade, dict): continue
+            ultimo = max(ultimo, int(trade.get('seq') or 0))
+            nombre = trade.get('activo')
+            if nombre not in indice:
+                indice[nombre] = len(activos)
+                activos.append(nombre)
+            tipo = trade.get('tipo')
+            ts.append(trade.get('timestamp') or '1970-01-01 00:00:00')
+            activo.append(indice[nombre])
+            signo.append(1 if tipo == 'COMPRA' else -1 if tipo == 'VENTA' else 0)
+            qty.append(float(trade.get('cantidad', 0) or 0))
+            precio.append(float(trade.get('precio_entrada', 0) or 0))
+            total.append(float(trade.get('total_operacion', 0) or 0))
+        return cls(_a_segundos(ts), np.array(activo, dtype=np.int32), np.array(signo, dtype=np.int8),
+                   np.array(qty), np.array(precio), np.array(total), activos, ultimo)
+
+    def concatenar(self, nuevas):
+        """Columnas con los trades de 'nuevas' al final (creadas con activos=self.activos)."""
+        return TradeColumns(np.concatenate([self.ts, nuevas.ts]), np.concatenate([self.activo, nuevas.activo]),
+                            np.concatenate([self.signo, nuevas.signo]), np.concatenate([self.qty, nuevas.qty]),
+                            np.concatenate([self.precio, nuevas.precio]), np.concatenate([self.total, nuevas.total]),
+                            nuevas.activos, max(self.ultimo_seq, nuevas.ultimo_seq))
+
+
+def _por_tramo(x, inicio_tramo):
+    """Suma acumulada que vuelve a empezar en cada posición marcada en 'inicio_tramo'."""
+    acumulado = np.cumsum(x)
+    tramo = np.cumsum(inicio_tramo) - 1
+    base = (acumulado - x)[np.flatnonzero(inicio_tramo)]
+    return acumulado - base[tramo]
+
+
+def costo_promedio(signo, qty, precio):
+    """
+    Posición, costo base y PnL realizado trade a trade de UN activo, a costo promedio
+    (la regla de ledger.aplicar_trade) sin bucle:
+      compra: C += qty * precio        venta: C *= q_despues / q_antes
+    Es una recurrencia lineal C_t = f_t * C_{t-1} + a_t, que se resuelve como
+    C_t = F_t * Σ a_k / F_k con F = producto acumulado de f. Cada cierre total de la
+    posición abre un tramo nuevo (F vuelve a 1).
+    """
+    delta = signo * qty
+    q = np.cumsum(delta)
+    q_antes = q - delta
+    venta = (signo < 0) & (q_antes > EPS)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factor = np.where(venta, np.clip(q / q_antes, 0.0, 1.0), 1.0)
+    plano = q <= EPS
+    # El paso que cierra la posición deja C = 0: se calcula con factor 1 y se anula con la máscara
+    factor = np.where(plano, 1.0, factor)
+
+    inicio_tramo = np.ones(len(q), dtype=bool)
+    inicio_tramo[1:] = plano[:-1]
+    F = np.exp(_por_tramo(np.log(np.maximum(factor, EPS)), inicio_tramo))
+    aporte = np.where(signo > 0, qty * precio, 0.0)
+    costo = np.where(plano, 0.0, F * _por_tramo(aporte / F, inicio_tramo))
+
+    costo_antes = np.concatenate([[0.0], costo[:-1]])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        promedio_antes = np.where(q_antes > EPS, costo_antes / q_antes, 0.0)
+    pnl = np.where(venta, qty * (precio - promedio_antes), 0.0)
+    return np.maximum(q, 0.0), costo, pnl
+
+
+def metricas_de_riesgo(equity, periodos_por_anio):
+    """Máx. drawdown, volatilidad anualizada, Sharpe y Sortino de una curva de capital."""
+    equity = np.asarray(equity, dtype=float)
+    if len(equity) < 3 or np.any(equity <= 0):
+        return {"max_drawdown_pct": 0.0, "volatilidad_pct": 0.0, "sharpe": 0.0, "sortino": 0.0}
+    retornos = np.diff(equity) / equity[:-1]
+    drawdown = 1 - equity / np.maximum.accumulate(equity)
+    anual = np.sqrt(periodos_por_anio)
+    media, desv = retornos.mean(), retornos.std(ddof=1)
+    desv_abajo = np.sqrt(np.mean(np.minimum(retornos, 0.0) ** 2))
+    return {
+        "max_drawdown_pct": round(float(drawdown.max()) * 100, 2),
+        "volatilidad_pct": round(float(desv * anual) * 100, 2),
+        "sharpe": round(float(media / desv * anual), 2) if desv > EPS else 0.0,
+        "sortino": round(float(media / desv_abajo * anual), 2) if desv_abajo > EPS else 0.0,
+    }
+
+
+def _ultimo_hasta(tiempos, valores, grilla, defecto):
+    """valores[i] del último tiempos[i] <= t para cada t de la grilla ('defecto' si no hay)."""
+    i = np.searchsorted(tiempos, grilla, side='right') - 1
+    return np.where(i >= 0, valores[np.maximum(i, 0)], defecto) if len(valores) else np.full(len(grilla), defecto)
+
+
+def analizar(cols, velas_fn, precios_actuales, ahora=None):
+    """
+    Métricas completas del portafolio.
+    velas_fn(symbol, timeframe, limite) -> array (N, 6) de velas [ts_ms, o, h, l, c, v];
+    precios_actuales: {symbol: precio} para valorizar el último punto (hoy).
+    """
+    if len(cols) == 0: return None
+    ahora = int(ahora or time.time())
+    # Relojes desordenados no deben romper las búsquedas: el tiempo nunca retrocede
+    ts = np.maximum.accumulate(cols.ts)
+
+    timeframe = '1h' if ahora - ts[0] <= DIAS_CURVA_HORARIA * 86400 else '1d'
+    paso = TIMEFRAME_MS[timeframe] // 1000
+    # Primer trade, cierre de cada vela desde entonces y ahora
+    grilla = np.concatenate([[ts[0]], np.arange(ts[0] - ts[0] % paso + paso, ahora, paso), [ahora]])
+
+    efectivo = SALDO_INICIAL - np.cumsum(cols.signo * cols.total)
+    equity = _ultimo_hasta(ts, efectivo, grilla, SALDO_INICIAL)
+
+    por_activo, ventas, ganadoras = [], 0, 0
+    realizado_total = no_realizado_total = 0.0
+    for a, symbol in enumerate(cols.activos):   # bucle por activo, no por trade
+        m = cols.activo == a
+        if not symbol or not m.any(): continue
+        q, costo, pnl = costo_promedio(cols.signo[m].astype(float), cols.qty[m], cols.precio[m])
+        ts_a, precio_a = ts[m], cols.precio[m]
+
+        # Precio en cada punto: cierre de la última vela guardada o, si no hay, el último precio operado
+        precio_grilla = _ultimo_hasta(ts_a, precio_a, grilla, 0.0)
+        try:
+            velas = velas_fn(symbol, timeframe, len(grilla) + 1)
+            if velas is not None and len(velas):
+                # Cada cierre vale desde que la vela termina (apertura + paso), sin mirar al futuro
+                ts_velas = (velas[:, 0] // 1000).astype(np.int64) + paso
+                cierre = _ultimo_hasta(ts_velas, velas[:, 4], grilla, 0.0)
+                precio_grilla = np.where(cierre > 0, cierre, precio_grilla)
+        except Exception as e:
+            print(f"Sin velas para valorizar {symbol}: {e}")
+        precio_hoy = float(precios_actuales.get(symbol) or precio_grilla[-1] or precio_a[-1])
+        precio_grilla[-1] = precio_hoy
+        equity = equity + _ultimo_hasta(ts_a, q, grilla, 0.0) * precio_grilla
+
+        es_venta = cols.signo[m] < 0
+        realizado = float(pnl.sum())
+        no_realizado = float(q[-1] * precio_hoy - costo[-1]) if q[-1] > EPS else 0.0
+        ventas += int(es_venta.sum())
+        # Ganadora = al menos un centavo (el ruido de punto flotante no cuenta)
+        ganadoras += int((np.round(pnl[es_venta], 2) > 0).sum())
+        realizado_total += realizado
+        no_realizado_total += no_realizado
+        por_activo.append({
+            "activo": symbol,
+            "operaciones": int(m.sum()),
+            "cantidad": float(q[-1]),
+            "costo": float(costo[-1]),
+            "precio_actual": precio_hoy,
+            "pnl_realizado": round(realizado, 2),
+            "pnl_no_realizado": round(no_realizado, 2),
+        })
+
+    etiquetas = np.datetime_as_string(grilla.astype('datetime64[s]'), unit='m')
+    resultado = {
+        "timeframe": timeframe,
+        "curva_labels": [e[5:].replace('T', ' ') for e in etiquetas],
+        "curva_equity": np.round(equity, 2).tolist(),
+        "win_rate_pct": round(ganadoras / ventas * 100, 2) if ventas else 0.0,
+        "ventas": ventas,
+        "pnl_realizado": round(realizado_total, 2),
+        "pnl_no_realizado": round(no_realizado_total, 2),
+        "por_activo": sorted(por_activo, key=lambda x: -abs(x['pnl_realizado'] + x['pnl_no_realizado'])),
+    }
+    resultado.update(metricas_de_riesgo(equity, PERIODOS_POR_ANIO[timeframe]))
+    return resultado
+
+
+class TradeColumnsCache:
+    """
+    Columnas por usuario, validadas contra el ledger (último 'seq' y número de trades).
+    Si sólo llegaron trades nuevos se leen y se agregan esos; si no cuadra, se recarga todo.
+    """
+
+    def __init__(self, max_usuarios=256):
+        self.max_usuarios = max_usuarios
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self.cargas_completas = 0
+        self.cargas_parciales = 0
+
+    def get(self, user_id, snapshot, cargar):
+        """cargar(despues_de_seq) -> iterable de (clave, trade) en orden de 'seq'."""
+        ultimo, total = int(snapshot.get('ultimo_seq') or 0), int(snapshot.get('trade_count', 0))
+        with self._lock:
+            cols = self._datos.get(user_id)
+            if cols is not None: self._datos.move_to_end(user_id)
+        if cols is not None and cols.ultimo_seq == ultimo and len(cols) == total:
+            return cols
+
+        if cols is not None and cols.ultimo_seq and len(cols) < total:
+            nuevas = TradeColumns.desde_trades(cargar(cols.ultimo_seq), cols.activos)
+            cols = cols.concatenar(nuevas)
+            self.cargas_parciales += 1
+        if cols is None or cols.ultimo_seq != ultimo or len(cols) != total:
+            cols = TradeColumns.desde_trades(cargar(None))
+            self.cargas_completas += 1
+
+        with self._lock:
+            self._datos[user_id] = cols
+            self._datos.move_to_end(user_id)
+            while len(self._datos) > self.max_usuarios:
+                self._datos.popitem(last=False)
+        return cols
+
+
+# Instancia única del proceso
+trade_columns_cache = TradeColumnsCache()
@@ -0,0 +1,132 @@
+import json
+import queue
+import threading
+import time
+
+# --- DIFUSIÓN DE PRECIOS EN VIVO (PUB/SUB) ---
+# Un solo hilo "upstream" por símbolo consulta el precio (pasando por la caché de
+# cotizaciones) y lo reparte a todos los navegadores suscritos. 500 personas
+# mirando BTC/USD = 1 consulta cada pocos segundos, no 500.
+# El hilo nace con el primer suscriptor y muere cuando se va el último.
+# Otras fuentes (ej. un WebSocket del exchange) pueden publicar directamente con publish().
+
+INTERVALOS_DEFAULT = {"crypto": 2.0, "yahoo": 15.0}
+
+
+class _Suscripcion:
+    def __init__(self, hub, clave):
+        self.hub = hub
+        self.clave = clave
+        # Cola corta: si el navegador va lento descartamos precios viejos, nunca acumulamos
+        self.cola = queue.Queue(maxsize=8)
+
+    def entregar(self, evento):
+        while True:
+            try:
+                self.cola.put_nowait(evento)
+                return
+            except queue.Full:
+                try: self.cola.get_nowait()
+                except queue.Empty: pass
+
+    def siguiente(self, timeout):
+        """Próximo evento o None si no llegó nada en 'timeout' segundos."""
+        try:
+            return self.cola.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def cerrar(self):
+        self.hub.unsubscribe(self)
+
+
+class PriceHub:
+
+    def __init__(self, intervalos=None):
+        self.intervalos = dict(INTERVALOS_DEFAULT, **(intervalos or {}))
+        self._suscriptores = {}  # (source, symbol) -> set(_Suscripcion)
+        self._ultimo = {}        # (source, symbol) -> evento más reciente
+        self._hilos = {}         # (source, symbol) -> Thread
+        self._fuentes = {}       # (source, symbol) -> fetch_fn
+        self._lock = threading.Lock()
+        self.upstream_fetches = 0
+
+    def subscribe(self, source, symbol, fetch_fn=None):
+        """
+        Suscribe a (source, symbol). Si nadie estaba mirando ese símbolo y se da
+        fetch_fn() -> precio, arranca el hilo que lo consulta periódicamente.
+        """
+        clave = (source, symbol)
+        sub = _Suscripcion(self, clave)
+        with self._lock:
+            self._suscriptores.setdefault(clave, set()).add(sub)
+            if fetch_fn is not None: self._fuentes.setdefault(clave, fetch_fn)
+            if clave in self._ultimo: sub.entregar(self._ultimo[clave])
+            if clave in self._fuentes and clave not in self._hilos:
+                hilo = threading.Thread(target=self._sondear, args=(clave,), name=f"price-{symbol}", daemon=True)
+                self._hilos[clave] = hilo
+                hilo.start()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._suscriptores.get(sub.clave)
+            if subs is None: return
+            subs.discard(sub)
+            if not subs:
+                # Sin audiencia: el hilo upstream lo detecta y termina
+                del self._suscriptores[sub.clave]
+                self._fuentes.pop(sub.clave, None)
+
+    def publish(self, source, symbol, price, ts=None):
+        """Reparte un precio nuevo a todos los suscriptores del símbolo."""
+        clave = (source, symbol)
+        evento = {"symbol": symbol, "source": source, "price": price, "ts": ts or time.time()}
+        with self._lock:
+            self._ultimo[clave] = evento
+            subs = list(self._suscriptores.get(clave, ()))
+        for sub in subs:
+            sub.entregar(evento)
+
+    def _sondear(self, clave):
+        source, symbol = clave
+        anterior = None
+        try:
+            while True:
+                with self._lock:
+                    fetch_fn = self._fuentes.get(clave)
+                if fetch_fn is None: return
+                try:
+                    precio = fetch_fn()
+                    self.upstream_fetches += 1
+                    if precio and precio != anterior:
+                        self.publish(source, symbol, precio)
+                        anterior = precio
+                except Exception as e:
+                    print(f"Error en stream de {symbol}: {e}")
+                time.sleep(self.intervalos.get(source, 5.0))
+        finally:
+            with self._lock:
+                self._hilos.pop(clave, None)
+                # Si alguien se suscribió justo mientras salíamos, relanzamos
+                if clave in self._fuentes and clave not in self._hilos:
+                    hilo = threading.Thread(target=self._sondear, args=(clave,), name=f"price-{symbol}", daemon=True)
+                    self._hilos[clave] = hilo
+                    hilo.start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "symbols": {f"{s}:{sym}": len(subs) for (s, sym), subs in self._suscriptores.items()},
+                "upstream_threads": len(self._hilos),
+                "upstream_fetches": self.upstream_fetches,
+            }
+
+
+def sse(evento):
+    """Formato Server-Sent Events."""
+    return f"data: {json.dumps(evento)}\n\n"
+
+
+# Instancia única del proceso
+price_hub = PriceHub()
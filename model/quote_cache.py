@@ -0,0 +1,215 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+# --- TTL POR DEFECTO (segundos) ---
+# Kraken se mueve cada segundo, Yahoo (acciones/forex) tiene retraso de todos modos.
+# Se pueden sobreescribir con variables de entorno: QUOTE_TTL_CRYPTO, QUOTE_TTL_YAHOO...
+DEFAULT_TTLS = {
+    "crypto": 5.0,
+    "yahoo": 30.0,
+}
+
+
+class _Vuelo:
+    """Una petición en curso. Los demás hilos esperan su resultado (single-flight)."""
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.valor = None
+        self.error = None
+
+
+class QuoteCache:
+    """
+    Caché de cotizaciones compartida por todo el proceso.
+    - Clave: (source, symbol), ej: ('crypto', 'BTC/USD').
+    - TTL configurable por fuente.
+    - Expulsión LRU cuando se supera 'max_entradas'.
+    - Single-flight: si 10 hilos piden BTC/USD a la vez, sólo uno va a la red.
+    """
+
+    def __init__(self, ttls=None, max_entradas=512, ttl_default=10.0):
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls: self.ttls.update(ttls)
+        self.ttl_default = ttl_default
+        self.max_entradas = max_entradas
+
+        self._datos = OrderedDict()  # (source, symbol) -> (valor, guardado_en)
+        self._vuelos = {}            # (source, symbol) -> _Vuelo
+        self._lock = threading.Lock()
+
+        # Contadores para dimensionar la caché bajo carga
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    def _ttl(self, source):
+        return self.ttls.get(source, self.ttl_default)
+
+    def _guardar(self, clave, valor):
+        """Inserta/actualiza la entrada y aplica LRU. Llamar con el lock tomado."""
+        self._datos[clave] = (valor, time.monotonic())
+        self._datos.move_to_end(clave)
+        while len(self._datos) > self.max_entradas:
+            self._datos.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_fetch(self, source, symbol, fetch_fn):
+        """
+        Devuelve el precio en caché si está fresco. Si no, llama a fetch_fn()
+        una sola vez aunque haya varios hilos pidiendo el mismo símbolo.
+        Si la red falla y había un valor viejo, devolvemos el viejo.
+        """
+        clave = (source, symbol)
+        ahora = time.monotonic()
+
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada and (ahora - entrada[1]) < self._ttl(source):
+                self._datos.move_to_end(clave)
+                self.hits += 1
+                return entrada[0]
+
+            if entrada: self.stale += 1
+            else: self.misses += 1
+
+            vuelo = self._vuelos.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = _Vuelo()
+                self._vuelos[clave] = vuelo
+            else:
+                self.coalesced += 1
+
+        # Los seguidores esperan al líder
+        if not lider:
+            vuelo.evento.wait()
+            if vuelo.error is not None:
+                if entrada: return entrada[0]
+                raise vuelo.error
+            return vuelo.valor
+
+        # El líder va a la red (sin el lock tomado)
+        try:
+            valor = fetch_fn()
+            with self._lock:
+                self._guardar(clave, valor)
+            vuelo.valor = valor
+            return valor
+        except Exception as e:
+            vuelo.error = e
+            if entrada: return entrada[0]
+            raise
+        finally:
+            with self._lock:
+                self._vuelos.pop(clave, None)
+            vuelo.evento.set()
+
+    def get_many(self, source, symbols, fetch_many_fn):
+        """
+        Versión por lotes: sirve de la caché lo que esté fresco y pide el resto
+        en UNA sola llamada a fetch_many_fn(lista) -> {symbol: precio}.
+        Los símbolos que otro hilo ya está pidiendo se esperan (single-flight).
+        Los que fallen se omiten del resultado (o se devuelve el valor viejo).
+        """
+        resultado, viejos, propios, ajenos = {}, {}, {}, {}
+        ahora = time.monotonic()
+
+        with self._lock:
+            for symbol in dict.fromkeys(symbols):
+                clave = (source, symbol)
+                entrada = self._datos.get(clave)
+                if entrada and (ahora - entrada[1]) < self._ttl(source):
+                    self._datos.move_to_end(clave)
+                    self.hits += 1
+                    resultado[symbol] = entrada[0]
+                    continue
+
+                if entrada:
+                    self.stale += 1
+                    viejos[symbol] = entrada[0]
+                else:
+                    self.misses += 1
+
+                vuelo = self._vuelos.get(clave)
+                if vuelo is None:
+                    vuelo = _Vuelo()
+                    self._vuelos[clave] = vuelo
+                    propios[symbol] = vuelo
+                else:
+                    self.coalesced += 1
+                    ajenos[symbol] = vuelo
+
+        if propios:
+            precios, error = {}, None
+            try:
+                precios = fetch_many_fn(list(propios)) or {}
+            except Exception as e:
+                error = e
+                print(f"Error en lote de precios ({source}): {e}")
+
+            with self._lock:
+                for symbol, vuelo in propios.items():
+                    if symbol in precios:
+                        self._guardar((source, symbol), precios[symbol])
+                        vuelo.valor = precios[symbol]
+                    else:
+                        vuelo.error = error or KeyError(symbol)
+                    self._vuelos.pop((source, symbol), None)
+
+            for symbol, vuelo in propios.items():
+                vuelo.evento.set()
+                if vuelo.error is None: resultado[symbol] = vuelo.valor
+                elif symbol in viejos: resultado[symbol] = viejos[symbol]
+
+        for symbol, vuelo in ajenos.items():
+            vuelo.evento.wait()
+            if vuelo.error is None: resultado[symbol] = vuelo.valor
+            elif symbol in viejos: resultado[symbol] = viejos[symbol]
+
+        return resultado
+
+    def invalidate(self, source=None, symbol=None):
+        """Borra una entrada concreta o toda la caché."""
+        with self._lock:
+            if source is None:
+                self._datos.clear()
+            else:
+                self._datos.pop((source, symbol), None)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses + self.stale
+            return {
+                "entries": len(self._datos),
+                "max_entries": self.max_entradas,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "ttls": dict(self.ttls),
+            }
+
+
+def _ttls_desde_entorno():
+    ttls = {}
+    for source in DEFAULT_TTLS:
+        valor = os.environ.get(f"QUOTE_TTL_{source.upper()}")
+        if valor:
+            try: ttls[source] = float(valor)
+            except ValueError: print(f"QUOTE_TTL_{source.upper()} inválido: {valor}")
+    return ttls
+
+
+# Instancia única del proceso (como 'db' en firebase_config)
+quote_cache = QuoteCache(
+    ttls=_ttls_desde_entorno(),
+    max_entradas=int(os.environ.get("QUOTE_CACHE_SIZE", 512))
+)
@@ -0,0 +1,125 @@
+import threading
+import time
+import pandas as pd
+import yfinance as yf
+
+# --- TABLA DE TASAS (PIVOTE USD) PARA EL CONVERSOR ---
+# Todas las monedas/activos del conversor se cotizan contra USD en UNA sola
+# descarga de Yahoo. Convertir es entonces: dos búsquedas en un dict y una división.
+
+CRYPTO = ['BTC', 'ETH', 'SOL', 'ADA', 'DOGE', 'USDT']
+# Yahoo cotiza la mayoría como USDXXX=X (cuántas unidades por 1 dólar) -> hay que invertir
+FOREX_INVERSO = ['COP', 'MXN', 'ARS', 'BRL', 'CLP', 'PEN', 'UYU', 'VES', 'KRW', 'CNY', 'INR', 'RUB', 'CAD', 'JPY']
+# EUR, GBP, AUD, CHF se cotizan directo (EURUSD=X); si no hay dato probamos el inverso
+FOREX_DIRECTO = ['EUR', 'GBP', 'AUD', 'CHF']
+
+# Si la primera descarga falla, no se reintenta en cada conversión sino cada tantos segundos
+REINTENTO_SEGUNDOS = 30
+
+
+def plan_yahoo(codigo):
+    """Lista de (ticker_yahoo, invertir) a probar, en orden, para el precio de 1 'codigo' en USD."""
+    if codigo in CRYPTO: return [(f"{codigo}-USD", False)]
+    if codigo in FOREX_INVERSO: return [(f"USD{codigo}=X", True)]
+    if codigo in FOREX_DIRECTO: return [(f"{codigo}USD=X", False), (f"USD{codigo}=X", True)]
+    # Acción / commodity directa (EC, AAPL, GC=F...)
+    return [(codigo, False)]
+
+
+class RateSnapshot:
+    """Foto inmutable de precios en USD. Todas las conversiones de una respuesta usan la misma."""
+
+    def __init__(self, precios_usd, creado_en):
+        self.precios_usd = precios_usd
+        self.creado_en = creado_en
+
+    def age(self):
+        """Segundos desde que se descargaron las tasas."""
+        return time.time() - self.creado_en
+
+    def convert(self, amount, from_curr, to_curr):
+        """(total, tasa_cruzada). (0.0, 0.0) si falta alguna de las dos tasas."""
+        if from_curr == to_curr: return amount, 1.0
+        price_from = self.precios_usd.get(from_curr, 0.0)
+        price_to = self.precios_usd.get(to_curr, 0.0)
+        if not price_from or not price_to: return 0.0, 0.0
+        cross_rate = price_from / price_to
+        return amount * cross_rate, cross_rate
+
+
+class RateTable:
+    """
+    Mantiene en memoria la RateSnapshot más reciente y la refresca en segundo
+    plano cada 'intervalo' segundos (el hilo arranca con la primera consulta).
+    """
+
+    def __init__(self, codigos, intervalo=300):
+        self.codigos = list(codigos)
+        self.intervalo = intervalo
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._reintentar_en = 0.0   # time.monotonic() desde el que se vuelve a intentar la primera descarga
+
+    def _descargar(self):
+        tickers = sorted({t for c in self.codigos for t, _ in plan_yahoo(c)})
+        data = yf.download(tickers, period="5d", interval="1d", progress=False, group_by='column', auto_adjust=False)
+        ultimos = {}
+        if data is None or data.empty: return ultimos
+        closes = data['Close']
+        if isinstance(closes, pd.Series): closes = closes.to_frame(tickers[0])
+        for ticker in tickers:
+            if ticker not in closes.columns: continue
+            serie = closes[ticker].dropna()
+            if not serie.empty and float(serie.iloc[-1]) > 0:
+                ultimos[ticker] = float(serie.iloc[-1])
+        return ultimos
+
+    def refresh(self):
+        """
+        Una descarga masiva -> nueva snapshot. Si un código falla conservamos su valor anterior.
+        Si no llegó NINGUNA tasa se lanza ValueError y la snapshot anterior sigue publicada
+        (una con sólo USD, marcada como recién descargada, rompería el conversor).
+        """
+        ultimos = self._descargar()
+        if not ultimos: raise ValueError("Yahoo no devolvió ninguna tasa")
+        anterior = self._snapshot.precios_usd if self._snapshot else {}
+        precios = {'USD': 1.0}
+        for codigo in self.codigos:
+            if codigo == 'USD': continue
+            for ticker, invertir in plan_yahoo(codigo):
+                if ticker in ultimos:
+                    precios[codigo] = 1.0 / ultimos[ticker] if invertir else ultimos[ticker]
+                    break
+            else:
+                if codigo in anterior: precios[codigo] = anterior[codigo]
+        self._snapshot = RateSnapshot(precios, time.time())
+        return self._snapshot
+
+    def _loop(self):
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refrescando tasas: {e}")
+
+    def snapshot(self):
+        """
+        La snapshot actual. La primera vez descarga (bloquea) y arranca el refresco programado.
+        Si esa descarga falla devuelve una snapshot vacía y vieja (age() enorme), sin guardarla:
+        pasados REINTENTO_SEGUNDOS la siguiente consulta vuelve a intentarlo.
+        """
+        if self._snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    if time.monotonic() < self._reintentar_en: return RateSnapshot({'USD': 1.0}, 0.0)
+                    try:
+                        self.refresh()
+                    except Exception as e:
+                        print(f"Error descargando tasas: {e}")
+                        self._reintentar_en = time.monotonic() + REINTENTO_SEGUNDOS
+                        return RateSnapshot({'USD': 1.0}, 0.0)
+                    self._hilo = threading.Thread(target=self._loop, name="rate-table", daemon=True)
+                    self._hilo.start()
+        return self._snapshot
@@ -0,0 +1,289 @@
+import asyncio
+import itertools
+import threading
+import time
+import numpy as np
+import pandas as pd
+from model.candle_store import TIMEFRAME_MS
+
+# --- MERCADO Y BROKER SIMULADOS (EN PROCESO) ---
+# Implementan el subconjunto de ccxt / yfinance / Alpaca que usa la app, con
+# precios sacados de "cintas" (sintéticas o grabadas) y latencia configurable.
+# Sirven para pruebas de carga y benchmarks sin red ni rate limits:
+#   mercado = SimMarket({'BTC/USD': PriceTape.sintetica(60000)}, latencia=0.002)
+#   vm = MainViewModel(storage, market=mercado)
+#   broker = BrokerClient(api=SimBroker(mercado))
+
+PASO_MS = 60_000  # cada punto de la cinta es un cierre de 1 minuto
+
+
+class PriceTape:
+    """Serie de precios que se recorre en bucle. 'velocidad' = puntos por segundo real (0 = manual)."""
+
+    def __init__(self, precios, velocidad=1.0):
+        self.precios = np.asarray(precios, dtype=float)
+        if len(self.precios) == 0: raise ValueError("La cinta no tiene precios")
+        self.velocidad = velocidad
+        self._t0 = time.monotonic()
+        self._desplazamiento = 0
+
+    @classmethod
+    def sintetica(cls, precio_inicial, n=10_000, volatilidad=0.001, deriva=0.0, semilla=42, velocidad=1.0):
+        """Camino aleatorio geométrico reproducible (misma semilla -> mismos precios)."""
+        rng = np.random.default_rng(semilla)
+        retornos = rng.normal(deriva, volatilidad, n)
+        return cls(precio_inicial * np.exp(np.cumsum(retornos)), velocidad)
+
+    @classmethod
+    def desde_velas(cls, velas, velocidad=1.0):
+        """Cinta con los cierres de un array de velas [ts, o, h, l, c, v] (ej. del CandleStore)."""
+        return cls(np.asarray(velas, dtype=float)[:, 4], velocidad)
+
+    def indice(self):
+        avance = int((time.monotonic() - self._t0) * self.velocidad) if self.velocidad else 0
+        return (avance + self._desplazamiento) % len(self.precios)
+
+    def avanzar(self, n=1):
+        """Mueve la cinta a mano (pruebas deterministas con velocidad=0)."""
+        self._desplazamiento += n
+
+    def precio(self):
+        return float(self.precios[self.indice()])
+
+    def ventana(self, n):
+        """Los últimos n precios hasta el actual (dando la vuelta si hace falta)."""
+        idx = np.arange(self.indice() - n + 1, self.indice() + 1) % len(self.precios)
+        return self.precios[idx]
+
+
+class _FastInfo:
+    def __init__(self, precio):
+        self.last_price = precio
+
+
+class _SimTicker:
+    """Lo que usa la app de yfinance.Ticker: fast_info.last_price e history()."""
+
+    def __init__(self, mercado, symbol):
+        self.mercado = mercado
+        self.symbol = symbol
+
+    @property
+    def fast_info(self):
+        return _FastInfo(self.mercado.fetch_ticker(self.symbol)['last'])
+
+    def history(self, period=None, start=None, interval='1d', **kwargs):
+        velas = self.mercado.fetch_ohlcv(self.symbol, interval, limit=500)
+        if start is not None:
+            desde = int(pd.Timestamp(start).timestamp() * 1000)
+            velas = [v for v in velas if v[0] >= desde]
+        indice = pd.to_datetime([v[0] for v in velas], unit='ms', utc=True)
+        return pd.DataFrame([v[1:] for v in velas], index=indice, columns=['Open', 'High', 'Low', 'Close', 'Volume'])
+
+
+class SimMarket:
+    """
+    Mercado simulado con interfaz de ccxt (fetch_ticker, fetch_tickers, fetch_ohlcv)
+    y de yfinance (Ticker, download). Todos los símbolos salen de 'cintas'.
+    """
+
+    def __init__(self, cintas, latencia=0.0, spread=0.0005):
+        self.cintas = dict(cintas)
+        self.latencia = latencia
+        self.spread = spread
+        self.llamadas = 0
+
+    def _cinta(self, symbol):
+        cinta = self.cintas.get(symbol) or self.cintas.get(symbol.replace('/', ''))
+        if cinta is None:
+            # Alpaca usa 'BTCUSD': buscamos la versión con '/'
+            for nombre, c in self.cintas.items():
+                if nombre.replace('/', '') == symbol: return c
+            raise KeyError(f"Símbolo sin cinta en el simulador: {symbol}")
+        return cinta
+
+    def _esperar(self):
+        self.llamadas += 1
+        if self.latencia: time.sleep(self.latencia)
+
+    # --- ccxt ---
+    def _ticker(self, symbol):
+        precio = self._cinta(symbol).precio()
+        medio = precio * self.spread / 2
+        return {"symbol": symbol, "last": precio, "bid": precio - medio, "ask": precio + medio,
+                "timestamp": int(time.time() * 1000)}
+
+    def fetch_ticker(self, symbol):
+        self._esperar()
+        return self._ticker(symbol)
+
+    def fetch_tickers(self, symbols=None):
+        self._esperar()
+        return {s: self._ticker(s) for s in (symbols or self.cintas)}
+
+    def fetch_ohlcv(self, symbol, timeframe='1h', since=None, limit=100):
+        self._esperar()
+        return self._ohlcv(symbol, timeframe, since, limit)
+
+    def _ohlcv(self, symbol, timeframe, since, limit):
+        """Velas armadas agrupando puntos de la cinta; la última termina en el precio actual."""
+        por_vela = max(1, TIMEFRAME_MS[timeframe] // PASO_MS)
+        limit = limit or 100
+        precios = self._cinta(symbol).ventana(limit * por_vela).reshape(limit, por_vela)
+        fin = (int(time.time() * 1000) // TIMEFRAME_MS[timeframe]) * TIMEFRAME_MS[timeframe]
+        velas = []
+        for j, grupo in enumerate(precios):
+            ts = fin - (limit - 1 - j) * TIMEFRAME_MS[timeframe]
+            if since is not None and ts < since: continue
+            velas.append([ts, float(grupo[0]), float(grupo.max()), float(grupo.min()), float(grupo[-1]), float(por_vela)])
+        return velas
+
+    def async_client(self):
+        """Versión con métodos async (para el MarketDataGateway)."""
+        return _AsyncSimMarket(self)
+
+    # --- yfinance ---
+    def Ticker(self, symbol):
+        return _SimTicker(self, symbol)
+
+    def download(self, symbols, **kwargs):
+        self._esperar()
+        cierres = pd.DataFrame({s: [self._cinta(s).precio()] for s in symbols},
+                               index=pd.DatetimeIndex([pd.Timestamp.now(tz='UTC')]))
+        return pd.concat({'Close': cierres}, axis=1)
+
+
+class _AsyncSimMarket:
+    """Mismos métodos que SimMarket pero awaitables, con la latencia como asyncio.sleep."""
+
+    def __init__(self, mercado):
+        self.mercado = mercado
+
+    async def _esperar(self):
+        self.mercado.llamadas += 1
+        if self.mercado.latencia: await asyncio.sleep(self.mercado.latencia)
+
+    async def fetch_ticker(self, symbol):
+        await self._esperar()
+        return self.mercado._ticker(symbol)
+
+    async def fetch_tickers(self, symbols=None):
+        await self._esperar()
+        return {s: self.mercado._ticker(s) for s in (symbols or self.mercado.cintas)}
+
+    async def fetch_ohlcv(self, symbol, timeframe='1h', since=None, limit=100):
+        await self._esperar()
+        return self.mercado._ohlcv(symbol, timeframe, since, limit)
+
+    async def close(self):
+        pass
+
+
+class _Objeto:
+    """Objeto con atributos (como las entidades de alpaca_trade_api)."""
+
+    def __init__(self, **campos):
+        self.__dict__.update(campos)
+
+
+class SimBroker:
+    """
+    Broker estilo Alpaca (submit_order, get_order, cancel_order, close_position,
+    get_latest_trade, get_account) que llena órdenes de mercado contra las cintas
+    de un SimMarket tras 'latencia_llenado' segundos.
+    Como Alpaca, una venta sólo se acepta si hay cantidad disponible (posición
+    menos lo ya comprometido en ventas abiertas): la posición nunca queda negativa.
+    """
+
+    def __init__(self, mercado, latencia_llenado=0.0, efectivo=100000.0):
+        self.mercado = mercado
+        self.latencia_llenado = latencia_llenado
+        self.efectivo = efectivo
+        self._ordenes = {}
+        self._posiciones = {}   # symbol -> qty
+        self._reservado = {}    # symbol -> qty comprometida en ventas abiertas
+        self._actividades = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _llenar_si_toca(self, orden):
+        """Llena la orden pendiente cuando ya pasó su latencia (al precio de ese momento)."""
+        if orden['status'] != 'new' or time.monotonic() < orden['llenar_en']: return
+        precio = self.mercado._cinta(orden['symbol']).precio()
+        qty = orden['qty'] if orden['qty'] is not None else orden['notional'] / precio
+        signo = 1 if orden['side'] == 'buy' else -1
+        if signo < 0: self._liberar(orden)
+        self._posiciones[orden['symbol']] = self._posiciones.get(orden['symbol'], 0.0) + signo * qty
+        self.efectivo -= signo * qty * precio
+        orden.update(status='filled', filled_avg_price=str(precio), filled_qty=str(qty),
+                     filled_at=time.time())
+        self._actividades.append(_Objeto(symbol=orden['symbol'], side=orden['side'], qty=qty, price=precio,
+                                         activity_type='FILL'))
+
+    def _vista(self, orden):
+        return _Objeto(**{k: v for k, v in orden.items() if k != 'llenar_en'})
+
+    def _disponible(self, symbol):
+        return self._posiciones.get(symbol, 0.0) - self._reservado.get(symbol, 0.0)
+
+    def _liberar(self, orden):
+        """Devuelve a 'disponible' lo que reservaba una venta (al llenarse o cancelarse)."""
+        self._reservado[orden['symbol']] = self._reservado.get(orden['symbol'], 0.0) - orden['qty']
+
+    def _crear_orden(self, symbol, side, type, qty, notional):
+        """Registra la orden (con el lock tomado). Las ventas reservan su cantidad."""
+        if side == 'sell':
+            if qty is None: raise Exception("sell orders require qty")
+            disponible = self._disponible(symbol)
+            if float(qty) > disponible + 1e-12:
+                raise Exception(f"insufficient qty available for order (requested: {qty}, available: {max(disponible, 0.0)})")
+            self._reservado[symbol] = self._reservado.get(symbol, 0.0) + float(qty)
+        orden = {"id": str(next(self._ids)), "symbol": symbol, "side": side, "type": type,
+                 "qty": float(qty) if qty is not None else None,
+                 "notional": float(notional) if notional is not None else None,
+                 "status": "new", "filled_avg_price": None, "filled_qty": "0",
+                 "llenar_en": time.monotonic() + self.latencia_llenado}
+        self._ordenes[orden['id']] = orden
+        self._llenar_si_toca(orden)
+        return self._vista(orden)
+
+    def submit_order(self, symbol, side, type='market', time_in_force='gtc', qty=None, notional=None, **kwargs):
+        self.mercado._esperar()
+        with self._lock:
+            return self._crear_orden(symbol, side, type, qty, notional)
+
+    def get_order(self, order_id):
+        self.mercado._esperar()
+        with self._lock:
+            orden = self._ordenes[order_id]
+            self._llenar_si_toca(orden)
+            return self._vista(orden)
+
+    def cancel_order(self, order_id):
+        with self._lock:
+            orden = self._ordenes[order_id]
+            if orden['status'] == 'new':
+                orden['status'] = 'canceled'
+                if orden['side'] == 'sell': self._liberar(orden)
+
+    def close_position(self, symbol):
+        """Vende todo lo disponible del símbolo. Leer y enviar van bajo el mismo lock."""
+        self.mercado._esperar()
+        with self._lock:
+            qty = self._disponible(symbol)
+            if qty <= 0: raise Exception(f"position does not exist: {symbol}")
+            return self._crear_orden(symbol, 'sell', 'market', qty, None)
+
+    def get_latest_trade(self, symbol):
+        self.mercado._esperar()
+        return _Objeto(p=self.mercado._cinta(symbol).precio(), t=time.time())
+
+    def get_activities(self, activity_types=None, direction='desc', page_size=50, **kwargs):
+        with self._lock:
+            lista = list(reversed(self._actividades)) if direction == 'desc' else list(self._actividades)
+        return lista[:page_size]
+
+    def get_account(self):
+        with self._lock:
+            valor = sum(q * self.mercado._cinta(s).precio() for s, q in self._posiciones.items())
+            return _Objeto(cash=self.efectivo, equity=self.efectivo + valor)
@@ -0,0 +1,474 @@
+import copy
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+# --- CAPA DE PERSISTENCIA INTERCAMBIABLE ---
+# DBService y BotService hablan con un StorageBackend usando rutas al estilo
+# de Realtime Database ("users/<uid>", "trade_log/<uid>/<key>"...).
+# Implementaciones:
+#   - FirebaseStorage: Pyrebase (con idToken) o Firebase Admin (segundo plano).
+#   - SQLiteStorage: archivo local en modo WAL, para paper trading masivo y
+#     pruebas de carga sin Firebase. STORAGE_BACKEND=sqlite lo activa.
+
+
+# --- PUSH IDs (mismo formato que Firebase: cronológicos y ordenables como texto) ---
+_PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+_push_lock = threading.Lock()
+_ultimo_push = [0, []]
+
+
+def generar_push_id():
+    with _push_lock:
+        ahora = int(time.time() * 1000)
+        duplicado = ahora <= _ultimo_push[0]
+        if duplicado:
+            ahora = _ultimo_push[0]
+        _ultimo_push[0] = ahora
+
+        prefijo = []
+        t = ahora
+        for _ in range(8):
+            prefijo.append(_PUSH_CHARS[t % 64])
+            t //= 64
+        prefijo.reverse()
+
+        if not duplicado:
+            _ultimo_push[1] = [random.randrange(64) for _ in range(12)]
+        else:
+            # Mismo milisegundo: incrementamos el sufijo para mantener el orden
+            aleatorio = _ultimo_push[1]
+            i = 11
+            while i >= 0 and aleatorio[i] == 63:
+                aleatorio[i] = 0
+                i -= 1
+            if i >= 0: aleatorio[i] += 1
+        return ''.join(prefijo) + ''.join(_PUSH_CHARS[n] for n in _ultimo_push[1])
+
+
+def _partes(path):
+    return [p for p in str(path).strip('/').split('/') if p]
+
+
+class StorageBackend(ABC):
+    """Interfaz mínima que usan los servicios. 'token' sólo lo usa Firebase."""
+
+    @abstractmethod
+    def get(self, path, token=None):
+        """Valor del nodo (dict, escalar) o None si no existe."""
+
+    @abstractmethod
+    def set(self, path, value, token=None):
+        """Reemplaza el nodo completo (None lo borra)."""
+
+    @abstractmethod
+    def update(self, path, values, token=None):
+        """Actualiza sólo las claves dadas. Las claves pueden ser rutas ("a/b": 1) -> escritura multi-ruta atómica."""
+
+    @abstractmethod
+    def remove(self, path, token=None):
+        """Borra el nodo."""
+
+    @abstractmethod
+    def update_if(self, path, comprobar, values, token=None):
+        """
+        Escritura condicional: aplica 'values' (rutas desde la raíz, que incluyen 'path')
+        sólo si comprobar(valor actual de 'path') es True. Devuelve False si no se cumplió
+        (otro proceso escribió antes): quien llama vuelve a leer y reintenta.
+        """
+
+    @abstractmethod
+    def query(self, path, order_by='$key', start_at=None, end_at=None, limit_to_first=None, limit_to_last=None, token=None):
+        """Hijos del nodo ordenados por clave ('$key') o por un campo hijo, como OrderedDict."""
+
+    def new_key(self):
+        """Clave nueva para un hijo (push id cronológico)."""
+        return generar_push_id()
+
+    def push(self, path, value, token=None):
+        """Agrega un hijo con clave automática y devuelve la clave."""
+        key = self.new_key()
+        self.set(f"{path}/{key}", value, token)
+        return key
+
+
+class FirebaseStorage(StorageBackend):
+    """
+    Realtime Database. 'factory' devuelve una raíz nueva en cada operación
+    (firebase.database de Pyrebase o un AdminDBAdapter): la raíz de Pyrebase
+    guarda la ruta en el propio objeto, así que compartirla entre hilos la corrompe.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def _nodo(self, path):
+        partes = _partes(path)
+        raiz = self.factory()
+        return raiz.child(*partes) if partes else raiz
+
+    def get(self, path, token=None):
+        return self._nodo(path).get(token=token).val()
+
+    def set(self, path, value, token=None):
+        if value is None: return self.remove(path, token)
+        self._nodo(path).set(value, token=token)
+
+    def update(self, path, values, token=None):
+        self._nodo(path).update(values, token=token)
+
+    def remove(self, path, token=None):
+        self._nodo(path).remove(token=token)
+
+    def update_if(self, path, comprobar, values, token=None):
+        # RTDB no admite condiciones en una escritura multi-ruta: el nodo 'path' se escribe
+        # con su ETag (compare-and-set) y, si ganó, el resto en una sola escritura.
+        # Si esa segunda escritura fallara, el nodo ya escrito no cuadra con el resto y
+        # quien lo lee lo detecta (ej. el ledger se verifica contra el trade_log).
+        path = '/'.join(_partes(path))
+        resto = {'/'.join(_partes(k)): v for k, v in values.items()}
+        nuevo = resto.pop(path)
+        actual = self._nodo(path).get_etag(token=token)
+        if not comprobar(actual['value']): return False
+        resultado = self._nodo(path).conditional_set(nuevo, actual['ETag'], token=token)
+        if isinstance(resultado, dict) and 'ETag' in resultado: return False  # 412: cambió entre medio
+        if resto: self.update("", resto, token)
+        return True
+
+    def push(self, path, value, token=None):
+        resultado = self._nodo(path).push(value, token=token)
+        return resultado.get('name') if isinstance(resultado, dict) else None
+
+    def query(self, path, order_by='$key', start_at=None, end_at=None, limit_to_first=None, limit_to_last=None, token=None):
+        consulta = self._nodo(path)
+        consulta = consulta.order_by_key() if order_by == '$key' else consulta.order_by_child(order_by)
+        if start_at is not None: consulta = consulta.start_at(start_at)
+        if end_at is not None: consulta = consulta.end_at(end_at)
+        if limit_to_first is not None: consulta = consulta.limit_to_first(limit_to_first)
+        if limit_to_last is not None: consulta = consulta.limit_to_last(limit_to_last)
+        val = consulta.get(token=token).val()
+        return OrderedDict(val) if val else OrderedDict()
+
+
+class SQLiteStorage(StorageBackend):
+    """
+    Almacén embebido. Cada nodo de segundo nivel ("users/<uid>", "bot_settings/<uid>"...)
+    es una fila JSON; el trade_log tiene su propia tabla indexada por (user_id, timestamp)
+    y (user_id, seq) para que las consultas por rango no lean todo el historial.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._local = threading.local()
+        carpeta = os.path.dirname(os.path.abspath(ruta))
+        os.makedirs(carpeta, exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS nodos (
+                    coleccion TEXT NOT NULL,
+                    clave TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (coleccion, clave)
+                );
+                CREATE TABLE IF NOT EXISTS trade_log (
+                    user_id TEXT NOT NULL,
+                    trade_key TEXT NOT NULL,
+                    timestamp TEXT,
+                    data TEXT NOT NULL,
+                    seq INTEGER,
+                    PRIMARY KEY (user_id, trade_key)
+                );
+                CREATE INDEX IF NOT EXISTS idx_trade_log_user_ts ON trade_log (user_id, timestamp);
+            """)
+            # Bases creadas antes de la columna 'seq'
+            columnas = [c[1] for c in conn.execute("PRAGMA table_info(trade_log)")]
+            if 'seq' not in columnas:
+                conn.execute("ALTER TABLE trade_log ADD COLUMN seq INTEGER")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_trade_log_user_seq ON trade_log (user_id, seq)")
+
+    def _conn(self):
+        """Una conexión por hilo (sqlite3 no comparte conexiones entre hilos)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.ruta, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --- NODOS GENÉRICOS (documento JSON + subruta dentro del documento) ---
+    @staticmethod
+    def _navegar(doc, subruta):
+        for p in subruta:
+            if not isinstance(doc, dict) or p not in doc: return None
+            doc = doc[p]
+        return doc
+
+    @staticmethod
+    def _asignar(doc, subruta, value):
+        """Asigna value en doc[subruta] (None borra). Devuelve el doc resultante o None si quedó vacío."""
+        if not subruta: return value if value not in ({}, None) else None
+        doc = doc if isinstance(doc, dict) else {}
+        hijo = SQLiteStorage._asignar(doc.get(subruta[0]), subruta[1:], value)
+        if hijo is None: doc.pop(subruta[0], None)
+        else: doc[subruta[0]] = hijo
+        return doc or None
+
+    def _leer_doc(self, conn, coleccion, clave):
+        fila = conn.execute("SELECT data FROM nodos WHERE coleccion = ? AND clave = ?", (coleccion, clave)).fetchone()
+        return json.loads(fila[0]) if fila else None
+
+    def _escribir_doc(self, conn, coleccion, clave, doc):
+        if doc is None:
+            conn.execute("DELETE FROM nodos WHERE coleccion = ? AND clave = ?", (coleccion, clave))
+        else:
+            conn.execute("INSERT OR REPLACE INTO nodos (coleccion, clave, data) VALUES (?, ?, ?)",
+                         (coleccion, clave, json.dumps(doc)))
+
+    # --- TRADE LOG ---
+    def _leer_trades(self, conn, user_id):
+        filas = conn.execute("SELECT trade_key, data FROM trade_log WHERE user_id = ? ORDER BY trade_key", (user_id,))
+        trades = OrderedDict((k, json.loads(d)) for k, d in filas)
+        return trades or None
+
+    def _escribir_trade(self, conn, user_id, key, trade):
+        if trade is None:
+            conn.execute("DELETE FROM trade_log WHERE user_id = ? AND trade_key = ?", (user_id, key))
+        else:
+            es_dict = isinstance(trade, dict)
+            conn.execute("INSERT OR REPLACE INTO trade_log (user_id, trade_key, timestamp, seq, data) VALUES (?, ?, ?, ?, ?)",
+                         (user_id, key, trade.get('timestamp') if es_dict else None,
+                          trade.get('seq') if es_dict else None, json.dumps(trade)))
+
+    # --- OPERACIONES ---
+    def _get(self, conn, partes):
+        if not partes:
+            raise ValueError("No se puede leer la raíz completa")
+        coleccion = partes[0]
+
+        if coleccion == 'trade_log':
+            if len(partes) == 1:
+                usuarios = [u for (u,) in conn.execute("SELECT DISTINCT user_id FROM trade_log")]
+                return {u: self._leer_trades(conn, u) for u in usuarios} or None
+            if len(partes) == 2:
+                return self._leer_trades(conn, partes[1])
+            fila = conn.execute("SELECT data FROM trade_log WHERE user_id = ? AND trade_key = ?", (partes[1], partes[2])).fetchone()
+            return self._navegar(json.loads(fila[0]), partes[3:]) if fila else None
+
+        if len(partes) == 1:
+            filas = conn.execute("SELECT clave, data FROM nodos WHERE coleccion = ?", (coleccion,))
+            return {k: json.loads(d) for k, d in filas} or None
+        return self._navegar(self._leer_doc(conn, coleccion, partes[1]), partes[2:])
+
+    def _set(self, conn, partes, value):
+        if len(partes) < 2:
+            # Colección completa: sólo soportamos borrarla o reemplazarla hijo por hijo
+            coleccion = partes[0]
+            if coleccion == 'trade_log': conn.execute("DELETE FROM trade_log")
+            else: conn.execute("DELETE FROM nodos WHERE coleccion = ?", (coleccion,))
+            for clave, hijo in (value or {}).items():
+                self._set(conn, [coleccion, clave], hijo)
+            return
+
+        coleccion, clave = partes[0], partes[1]
+        if coleccion == 'trade_log':
+            if len(partes) == 2:
+                conn.execute("DELETE FROM trade_log WHERE user_id = ?", (clave,))
+                for key, trade in (value or {}).items():
+                    self._escribir_trade(conn, clave, key, trade)
+            elif len(partes) == 3:
+                self._escribir_trade(conn, clave, partes[2], value)
+            else:
+                fila = conn.execute("SELECT data FROM trade_log WHERE user_id = ? AND trade_key = ?", (clave, partes[2])).fetchone()
+                trade = self._asignar(json.loads(fila[0]) if fila else None, partes[3:], value)
+                self._escribir_trade(conn, clave, partes[2], trade)
+            return
+
+        doc = self._asignar(self._leer_doc(conn, coleccion, clave), partes[2:], value)
+        self._escribir_doc(conn, coleccion, clave, doc)
+
+    def get(self, path, token=None):
+        return self._get(self._conn(), _partes(path))
+
+    def set(self, path, value, token=None):
+        with self._conn() as conn:
+            self._set(conn, _partes(path), value)
+
+    def update(self, path, values, token=None):
+        # Todo dentro de una transacción: o se aplican todas las rutas o ninguna
+        base = _partes(path)
+        with self._conn() as conn:
+            for subruta, value in values.items():
+                self._set(conn, base + _partes(subruta), value)
+
+    def remove(self, path, token=None):
+        self.set(path, None)
+
+    def update_if(self, path, comprobar, values, token=None):
+        # BEGIN IMMEDIATE toma el lock de escritura ANTES de leer: comprobar y escribir
+        # van en la misma transacción, ningún otro proceso puede colarse en medio
+        with self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if not comprobar(self._get(conn, _partes(path))): return False
+            for subruta, value in values.items():
+                self._set(conn, _partes(subruta), value)
+        return True
+
+    def query(self, path, order_by='$key', start_at=None, end_at=None, limit_to_first=None, limit_to_last=None, token=None):
+        partes = _partes(path)
+        conn = self._conn()
+
+        # Camino rápido: historial de un usuario, ordenado por clave, timestamp o seq (índice).
+        # Como en Firebase, los que no tienen el campo (NULL) van primero.
+        if len(partes) == 2 and partes[0] == 'trade_log' and order_by in ('$key', 'timestamp', 'seq'):
+            columna = 'trade_key' if order_by == '$key' else order_by
+            sql, args = f"SELECT trade_key, data FROM trade_log WHERE user_id = ?", [partes[1]]
+            if start_at is not None:
+                sql += f" AND {columna} >= ?"; args.append(start_at)
+            if end_at is not None:
+                sql += f" AND {columna} <= ?"; args.append(end_at)
+            if limit_to_last is not None:
+                sql += f" ORDER BY {columna} DESC, trade_key DESC LIMIT ?"; args.append(limit_to_last)
+                filas = list(conn.execute(sql, args))[::-1]
+            else:
+                sql += f" ORDER BY {columna}, trade_key"
+                if limit_to_first is not None:
+                    sql += " LIMIT ?"; args.append(limit_to_first)
+                filas = list(conn.execute(sql, args))
+            return OrderedDict((k, json.loads(d)) for k, d in filas)
+
+        # Resto: en memoria (colecciones pequeñas)
+        hijos = self._get(conn, partes) or {}
+        if not isinstance(hijos, dict): return OrderedDict()
+        clave_orden = (lambda kv: kv[0]) if order_by == '$key' else (lambda kv: (kv[1] or {}).get(order_by, ''))
+        items = sorted(hijos.items(), key=clave_orden)
+        if start_at is not None: items = [kv for kv in items if clave_orden(kv) >= start_at]
+        if end_at is not None: items = [kv for kv in items if clave_orden(kv) <= end_at]
+        if limit_to_first is not None: items = items[:limit_to_first]
+        if limit_to_last is not None: items = items[-limit_to_last:] if limit_to_last else []
+        return OrderedDict(items)
+
+
+# --- CACHÉ POR PETICIÓN (READ-THROUGH) ---
+def _relacionadas(a, b):
+    """True si una ruta es igual, ancestro o descendiente de la otra."""
+    return a == b or a.startswith(b + '/') or b.startswith(a + '/') or not a or not b
+
+
+class RequestCachedStorage(StorageBackend):
+    """
+    Envuelve otro backend y sirve desde memoria las lecturas repetidas de la
+    misma ruta DENTRO de una petición. 'obtener_cache' devuelve el dict de la
+    petición actual (en la web: flask.g) o None fuera de una petición, en cuyo
+    caso todo pasa directo al backend.
+    Las escrituras van siempre al backend y actualizan lo que hubiera en caché.
+    """
+
+    def __init__(self, backend, obtener_cache):
+        self.backend = backend
+        self.obtener_cache = obtener_cache
+
+    def new_key(self):
+        return self.backend.new_key()
+
+    def _cache(self):
+        return self.obtener_cache()
+
+    def _al_escribir(self, cache, path, value):
+        """Refleja en la caché la escritura 'value' en 'path' (None = borrado)."""
+        if cache is None: return
+        for clave in list(cache):
+            tipo, ruta = clave[0], clave[1]
+            if not _relacionadas(ruta, path): continue
+            if tipo == 'get' and ruta == path:
+                cache[clave] = copy.deepcopy(value)
+            elif tipo == 'get' and path.startswith(ruta + '/'):
+                # Ancestro en caché: aplicamos el cambio dentro de su valor
+                cache[clave] = SQLiteStorage._asignar(cache[clave], _partes(path[len(ruta) + 1:]), copy.deepcopy(value))
+            else:
+                # Descendientes y consultas afectadas: se vuelven a leer
+                del cache[clave]
+
+    def get(self, path, token=None):
+        cache, path = self._cache(), '/'.join(_partes(path))
+        if cache is None: return self.backend.get(path, token)
+        clave = ('get', path)
+        if clave not in cache:
+            cache[clave] = self.backend.get(path, token)
+        return copy.deepcopy(cache[clave])
+
+    def set(self, path, value, token=None):
+        self.backend.set(path, value, token)
+        cache, path = self._cache(), '/'.join(_partes(path))
+        self._al_escribir(cache, path, value)
+        if cache is not None: cache[('get', path)] = copy.deepcopy(value)
+
+    def update(self, path, values, token=None):
+        self.backend.update(path, values, token)
+        cache, base = self._cache(), _partes(path)
+        for subruta, value in values.items():
+            self._al_escribir(cache, '/'.join(base + _partes(subruta)), value)
+
+    def remove(self, path, token=None):
+        self.backend.remove(path, token)
+        self._al_escribir(self._cache(), '/'.join(_partes(path)), None)
+
+    def update_if(self, path, comprobar, values, token=None):
+        cache = self._cache()
+        if not self.backend.update_if(path, comprobar, values, token):
+            # Otro proceso cambió esa ruta: lo que hubiera en caché se vuelve a leer
+            if cache is not None:
+                path = '/'.join(_partes(path))
+                for clave in [c for c in cache if _relacionadas(c[1], path)]:
+                    del cache[clave]
+            return False
+        for subruta, value in values.items():
+            self._al_escribir(cache, '/'.join(_partes(subruta)), value)
+        return True
+
+    def push(self, path, value, token=None):
+        key = self.backend.push(path, value, token)
+        if key: self._al_escribir(self._cache(), '/'.join(_partes(path) + [key]), value)
+        return key
+
+    def query(self, path, order_by='$key', start_at=None, end_at=None, limit_to_first=None, limit_to_last=None, token=None):
+        cache, path = self._cache(), '/'.join(_partes(path))
+        params = (order_by, start_at, end_at, limit_to_first, limit_to_last)
+        if cache is None: return self.backend.query(path, *params, token=token)
+        clave = ('query', path, params)
+        if clave not in cache:
+            cache[clave] = self.backend.query(path, *params, token=token)
+        return copy.deepcopy(cache[clave])
+
+
+# --- BACKEND POR DEFECTO (según variables de entorno) ---
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_default_storage():
+    """
+    STORAGE_BACKEND=firebase (por defecto) usa Pyrebase con el idToken del usuario.
+    STORAGE_BACKEND=sqlite usa SQLITE_PATH (data/wallet_trainer.db).
+    """
+    global _default
+    with _default_lock:
+        if _default is None:
+            if os.environ.get('STORAGE_BACKEND', 'firebase').lower() == 'sqlite':
+                ruta = os.environ.get('SQLITE_PATH', os.path.join(
+                    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'wallet_trainer.db'))
+                _default = SQLiteStorage(ruta)
+                print(f"--- Persistencia local SQLite (WAL): {ruta} ---")
+            else:
+                from firebase_config import firebase
+                _default = FirebaseStorage(firebase.database)
+        return _default
+
+
+def is_local_storage():
+    return os.environ.get('STORAGE_BACKEND', 'firebase').lower() == 'sqlite'
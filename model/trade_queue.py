@@ -0,0 +1,72 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# --- COLA DE EJECUCIÓN DE ÓRDENES ---
+# Las órdenes de un MISMO usuario se ejecutan de una en una y en orden de llegada
+# (dos pestañas, o el bot más un clic, ya no leen el mismo saldo a la vez y gastan
+# dos veces). Las de usuarios DISTINTOS corren en paralelo en el pool de hilos.
+# Cada usuario con órdenes pendientes ocupa como mucho un hilo, y tras cada orden
+# cede el turno (re-encola) para que un usuario con muchas órdenes no acapare el pool.
+# Ojo: serializa dentro de ESTE proceso (web con su scheduler, o bot_worker.py).
+# Entre procesos protege el commit condicional del ledger (BotService.commit_trade).
+
+
+class TradeQueue:
+
+    def __init__(self, max_workers=8):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="trade")
+        self._colas = {}   # user_id -> deque de órdenes pendientes (la clave existe mientras hay una en curso)
+        self._lock = threading.Lock()
+        self.ejecutadas = 0
+        self.max_pendientes = 0
+
+    def submit(self, user_id, fn, *args, **kwargs):
+        """Encola fn(*args, **kwargs) en la fila del usuario -> Future con su resultado."""
+        futuro = Future()
+        with self._lock:
+            cola = self._colas.get(user_id)
+            lanzar = cola is None
+            if lanzar: cola = self._colas[user_id] = deque()
+            cola.append((futuro, fn, args, kwargs))
+            self.max_pendientes = max(self.max_pendientes, len(cola))
+        if lanzar: self.pool.submit(self._turno, user_id)
+        return futuro
+
+    def run(self, user_id, fn, *args, **kwargs):
+        """Versión bloqueante de submit()."""
+        return self.submit(user_id, fn, *args, **kwargs).result()
+
+    def _turno(self, user_id):
+        """Ejecuta UNA orden del usuario y, si le quedan más, vuelve a la cola del pool."""
+        with self._lock:
+            futuro, fn, args, kwargs = self._colas[user_id].popleft()
+        try:
+            if futuro.set_running_or_notify_cancel():
+                try:
+                    futuro.set_result(fn(*args, **kwargs))
+                except Exception as e:
+                    futuro.set_exception(e)
+        finally:
+            with self._lock:
+                self.ejecutadas += 1
+                seguir = bool(self._colas[user_id])
+                if not seguir: del self._colas[user_id]
+            if seguir: self.pool.submit(self._turno, user_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active_users": len(self._colas),
+                "pending": sum(len(c) for c in self._colas.values()),
+                "executed": self.ejecutadas,
+                "max_pending_per_user": self.max_pendientes,
+            }
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
+
+
+# Instancia única del proceso (hilos configurables por entorno)
+trade_queue = TradeQueue(max_workers=int(os.environ.get('TRADE_QUEUE_WORKERS', 8)))
@@ -1,25 +1,122 @@
 from model.auth_service import AuthService
 from model.db_service import DBService
-from model.bot_service import BotService
+from model.bot_service import BotService, INTENTOS_COMMIT
+from model.quote_cache import quote_cache
+from model import ledger
+from model.candle_store import CandleStore, candle_store
+from model.indicators import indicator_engine
+from model.rate_table import RateTable
+from model.http_session import firebase_latency
+from model.market_gateway import MarketDataGateway, market_gateway
+from model.price_stream import price_hub
+from model.kraken_feed import KrakenFeed
+from model.trade_queue import trade_queue
+from model import portfolio_analytics
+from model.portfolio_analytics import trade_columns_cache
+from model import backtest_engine, backtest_sweep
+import copy
 import datetime
 import os
+import tempfile
 import time
 import ccxt 
-import pandas as pd 
-import yfinance as yf
 import traceback
+import csv
+import io
+
+# Parquet es opcional (pip install pyarrow): sin él sólo se ofrece CSV
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Pares de Kraken que se reciben por WebSocket (los de _get_symbol_and_source)
+PARES_KRAKEN = ['BTC/USD', 'ETH/USD', 'SOL/USD', 'ADA/USD']
+
+# Historial en /performance: filas por página
+HISTORIAL_POR_PAGINA = 50
+
+# Reporte descargable: columnas y trades leídos/escritos por bloque
+REPORTE_COLUMNAS = ["key", "timestamp", "tipo", "activo", "cantidad", "precio_entrada", "total_operacion", "saldo_resultante", "pnl", "motivo"]
+REPORTE_CHUNK = 1000
+
+# Bots automáticos: velas de la señal y multiplicador de la cantidad base según el riesgo elegido
+BOT_TIMEFRAME = '1h'
+RIESGO_MULTIPLICADOR = {"bajo": 0.5, "medio": 1.0, "alto": 2.0}
+
+
+class _SalidaPorTrozos(io.RawIOBase):
+    """Archivo de sólo escritura que acumula bytes hasta que se drenan (para streaming)."""
 
-class MainViewModel:
     def __init__(self):
+        self._partes = []
+        self._pos = 0
+
+    def writable(self): return True
+
+    def write(self, b):
+        self._partes.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self): return self._pos
+
+    def drenar(self):
+        datos = b''.join(self._partes)
+        self._partes = []
+        return datos
+
+
+class MainViewModel:
+    def __init__(self, storage=None, market=None):
+        # 'market': mercado simulado (model.sim_exchange.SimMarket) para pruebas de carga sin red
         self.auth_service = AuthService()
-        self.db_service = DBService()
-        self.bot_service = BotService()
+        self.db_service = DBService(storage)
+        self.bot_service = BotService(storage)
+        # Recorridos del historial completo (analítica, reconstrucción del ledger): van
+        # directo al backend, sin pasar por la caché de la petición. Si no, cada bloque
+        # leído quedaría también guardado en flask.g y el historial estaría dos veces en memoria.
+        self.historial_service = BotService(getattr(self.bot_service.storage, 'backend', self.bot_service.storage))
         self.markets = self.db_service.get_markets()
+        self.quote_cache = quote_cache
+        self.market_gateway = market_gateway if market is None else MarketDataGateway(exchange=market.async_client(), yahoo=market)
+        self.price_hub = price_hub
+        # Órdenes serializadas por usuario, en paralelo entre usuarios
+        self.trade_queue = trade_queue
+        # Historial de trades en columnas NumPy por usuario (para la analítica de /performance)
+        self.trade_columns = trade_columns_cache
+        # Ticker/OHLC de Kraken en vivo (se conecta con start_market_feed)
+        self.kraken_feed = KrakenFeed(PARES_KRAKEN, hub=price_hub)
         
         # Cliente Crypto (Kraken) - Configurado para no bloquear IPs de EE.UU.
         self.exchange = ccxt.kraken({
             'enableRateLimit': True
-        })
+        }) if market is None else market
+
+        # Velas OHLCV compartidas por todo el proceso (piden a la red por el gateway)
+        if market is None:
+            self.candle_store = candle_store
+        else:
+            # Velas del simulador en una carpeta temporal (no se mezclan con las reales)
+            self.candle_store = CandleStore(gateway=self.market_gateway, directorio=tempfile.mkdtemp(prefix="sim_candles_"))
+        self.indicators = indicator_engine
+
+        # Tabla de tasas del conversor (todas las monedas soportadas contra USD)
+        codigos = [c for grupo in self.get_supported_currencies().values() for c in grupo]
+        self.rate_table = RateTable(codigos, intervalo=int(os.environ.get('RATE_TABLE_REFRESH_SECONDS', 300)))
+
+    def con_storage(self, storage):
+        """
+        El mismo ViewModel (mercado, velas, cotizaciones, tasas, feed de Kraken y cola
+        de órdenes compartidos) pero leyendo y escribiendo en otro almacenamiento.
+        El scheduler de bots dentro de la web lo usa con el Admin SDK, sin duplicar hilos.
+        """
+        vista = copy.copy(self)
+        vista.db_service = DBService(storage)
+        vista.bot_service = BotService(storage)
+        vista.historial_service = BotService(getattr(storage, 'backend', storage))
+        return vista
 
     # ==============================================================================
     # 1. GESTIÓN DE PRECIOS Y MERCADOS (ROUTER)
@@ -58,24 +155,88 @@ class MainViewModel:
         # Default
         return ('BTC/USD', 'crypto') 
 
+    def _fetch_price(self, symbol, source):
+        """Va a la red por el precio (vía gateway asíncrono, con timeout). Lanza excepción si falla."""
+        return self.market_gateway.run(self.market_gateway.quote(symbol, source))
+
+    def start_market_feed(self, replay=None, pausa=0.0):
+        """
+        Conecta el WebSocket de Kraken en el loop del gateway. Con 'replay' (ruta JSONL
+        de mensajes grabados) reproduce ese archivo en vez de conectarse (pruebas).
+        """
+        if replay:
+            return self.kraken_feed.start_replay(replay, pausa)
+        return self.kraken_feed.start(self.market_gateway)
+
     def get_real_price(self, asset_id):
-        """Obtiene el precio numérico exacto en tiempo real."""
+        """Obtiene el precio numérico exacto en tiempo real (WebSocket de Kraken o caché compartida)."""
         symbol, source = self._get_symbol_and_source(asset_id)
+        if source == 'crypto':
+            # Estado en memoria del WebSocket; si está caído seguimos por REST
+            precio = self.kraken_feed.price(symbol)
+            if precio: return precio
         try:
-            if source == 'crypto':
-                # Usamos Kraken para criptos
-                ticker = self.exchange.fetch_ticker(symbol)
-                return float(ticker['last'])
-            else:
-                # Usamos Yahoo Finance para acciones y forex
-                ticker = yf.Ticker(symbol)
-                # 'fast_info' es más rápido y fiable para el precio actual
-                price = ticker.fast_info.last_price
-                return float(price)
+            return self.quote_cache.get_or_fetch(source, symbol, lambda: self._fetch_price(symbol, source))
         except Exception as e:
             print(f"Error obteniendo precio para {symbol}: {e}")
             return 0.0
 
+    def _get_source_for_symbol(self, symbol):
+        """Los pares de Kraken llevan '/', todo lo demás (EC, EURUSD=X, GC=F) es Yahoo."""
+        return 'crypto' if '/' in symbol else 'yahoo'
+
+    def _fetch_prices_batch(self, source, symbols):
+        """Una sola llamada de red para varios símbolos de la misma fuente (fetch_tickers / yf.download)."""
+        return self.market_gateway.run(self.market_gateway.quotes_batch(source, symbols))
+
+    def get_real_prices(self, symbols):
+        """
+        Precios de varios símbolos de mercado (ej: ['BTC/USD', 'ETH/USD', 'EC'])
+        con UNA llamada por fuente, sin importar cuántas posiciones haya.
+        Devuelve {symbol: precio}; los que fallen no aparecen.
+        """
+        por_fuente, precios = {}, {}
+        for symbol in symbols:
+            if not symbol: continue
+            source = self._get_source_for_symbol(symbol)
+            en_vivo = self.kraken_feed.price(symbol) if source == 'crypto' else None
+            if en_vivo: precios[symbol] = en_vivo
+            else: por_fuente.setdefault(source, []).append(symbol)
+
+        # Cada fuente en paralelo (Kraken y Yahoo a la vez), cada una pasando por la caché
+        futuros = [
+            self.market_gateway.call(self.quote_cache.get_many, source, lista,
+                                     lambda faltan, src=source: self._fetch_prices_batch(src, faltan))
+            for source, lista in por_fuente.items()
+        ]
+        for futuro in futuros:
+            try:
+                precios.update(futuro.result())
+            except Exception as e:
+                print(f"Error obteniendo precios: {e}")
+        return precios
+
+    def get_real_price_async(self, asset_id):
+        """Como get_real_price pero sin bloquear: devuelve un Future con el precio (0.0 si falla)."""
+        return self.market_gateway.call(self.get_real_price, asset_id)
+
+    def subscribe_prices(self, asset_id):
+        """Suscripción al precio en vivo del activo (un solo sondeo compartido por todos los que miran)."""
+        symbol, source = self._get_symbol_and_source(asset_id)
+        return self.price_hub.subscribe(source, symbol, lambda: self.get_real_price(asset_id))
+
+    def get_quote_cache_stats(self):
+        """Contadores de la caché de precios (hits/misses/stale) para dimensionarla."""
+        return self.quote_cache.stats()
+
+    def get_trade_queue_stats(self):
+        """Usuarios con órdenes en curso, pendientes y ejecutadas de la cola de órdenes."""
+        return self.trade_queue.stats()
+
+    def get_firebase_latency_stats(self):
+        """Histograma de latencia de las llamadas REST a Firebase (por método y colección)."""
+        return firebase_latency.stats()
+
     # ==============================================================================
     # 2. GESTIÓN DE USUARIOS Y SALDO (ESTRICTO)
     # ==============================================================================
@@ -113,28 +274,53 @@ class MainViewModel:
             return user
         return None
 
+    # --- 📒 LIBRO CONTABLE (SNAPSHOT INCREMENTAL) ---
+    def rebuild_ledger(self, user_id, token):
+        """
+        Recalcula el snapshot completo desde el trade_log (sólo bajo demanda o si no cuadra).
+        De paso numera los trades antiguos que todavía no tienen 'seq'.
+        """
+        trade_log = self.historial_service.get_trade_log(user_id, token)
+        numerados = self.historial_service.asignar_seq_legado(user_id, trade_log, token)
+        if numerados: print(f"{numerados} trades antiguos de {user_id} numerados con 'seq'")
+        snapshot = ledger.reconstruir(trade_log)
+        self.bot_service.save_ledger(user_id, snapshot, token)
+        return snapshot
+
+    def get_ledger(self, user_id, token):
+        """
+        Devuelve el snapshot del usuario (efectivo, posiciones, costo).
+        Verificación barata: la clave del último trade (por 'seq') debe coincidir con
+        la última aplicada al snapshot. Si no, lo reconstruimos completo.
+        """
+        snapshot = self.bot_service.get_ledger(user_id, token)
+        if not snapshot:
+            return self.rebuild_ledger(user_id, token)
+        if int(snapshot.get('ultimo_seq') or 0) < int(snapshot.get('trade_count', 0)):
+            # Snapshot de antes de 'seq': hay trades sin numerar (una sola vez por usuario)
+            return self.rebuild_ledger(user_id, token)
+
+        try:
+            ultima_clave = self.bot_service.get_last_trade_key(user_id, token)
+        except Exception as e:
+            # Sin poder verificar (ej. falta ".indexOn": "seq") NO reconstruimos en cada
+            # petición: servimos el snapshot guardado y dejamos el error a la vista
+            print(f"⚠️ No se pudo verificar el ledger de {user_id}, se usa el guardado: {e}")
+            return snapshot
+        if ultima_clave != snapshot.get('last_trade_key'):
+            print(f"Ledger desincronizado para {user_id}, reconstruyendo...")
+            return self.rebuild_ledger(user_id, token)
+        return snapshot
+
     # --- ⚖️ CONCILIACIÓN BANCARIA (EL ARREGLO MÁGICO) ---
-    def _reconcile_balance(self, user_id, token):
+    def _reconcile_balance(self, user_id, token, snapshot=None):
         """
-        Recalcula el saldo EXACTO basándose en el historial de transacciones.
+        Saldo EXACTO según el libro contable.
         Saldo = 100,000 (Base) - Compras + Ventas.
         Esto elimina cualquier error de 'dinero infinito' o corrupción de datos.
         """
-        trade_log = self.bot_service.get_trade_log(user_id, token)
-        
-        saldo_calculado = 100000.0 # Siempre empezamos con 100k de base
-        
-        if trade_log:
-            trades = trade_log.values() if isinstance(trade_log, dict) else []
-            for trade in trades:
-                tipo = trade.get('tipo')
-                # Aseguramos que sea float
-                total = float(trade.get('total_operacion', 0))
-                
-                if tipo == 'COMPRA':
-                    saldo_calculado -= total
-                elif tipo == 'VENTA':
-                    saldo_calculado += total
+        if snapshot is None: snapshot = self.get_ledger(user_id, token)
+        saldo_calculado = float(snapshot.get('cash', ledger.SALDO_INICIAL))
         
         # Guardamos el saldo REAL calculado en la base de datos para sincronizar
         self.update_user_profile(user_id, {"saldo_virtual": saldo_calculado}, token)
@@ -150,53 +336,47 @@ class MainViewModel:
         # Si el campo de saldo no existe, lo creamos
         if 'saldo_virtual' not in profile:
             profile['saldo_virtual'] = 100000.0
-            self.db_service.save_user_profile(user_id, profile, token)
+            self.db_service.update_user_fields(user_id, {"saldo_virtual": 100000.0}, token)
             
         return profile
 
     def update_user_profile(self, user_id, data, token):
-        """Actualiza datos del perfil (incluyendo el saldo tras operar)."""
-        current_profile = self.db_service.get_user_profile(user_id, token)
-        if not current_profile: current_profile = {}
-        current_profile.update(data)
-        return self.db_service.save_user_profile(user_id, current_profile, token)
+        """Actualiza sólo los campos enviados del perfil (ej. el saldo), sin leerlo antes."""
+        return self.db_service.update_user_fields(user_id, data, token)
 
     # ==============================================================================
     # 3. LÓGICA DE TRADING (PAPER TRADING BLINDADO)
     # ==============================================================================
 
-    def _calculate_holdings(self, user_id, token, target_symbol):
+    def _calculate_holdings(self, user_id, token, target_symbol, snapshot=None):
         """
-        Calcula cuánto tienes realmente de un activo (Inventario).
-        Suma todas las compras y resta todas las ventas del historial.
+        Calcula cuánto tienes realmente de un activo (Inventario),
+        leyendo la posición del libro contable.
         """
-        trade_log = self.bot_service.get_trade_log(user_id, token)
-        if not trade_log: return 0.0
-
-        total_holding = 0.0
-        # Convertimos el diccionario de firebase a lista
-        trades = trade_log.values() if isinstance(trade_log, dict) else []
-        
-        for trade in trades:
-            # Solo miramos el activo que nos interesa (ej: BTC/USD)
-            if trade.get('activo') == target_symbol:
-                qty = float(trade.get('cantidad', 0))
-                
-                if trade.get('tipo') == 'COMPRA':
-                    total_holding += qty
-                elif trade.get('tipo') == 'VENTA':
-                    total_holding -= qty
-        
-        # Evitamos errores de redondeo negativo (ej: -0.0000001)
-        return max(0.0, total_holding)
+        if snapshot is None: snapshot = self.get_ledger(user_id, token)
+        return ledger.cantidad_en_cartera(snapshot, target_symbol)
 
-    def execute_manual_trade(self, user_id, token, asset_id, action, quantity=None):
+    def execute_manual_trade(self, user_id, token, asset_id, action, quantity=None, price=None):
         """
         Ejecuta una operación manual verificando saldo e inventario.
+        'price': precio ya obtenido (el bot lo pasa para no consultarlo una vez por usuario).
+        Pasa por la cola de ejecución: las órdenes del mismo usuario van de una en una.
+        """
+        return self.execute_manual_trade_async(user_id, token, asset_id, action, quantity, price).result()
+
+    def execute_manual_trade_async(self, user_id, token, asset_id, action, quantity=None, price=None):
+        """Como execute_manual_trade pero sin bloquear: Future con (success, message, saldo)."""
+        return self.trade_queue.submit(user_id, self._execute_trade, user_id, token, asset_id, action, quantity, price)
+
+    def _execute_trade(self, user_id, token, asset_id, action, quantity=None, price=None):
+        """
+        La operación en sí. Corre en la fila del usuario (TradeQueue) y fuera de la
+        petición web, así que el ledger se lee directo del almacenamiento, nunca de
+        una caché de la petición que otra orden ya haya dejado vieja.
         """
         try:
             # 1. OBTENER PRECIO REAL
-            current_price = self.get_real_price(asset_id)
+            current_price = price if price else self.get_real_price(asset_id)
             if current_price == 0: 
                 return False, "Mercado cerrado o sin conexión.", 0
 
@@ -212,48 +392,59 @@ class MainViewModel:
             # Calcular costo total de la operación
             total_value = current_price * quantity
             
-            # 3. OBTENER SALDO REAL (RECONCILIADO)
-            # Llamamos a _reconcile_balance para asegurarnos de tener el dinero real
-            current_balance = self._reconcile_balance(user_id, token)
-            
             symbol, _ = self._get_symbol_and_source(asset_id)
-            nuevo_saldo = current_balance
 
-            # 4. LÓGICA DE COMPRA (Restar Saldo)
-            if action == "COMPRA":
-                if current_balance < total_value:
-                    return False, f"Saldo insuficiente (${current_balance:,.2f}) para esta operación.", current_balance
+            # La fila del usuario (TradeQueue) sólo ordena dentro de este proceso: la web
+            # y bot_worker.py pueden operar la misma cuenta a la vez, así que el commit es
+            # condicional y ante un choque se repiten las validaciones con el ledger nuevo.
+            for _ in range(INTENTOS_COMMIT):
+                # 3. OBTENER SALDO REAL (DEL LIBRO CONTABLE)
+                # Un solo snapshot para saldo e inventario. No hace falta reconciliar el
+                # perfil aquí: el commit del trade reescribe el saldo junto con el ledger.
+                snapshot = self.get_ledger(user_id, token)
+                current_balance = float(snapshot.get('cash', ledger.SALDO_INICIAL))
+                nuevo_saldo = current_balance
+
+                # 4. LÓGICA DE COMPRA (Restar Saldo)
+                if action == "COMPRA":
+                    if current_balance < total_value:
+                        return False, f"Saldo insuficiente (${current_balance:,.2f}) para esta operación.", current_balance
                 
-                nuevo_saldo = current_balance - total_value
+                    nuevo_saldo = current_balance - total_value
             
-            # 5. LÓGICA DE VENTA (Sumar Saldo + Verificar Inventario)
-            elif action == "VENTA":
-                # Verificamos si realmente tienes el activo
-                holdings = self._calculate_holdings(user_id, token, symbol)
+                # 5. LÓGICA DE VENTA (Sumar Saldo + Verificar Inventario)
+                elif action == "VENTA":
+                    # Verificamos si realmente tienes el activo
+                    holdings = self._calculate_holdings(user_id, token, symbol, snapshot)
                 
-                if holdings < quantity:
-                    return False, f"No puedes vender {quantity} {symbol}. Solo tienes {holdings:.4f} en cartera.", current_balance
+                    if holdings < quantity:
+                        return False, f"No puedes vender {quantity} {symbol}. Solo tienes {holdings:.4f} en cartera.", current_balance
                 
-                nuevo_saldo = current_balance + total_value
-
-            # 6. GUARDAR NUEVO SALDO (Persistencia Inmediata)
-            self.update_user_profile(user_id, {"saldo_virtual": nuevo_saldo}, token)
-
-            # 7. GUARDAR REGISTRO DEL TRADE (Log)
-            trade_record = {
-                "tipo": action,
-                "activo": symbol,
-                "precio_entrada": float(current_price),
-                "cantidad": quantity,
-                "total_operacion": total_value,
-                "saldo_resultante": nuevo_saldo, # Guardamos el saldo histórico
-                "pnl": 0.0, # (Opcional) PnL realizado
-                "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "motivo": f"Manual: {quantity} unidades"
-            }
-            self.bot_service.record_trade(user_id, trade_record, token)
-
-            return True, f"Orden ejecutada: {action} {quantity} {symbol}", nuevo_saldo
+                    nuevo_saldo = current_balance + total_value
+
+                # 6. REGISTRO DEL TRADE (Log)
+                trade_record = {
+                    "tipo": action,
+                    "activo": symbol,
+                    "precio_entrada": float(current_price),
+                    "cantidad": quantity,
+                    "total_operacion": total_value,
+                    "saldo_resultante": nuevo_saldo, # Guardamos el saldo histórico
+                    "pnl": 0.0, # (Opcional) PnL realizado
+                    "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "motivo": f"Manual: {quantity} unidades"
+                }
+
+                # 7. COMMIT CONDICIONAL: trade + ledger + saldo del perfil, sólo si nadie
+                #    tocó el ledger desde que lo leímos (si no, se valida de nuevo con el nuevo)
+                resultado = self.bot_service.commit_trade(user_id, trade_record, snapshot, token)
+                if resultado is False: continue
+                if not resultado:
+                    return False, "No se pudo guardar la operación. Intenta de nuevo.", current_balance
+
+                return True, f"Orden ejecutada: {action} {quantity} {symbol}", nuevo_saldo
+
+            return False, "La cuenta está recibiendo otras órdenes. Intenta de nuevo.", current_balance
 
         except Exception as e:
             print(f"Error crítico en trading: {e}")
@@ -261,63 +452,106 @@ class MainViewModel:
             return False, f"Error del sistema: {str(e)}", 0
 
     def clear_trades(self, user_id, token):
-        """Borra el historial y reinicia el saldo a 100k."""
+        """Borra el historial y reinicia el saldo a 100k (en la fila del usuario, sin cruzarse con órdenes)."""
+        return self.trade_queue.run(user_id, self._clear_trades, user_id, token)
+
+    def _clear_trades(self, user_id, token):
         # 1. Borrar tabla de trades
         self.bot_service.clear_trade_log(user_id, token)
         # 2. Restaurar saldo a 100k exactos
         self.update_user_profile(user_id, {"saldo_virtual": 100000.0}, token)
+        # 3. Borrar el resumen del último backtest
+        self.bot_service.clear_backtest(user_id, token)
         return True
 
+    # --- 🧪 BACKTEST (REGLA DEL BOT SOBRE VELAS HISTÓRICAS) ---
+    def _backtest_inputs(self, user_id, token, timeframe, barras):
+        """Activo configurado del usuario, sus velas y la cantidad que usa el bot."""
+        settings = self.get_bot_settings_data(user_id, token)
+        asset_id = settings.get('activo', 'crypto_btc_usd')
+        symbol, source = self._get_symbol_and_source(asset_id)
+        velas = self.candle_store.get_candles(symbol, source, timeframe, barras)
+        # Misma cantidad que usa el bot automático
+        qty = 1.0 if source == 'yahoo' else 0.001
+        return symbol, velas, qty
+
+    def run_backtest(self, user_id, token, timeframe='1h', barras=17520):
+        """
+        Reproduce la regla SMA-14 ±0.2% del bot sobre el histórico del activo
+        configurado (hasta ~2 años de velas de 1h) y guarda el resumen para
+        mostrarlo en la página de rendimiento.
+        """
+        try:
+            symbol, velas, qty = self._backtest_inputs(user_id, token, timeframe, barras)
+            if len(velas) < 15:
+                print(f"Backtest: velas insuficientes para {symbol}")
+                return None
+
+            resultado = backtest_engine.run_sma_backtest(velas[:, 4], qty=qty)
+
+            summary = {
+                "activo": symbol,
+                "timeframe": timeframe,
+                "desde": datetime.datetime.fromtimestamp(velas[0, 0] / 1000).strftime("%Y-%m-%d %H:%M"),
+                "hasta": datetime.datetime.fromtimestamp(velas[-1, 0] / 1000).strftime("%Y-%m-%d %H:%M"),
+                "estrategia": "SMA 14 ±0.2%",
+                "cantidad": qty,
+                "barras": resultado['barras'],
+                "operaciones": resultado['operaciones'],
+                "compras": resultado['compras'],
+                "ventas": resultado['ventas'],
+                "equity_final": round(resultado['equity_final'], 2),
+                "pnl": round(resultado['pnl'], 2),
+                "retorno_pct": round(resultado['retorno_pct'], 4),
+                "buy_hold_pct": round(resultado['buy_hold_pct'], 2),
+                "max_drawdown_pct": round(resultado['max_drawdown_pct'], 4),
+                "curva": backtest_engine.reducir_curva(resultado['equity']),
+                "creado_en": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+            self.bot_service.save_backtest(user_id, summary, token)
+            return summary
+        except Exception as e:
+            print(f"Error en backtest: {e}")
+            traceback.print_exc()
+            return None
+
+    def run_backtest_sweep(self, user_id, token, grilla=None, timeframe='1h', barras=17520, top=20):
+        """
+        Barrido de parámetros (ventana SMA, bandas, período RSI) en paralelo.
+        Devuelve (tabla_ordenada, mensaje_error).
+        """
+        try:
+            symbol, velas, qty = self._backtest_inputs(user_id, token, timeframe, barras)
+            if len(velas) < 60:
+                return None, f"Velas insuficientes para {symbol}."
+            tabla = backtest_sweep.barrido(velas[:, 4], grilla, qty=qty)
+            return {"activo": symbol, "timeframe": timeframe, "barras": int(len(velas)),
+                    "combinaciones": len(tabla), "resultados": tabla[:top]}, None
+        except ValueError as e:
+            return None, str(e)
+        except Exception as e:
+            print(f"Error en barrido de parámetros: {e}")
+            traceback.print_exc()
+            return None, "Error del sistema al ejecutar el barrido."
+
     # ==============================================================================
     # 4. DATOS DE RENDIMIENTO Y PORTAFOLIO PRO (COMPLETO)
     # ==============================================================================
 
     def get_performance_data(self, user_id, token):
         """
-        Calcula todo el portafolio: Costo promedio, PnL no realizado, Gráficas.
+        Calcula todo el portafolio: Costo promedio, PnL no realizado, métricas de riesgo, Gráficas.
         """
         # Aseguramos que el saldo esté bien calculado antes de empezar
-        self._reconcile_balance(user_id, token)
-        
-        trade_log = self.bot_service.get_trade_log(user_id, token)
-        trade_list, labels_grafica, data_grafica = [], [], []
+        snapshot = self.get_ledger(user_id, token)
+        saldo_cash = self._reconcile_balance(user_id, token, snapshot)
         
+        # Inventario y costo promedio ya vienen calculados en el libro contable
         # Estructura para el portafolio: {'BTC/USD': {'qty': 0.5, 'total_cost': 25000.0}}
-        holdings = {} 
-        
-        profile = self.get_user_profile(user_id, token)
-        saldo_cash = float(profile.get('saldo_virtual', 100000.0))
+        holdings = ledger.posiciones_por_activo(snapshot)
         
-        if trade_log:
-            try: sorted_trades = sorted(trade_log.values(), key=lambda x: x.get('timestamp', ''))
-            except: sorted_trades = trade_log.values()
-            
-            for trade in sorted_trades:
-                trade_list.append(trade)
-                labels_grafica.append(trade.get('timestamp', '')[5:16]) 
-                # Graficamos la evolución del saldo en efectivo
-                data_grafica.append(trade.get('saldo_resultante', 0))
-                
-                # --- CÁLCULO DE INVENTARIO Y COSTO PROMEDIO ---
-                asset = trade.get('activo')
-                qty = float(trade.get('cantidad', 0))
-                price = float(trade.get('precio_entrada', 0))
-                tipo = trade.get('tipo')
-                
-                if asset not in holdings: 
-                    holdings[asset] = {'qty': 0.0, 'total_cost': 0.0}
-                
-                if tipo == 'COMPRA':
-                    holdings[asset]['qty'] += qty
-                    holdings[asset]['total_cost'] += (qty * price)
-                elif tipo == 'VENTA':
-                    # Al vender, reducimos el costo total proporcionalmente
-                    # Esto mantiene el precio promedio de lo que queda igual
-                    if holdings[asset]['qty'] > 0:
-                        avg_price = holdings[asset]['total_cost'] / holdings[asset]['qty']
-                        holdings[asset]['total_cost'] -= (qty * avg_price)
-                    
-                    holdings[asset]['qty'] -= qty
+        # La tabla sólo necesita la primera página del historial (la gráfica sale de la analítica)
+        trade_list, cursor = self.bot_service.get_trades_page(user_id, token, limit=HISTORIAL_POR_PAGINA)
 
         # Preparar datos para la vista (Gráfico de Dona y Tabla)
         portfolio_labels = ["Efectivo (USD)"]
@@ -325,6 +559,10 @@ class MainViewModel:
         total_equity = saldo_cash # Valor total de la cuenta (Cash + Acciones)
         lista_posiciones = [] 
 
+        # 1. Precios actuales de TODAS las posiciones abiertas (una llamada por fuente)
+        abiertos = [asset for asset, data in holdings.items() if asset and data['qty'] > 0.00001]
+        precios_actuales = self.get_real_prices(abiertos)
+
         for asset, data in holdings.items():
             qty = data['qty']
             cost_basis = data['total_cost']
@@ -332,15 +570,7 @@ class MainViewModel:
             # Solo mostramos activos donde tengas más de 0.00001 (para evitar residuos)
             if qty > 0.00001: 
                 try:
-                    # 1. Obtener Precio Actual Real (Intento de API)
-                    current_price = 0
-                    if "BTC" in asset: current_price = self.get_real_price("crypto_btc_usd")
-                    elif "ETH" in asset: current_price = self.get_real_price("crypto_eth_usd")
-                    elif "SOL" in asset: current_price = self.get_real_price("crypto_sol_usd")
-                    elif "EUR" in asset: current_price = self.get_real_price("forex_eur_usd")
-                    elif "EC" in asset: current_price = self.get_real_price("stock_ecopetrol")
-                    elif "CIB" in asset: current_price = self.get_real_price("stock_bancolombia")
-                    elif "AVAL" in asset: current_price = self.get_real_price("stock_aval")
+                    current_price = precios_actuales.get(asset, 0)
                     
                     # Fallback: si la API falla o no encuentra, usamos el precio de costo
                     if current_price == 0 and qty > 0: current_price = cost_basis / qty
@@ -372,15 +602,25 @@ class MainViewModel:
         # Ganancia Total histórica = Valor Total Hoy - 100k Iniciales
         ganancia_total = total_equity - 100000.0 
 
+        # Riesgo y curva de capital valorizada con velas (vectorizado sobre todo el historial)
+        analytics = self.get_portfolio_analytics(user_id, token, snapshot, precios_actuales)
+        if analytics:
+            labels_grafica, data_grafica = analytics['curva_labels'], analytics['curva_equity']
+        else:
+            labels_grafica, data_grafica = [], []
+
         stats = {
             "ganancia_total": round(ganancia_total, 2), 
-            "total_trades": len(trade_list),
+            "total_trades": int(snapshot.get('trade_count', len(trade_list))),
             "equity": total_equity 
         }
         
         return {
             "stats": stats, 
-            "all_trades": trade_list, 
+            "backtest": self.bot_service.get_backtest(user_id, token),
+            "analytics": analytics,
+            "trades": trade_list,
+            "trades_cursor": cursor, 
             "current_holdings": lista_posiciones, 
             "grafica_labels": labels_grafica, 
             "grafica_data": data_grafica,
@@ -388,10 +628,118 @@ class MainViewModel:
             "pie_data": portfolio_data
         }
 
+    def get_portfolio_analytics(self, user_id, token, snapshot=None, precios=None):
+        """
+        Drawdown, volatilidad, Sharpe/Sortino, win rate y PnL realizado/no realizado por
+        activo sobre TODO el historial. Las columnas del historial se cargan una vez por
+        usuario y sólo se leen los trades nuevos en las visitas siguientes (sin caché de
+        la petición: de cada bloque sólo quedan las columnas).
+        """
+        try:
+            if snapshot is None: snapshot = self.get_ledger(user_id, token)
+            cols = self.trade_columns.get(
+                user_id, snapshot,
+                lambda despues_de: self.historial_service.iter_trades(user_id, token, chunk=REPORTE_CHUNK, despues_de=despues_de))
+
+            # Precios de hoy sólo hacen falta para las posiciones abiertas
+            if precios is None:
+                abiertos = [a for a, d in ledger.posiciones_por_activo(snapshot).items() if a and d['qty'] > 0.00001]
+                precios = self.get_real_prices(abiertos)
+
+            def velas(symbol, timeframe, limite):
+                return self.candle_store.get_candles(symbol, self._get_source_for_symbol(symbol), timeframe, limite)
+
+            return portfolio_analytics.analizar(cols, velas, precios)
+        except Exception as e:
+            print(f"Error calculando analítica del portafolio: {e}")
+            traceback.print_exc()
+            return None
+
+    def get_trade_history(self, user_id, token, before=None, limit=HISTORIAL_POR_PAGINA):
+        """
+        Página del historial de órdenes (más recientes primero) para el botón 'Cargar más'.
+        'before': 'seq' del último trade mostrado (ValueError si no es un número).
+        """
+        limit = max(1, min(int(limit), 500))
+        before = int(before) if before is not None else None
+        trades, cursor = self.bot_service.get_trades_page(user_id, token, limit=limit, before_seq=before)
+        return {"trades": trades, "next_cursor": cursor}
+
+    # --- 📄 REPORTE DESCARGABLE (STREAMING) ---
+    def _rango_fechas(self, desde=None, hasta=None):
+        """'YYYY-MM-DD' -> límites de timestamp inclusivos. ValueError si la fecha no es válida."""
+        if desde: desde = datetime.datetime.strptime(desde, "%Y-%m-%d").strftime("%Y-%m-%d 00:00:00")
+        if hasta: hasta = datetime.datetime.strptime(hasta, "%Y-%m-%d").strftime("%Y-%m-%d 23:59:59")
+        return desde or None, hasta or None
+
+    def _filas_reporte(self, user_id, token, desde=None, hasta=None):
+        try:
+            for key, trade in self.historial_service.iter_trades(user_id, token, desde, hasta, chunk=REPORTE_CHUNK):
+                yield [key] + [trade.get(c) for c in REPORTE_COLUMNAS[1:]]
+        except Exception as e:
+            # Se propaga: mejor una descarga fallida que un reporte truncado que parece completo
+            print(f"Error leyendo el historial para el reporte: {e}")
+            raise
+
+    def generate_csv_report(self, user_id, token, desde=None, hasta=None):
+        """Generador de texto CSV por bloques: nunca tiene el historial completo en memoria."""
+        desde, hasta = self._rango_fechas(desde, hasta)
+
+        def generar():
+            buffer = io.StringIO()
+            escritor = csv.writer(buffer)
+            escritor.writerow(REPORTE_COLUMNAS)
+            for n, fila in enumerate(self._filas_reporte(user_id, token, desde, hasta), start=1):
+                escritor.writerow(fila)
+                if n % REPORTE_CHUNK == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+
+        return generar()
+
+    def generate_parquet_report(self, user_id, token, desde=None, hasta=None):
+        """
+        Generador de bytes Parquet: un row group por bloque de REPORTE_CHUNK trades.
+        Requiere pyarrow (opcional); devuelve None si no está instalado.
+        """
+        if pa is None: return None
+        desde, hasta = self._rango_fechas(desde, hasta)
+        esquema = pa.schema([
+            ("key", pa.string()), ("timestamp", pa.string()), ("tipo", pa.string()), ("activo", pa.string()),
+            ("cantidad", pa.float64()), ("precio_entrada", pa.float64()), ("total_operacion", pa.float64()),
+            ("saldo_resultante", pa.float64()), ("pnl", pa.float64()), ("motivo", pa.string()),
+        ])
+
+        def bloque(filas):
+            columnas = list(zip(*filas))
+            return pa.Table.from_arrays([pa.array(col, type=campo.type) for col, campo in zip(columnas, esquema)], schema=esquema)
+
+        def generar():
+            salida = _SalidaPorTrozos()
+            with pq.ParquetWriter(salida, esquema) as escritor:
+                filas = []
+                for fila in self._filas_reporte(user_id, token, desde, hasta):
+                    filas.append(fila)
+                    if len(filas) == REPORTE_CHUNK:
+                        escritor.write_table(bloque(filas))
+                        filas = []
+                        yield salida.drenar()
+                if filas: escritor.write_table(bloque(filas))
+            yield salida.drenar()
+
+        return generar()
+
     # ==============================================================================
     # 5. ANÁLISIS DE IA (HTML COMPLETO)
     # ==============================================================================
 
+    def _get_indicators(self, symbol, source, timeframe, barras):
+        """Valores actuales de RSI/SMA/EMA/MACD: sólo se procesan las velas nuevas (O(1) por vela)."""
+        velas = self.candle_store.get_candles(symbol, source, timeframe, barras)
+        return self.indicators.sync(symbol, timeframe, velas)
+
     def get_ai_analysis(self, user_id, token, asset_name):
         try:
             symbol, source = self._get_symbol_and_source(f"ai_{asset_name.lower()}")
@@ -402,37 +750,32 @@ class MainViewModel:
             if "eur" in asset_name.lower(): symbol, source = 'EURUSD=X', 'yahoo'
             if "oro" in asset_name.lower(): symbol, source = 'GC=F', 'yahoo'
 
-            df = pd.DataFrame()
-
-            # Obtención de datos históricos
+            # Indicadores precalculados sobre el almacén de velas compartido
+            # (120 velas para que las SMA 50 y la MACD estén bien calentadas)
             if source == 'crypto':
-                ohlcv = self.exchange.fetch_ohlcv(symbol, timeframe='4h', limit=50)
-                if not ohlcv: return "Datos insuficientes para análisis técnico."
-                df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+                ind = self._get_indicators(symbol, source, '4h', 120)
+                if ind['close'] is None: return "Datos insuficientes para análisis técnico."
             else:
-                ticker = yf.Ticker(symbol)
-                hist = ticker.history(period="1mo", interval="1d") 
-                if hist.empty: return "Mercado cerrado o datos no disponibles."
-                df = hist.reset_index()
-                df.rename(columns={'Close': 'close'}, inplace=True)
+                ind = self._get_indicators(symbol, source, '1d', 120)
+                if ind['close'] is None: return "Mercado cerrado o datos no disponibles."
 
-            current_price = df['close'].iloc[-1]
-            
-            # Cálculos Técnicos
-            delta = df['close'].diff()
-            gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-            loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-            rs = gain / loss
-            rsi = 100 - (100 / (1 + rs)).iloc[-1]
+            current_price = ind['close']
+            rsi = ind['rsi_14']
+            if rsi is None: return "Datos insuficientes para análisis técnico."
             
-            sma_short = df['close'].rolling(window=20).mean().iloc[-1]
-            sma_long = df['close'].rolling(window=50).mean().iloc[-1]
-            
-            tendencia = "ALCISTA 🟢" if sma_short > sma_long else "BAJISTA 🔴"
+            sma_short, sma_long = ind['sma_20'], ind['sma_50']
+            alcista = sma_short is not None and sma_long is not None and sma_short > sma_long
+            tendencia = "ALCISTA 🟢" if alcista else "BAJISTA 🔴"
             
             if rsi > 70: sentimiento = "SOBRECOMPRA ⚠️"
             elif rsi < 30: sentimiento = "SOBREVENTA 🚀"
             else: sentimiento = "NEUTRAL ⚖️"
+
+            macd = ind['macd']
+            if macd and macd['hist'] is not None:
+                macd_txt = f"{macd['macd']:,.4f} ({'CRUCE ALCISTA 🟢' if macd['hist'] > 0 else 'CRUCE BAJISTA 🔴'})"
+            else:
+                macd_txt = "N/D"
             
             # --- SALIDA DE TEXTO COMPLETA (HTML) ---
             analisis = f"""
@@ -441,10 +784,11 @@ class MainViewModel:
             Precio Actual: <strong>${current_price:,.2f}</strong><br>
             Tendencia (MA20/50): <strong>{tendencia}</strong><br>
             RSI (14): <strong>{round(rsi, 2)}</strong> ({sentimiento})<br>
+            MACD (12,26,9): <strong>{macd_txt}</strong><br>
             <br>
             <strong>Conclusión de la IA:</strong><br>
             El activo muestra una estructura {tendencia.split(' ')[0].lower()}. 
-            {'Los compradores mantienen el control.' if sma_short > sma_long else 'Presión de venta dominante.'}
+            {'Los compradores mantienen el control.' if alcista else 'Presión de venta dominante.'}
             {'Alerta de posible reversión por RSI alto.' if rsi > 70 else 'Posible zona de compra por RSI bajo.' if rsi < 30 else 'Zona de consolidación, esperar ruptura.'}
             """
             return analisis
@@ -459,12 +803,14 @@ class MainViewModel:
     def get_dashboard_data(self, user_id, token):
         try:
             # Conciliamos saldo SIEMPRE al entrar para asegurar matemáticas correctas
+            # (el bot automático ya no corre aquí: lo evalúa el BotScheduler en segundo plano)
             self._reconcile_balance(user_id, token)
-            self.check_bot_execution(user_id, token)
             
-            profile = self.get_user_profile(user_id, token)
             settings = self.get_bot_settings_data(user_id, token)
-            settings['current_price'] = self.get_real_price(settings.get('activo'))
+            # El precio se pide en paralelo mientras leemos el perfil
+            precio = self.get_real_price_async(settings.get('activo'))
+            profile = self.get_user_profile(user_id, token)
+            settings['current_price'] = precio.result()
             
             return {"profile": profile, "settings": settings}
         except: 
@@ -486,7 +832,7 @@ class MainViewModel:
     def change_email(self, t, e): return self.auth_service.change_email(t, e)
     def delete_profile(self, u, t): return self.db_service.delete_user_data(u, t)
     def forgot_password(self, e): return self.auth_service.reset_password(e)
-    def generate_mock_trades(self, u, t): return False
+    def generate_mock_trades(self, u, t): return self.run_backtest(u, t) is not None
 
     # --- BOT SETTINGS ---
     def get_bot_settings_data(self, u, t):
@@ -562,117 +908,109 @@ class MainViewModel:
             }
         }
 
-    def _get_usd_price(self, symbol):
-        """Obtiene el precio de 1 unidad del símbolo en USD."""
-        if symbol == 'USD': return 1.0
-        
-        # 1. Intentamos como Crypto (SYMBOL-USD)
-        if symbol in ['BTC', 'ETH', 'SOL', 'ADA', 'DOGE', 'USDT']:
-            try:
-                t = yf.Ticker(f"{symbol}-USD")
-                return t.fast_info.last_price
-            except: pass
-
-        # 2. Intentamos como Moneda Forex (USD/SYMBOL)
-        # Yahoo cotiza la mayoría así: USDCOP=X (cuántos pesos por 1 dólar)
-        # Entonces el precio de 1 Peso en dólares es 1 / Cotización
-        forex_pairs = ['COP', 'MXN', 'ARS', 'BRL', 'CLP', 'PEN', 'UYU', 'VES', 'KRW', 'CNY', 'INR', 'RUB', 'CAD', 'JPY']
-        if symbol in forex_pairs:
-            try:
-                t = yf.Ticker(f"USD{symbol}=X")
-                rate = t.fast_info.last_price
-                if rate > 0: return 1.0 / rate
-            except: pass
-            
-        # 3. Excepciones Forex Directas (EUR, GBP, AUD se cotizan al revés: EURUSD=X)
-        direct_forex = ['EUR', 'GBP', 'AUD', 'CHF'] # CHF a veces varía, pero probamos directo
-        if symbol in direct_forex:
-            try:
-                # Intento 1: Directo (EURUSD=X)
-                t = yf.Ticker(f"{symbol}USD=X")
-                return t.fast_info.last_price
-            except: 
-                # Intento 2: Inverso (USDCHF=X)
-                try:
-                    t = yf.Ticker(f"USD{symbol}=X")
-                    rate = t.fast_info.last_price
-                    if rate > 0: return 1.0 / rate
-                except: pass
+    def get_rate_snapshot(self):
+        """Foto actual de la tabla de tasas (pivote USD). Se refresca sola en segundo plano."""
+        return self.rate_table.snapshot()
 
-        # 4. Intentamos como Acción/Commodity directa
-        try:
-            t = yf.Ticker(symbol)
-            return t.fast_info.last_price
-        except:
-            return 0.0
-
-    def convert_currency_amount(self, amount, from_curr, to_curr):
+    def convert_currency_amount(self, amount, from_curr, to_curr, snapshot=None):
         """
         Convierte usando USD como puente universal.
         Formula: (Monto * Precio_Origen_en_USD) / Precio_Destino_en_USD
+        Los precios salen de la tabla en memoria: dos búsquedas y una división.
         """
         try:
             amount = float(amount)
-            if from_curr == to_curr: return amount, 1.0
-
-            # Paso 1: Obtener valor de ambos en Dólares
-            price_from_in_usd = self._get_usd_price(from_curr)
-            price_to_in_usd = self._get_usd_price(to_curr)
-
-            if price_from_in_usd == 0 or price_to_in_usd == 0:
-                return 0.0, 0.0
-
-            # Paso 2: Calcular tasa cruzada
+            if snapshot is None: snapshot = self.get_rate_snapshot()
             # Ejemplo: 1 AAPL ($200) a COP ($0.00023 USD/COP)
             # Tasa = 200 / 0.00023 = 869,565 COP por acción
-            cross_rate = price_from_in_usd / price_to_in_usd
-            
-            total = amount * cross_rate
-            return total, cross_rate
+            return snapshot.convert(amount, from_curr, to_curr)
 
         except Exception as e:
             print(f"Error conversión: {e}")
             return 0.0, 0.0
         
-    def check_bot_execution(self, user_id, token):
-        """ Bot automático simplificado. """
-        settings = self.get_bot_settings_data(user_id, token)
-        if not settings.get('isActive'): return
-        
-        asset_id = settings.get('activo', 'crypto_btc_usd')
+    def convert_batch(self, items, to_curr=None):
+        """
+        Convierte muchos (monto, desde, hasta) contra UNA misma foto de tasas,
+        así todos los resultados son coherentes entre sí.
+        Si se pasa 'to_curr', se usa como destino para todos los que no traigan 'to'.
+        Devuelve (resultados, total_en_destino_o_None, snapshot). El total sólo suma
+        las conversiones exitosas: si alguna falló es parcial (ver 'success' de cada una).
+        """
+        snapshot = self.get_rate_snapshot()
+        resultados = []
+        for item in items:
+            item = item if isinstance(item, dict) else {}
+            from_c = item.get('from')
+            to_c = item.get('to') or to_curr
+            result, rate = self.convert_currency_amount(item.get('amount'), from_c, to_c, snapshot)
+            resultados.append({
+                "amount": item.get('amount'),
+                "from": from_c,
+                "to": to_c,
+                "result": result,
+                "rate": rate,
+                "success": rate > 0
+            })
+
+        # Con un único destino tiene sentido sumar (ej: valor de toda la cartera en COP)
+        destinos = {r['to'] for r in resultados}
+        total = sum(r['result'] for r in resultados if r['success']) if len(destinos) == 1 else None
+        return resultados, total, snapshot
+
+    def get_active_bot_settings(self, token=None):
+        """{user_id: settings} de todos los bots con isActive = True."""
+        todos = self.bot_service.get_all_bot_settings(token)
+        return {uid: s for uid, s in todos.items() if isinstance(s, dict) and s.get('isActive')}
+
+    def bot_group(self, settings):
+        """Clave (symbol, source, timeframe) del bot: los usuarios con la misma clave comparten señal."""
+        symbol, source = self._get_symbol_and_source(settings.get('activo', 'crypto_btc_usd'))
+        return (symbol, source, BOT_TIMEFRAME)
+
+    def bot_signal(self, asset_id, timeframe=BOT_TIMEFRAME):
+        """
+        Señal del bot para un activo: ("COMPRA" | "VENTA" | "MANTENER", precio actual).
+        Sólo depende del mercado, así que se calcula UNA vez por símbolo y se reparte.
+        """
         symbol, source = self._get_symbol_and_source(asset_id)
+        current_price = self.get_real_price(asset_id)
+        if current_price == 0: return "MANTENER", 0.0
+
+        # SMA-14 precalculada sobre las velas compartidas
+        ind = self._get_indicators(symbol, source, timeframe, 30)
+        sma_14, last_close = ind['sma_14'], ind['close']
+        if sma_14 is None or last_close is None: return "MANTENER", current_price
+
+        accion = "MANTENER"
+        if last_close > (sma_14 * 1.002): accion = "COMPRA"
+        elif last_close < (sma_14 * 0.998): accion = "VENTA"
+        return accion, current_price
+
+    def _bot_quantity(self, settings, source):
+        """Cantidad por operación del usuario: la base del mercado escalada por su nivel de riesgo."""
+        base = 1.0 if source == 'yahoo' else 0.001
+        return base * RIESGO_MULTIPLICADOR.get(settings.get('riesgo'), 1.0)
+
+    def execute_bot_trade(self, user_id, token, settings, accion, precio):
+        """Ejecuta la señal ya calculada para un usuario concreto (su activo, su cantidad)."""
+        if accion == "MANTENER" or not precio: return False
+        asset_id = settings.get('activo', 'crypto_btc_usd')
+        _, source = self._get_symbol_and_source(asset_id)
+        qty = self._bot_quantity(settings, source)
+
+        # Ejecutamos usando la función segura, al precio de la señal
+        success, msg, _ = self.execute_manual_trade(user_id, token, asset_id, accion, quantity=qty, price=precio)
+        if success: print(f"🤖 Bot Trade ({user_id}): {msg}")
+        return success
+
+    def check_bot_execution(self, user_id, token, settings=None):
+        """ Bot automático de UN usuario (el BotScheduler agrupa por símbolo y usa bot_signal directamente). """
+        if settings is None: settings = self.get_bot_settings_data(user_id, token)
+        if not settings.get('isActive'): return
         
         try:
-            current_price = self.get_real_price(asset_id)
-            if current_price == 0: return
-            
-            df = pd.DataFrame()
-            if source == 'crypto':
-                ohlcv = self.exchange.fetch_ohlcv(symbol, timeframe='1h', limit=20)
-                df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-            else:
-                ticker = yf.Ticker(symbol)
-                hist = ticker.history(period="2d", interval="1h")
-                if hist.empty: return
-                df = hist.reset_index()
-                df.rename(columns={'Close': 'close'}, inplace=True)
-            
-            if df.empty: return
-            
-            sma_14 = df['close'].rolling(window=14).mean().iloc[-1]
-            last_close = df['close'].iloc[-1]
-            
-            accion = "MANTENER"
-            if last_close > (sma_14 * 1.002): accion = "COMPRA"
-            elif last_close < (sma_14 * 0.998): accion = "VENTA"
-            
-            if accion != "MANTENER":
-                # Cantidad pequeña para el bot automático
-                qty = 1.0 if source == 'yahoo' else 0.001
-                
-                # Ejecutamos usando la función segura
-                success, msg, _ = self.execute_manual_trade(user_id, token, asset_id, accion, quantity=qty)
-                if success: print(f"🤖 Bot Trade: {msg}")
-                
+            accion, precio = self.bot_signal(settings.get('activo', 'crypto_btc_usd'))
+            self.execute_bot_trade(user_id, token, settings, accion, precio)
         except Exception as e:
-            print(f"Bot error: {e}")
\ No newline at end of file
+            print(f"Bot error: {e}")